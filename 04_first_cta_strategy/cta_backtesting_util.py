@@ -3,10 +3,13 @@ import pandas as pd
 from vnpy_ctastrategy.backtesting import BacktestingEngine
 from vnpy.trader.constant import Interval, Offset, Direction
 
+from future_data.bar_cache import install_bar_cache
 from strategies.macd_hist_strategy import MacdHistStrategy
 
 
 def main():
+    # 使用本地缓存加载历史数据，重复回测时无需再从数据库读取
+    install_bar_cache()
     start = pd.to_datetime("20150101",
                            format='%Y%m%d %H:%M:%S.%f').tz_localize("Asia/Shanghai")
 
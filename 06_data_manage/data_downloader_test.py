@@ -1,4 +1,4 @@
-from future_data.data_downloader import download_data_from_rq
+from future_data.backfill_task import backfill
 import time
 
 start = "2022-05-01 00:00:00"
@@ -9,5 +9,5 @@ end = time.strftime(TIME_FORMAT, time.localtime())
 # security_codes = ["MA8888","SA8888","fu8888","m8888","TA8888","i8888","y8888","au8888","FG8888","al8888"]  # XSGE
 security_codes = ["TA209.CZCE" ]  # XSGE
 if __name__ == '__main__':
-    for security_code in security_codes:
-        download_data_from_rq(security_code, start, end)
+    # 按月分段下载并记录断点，中断后重新执行即可从断点继续
+    print(backfill(security_codes, start, end))
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+from peewee import chunked
+from vnpy.trader.constant import Exchange, Interval
+from vnpy.trader.object import BarData
+
+from future_data.bar_resample import DbResampledBar
+from future_data.bar_trading_day import DbBarTradingDay
+from future_data.data_downloader import save_bar, bar_to_row, update_bar_overview
+from future_data.db_pool import DbBarData, DbBarOverview
+from util.benchmark_util import bind_models_to_sqlite, timed
+
+
+def make_bars(symbol: str, size: int):
+    start = datetime(2020, 1, 2, 9, 0)
+    return [BarData(gateway_name="DB", symbol=symbol, exchange=Exchange.SHFE,
+                    datetime=start + timedelta(minutes=i), interval=Interval.MINUTE,
+                    volume=100 + i % 50, open_interest=10000, open_price=3000 + i % 7,
+                    high_price=3010, low_price=2990, close_price=3001)
+            for i in range(size)]
+
+
+def legacy_save_bar(bars):
+    """原写入方式：每200条调用一次save_bar_data，每次都重新统计overview"""
+    for sub_bars in chunked(bars, 200):
+        rows = [bar_to_row(bar) for bar in sub_bars]
+        with DbBarData._meta.database.atomic():
+            for c in chunked(rows, 50):
+                DbBarData.insert_many(c).on_conflict_replace().execute()
+        update_bar_overview(rows[0]["symbol"], rows[0]["exchange"], rows[0]["interval"],
+                            rows[0]["datetime"], rows[-1]["datetime"])
+
+
+def benchmark(size: int = 50000, path: str = ":memory:"):
+    """
+    对比原写入方式与批量upsert的吞吐量，默认使用sqlite代替MySQL
+    如需测试MySQL，不调用bind_models_to_sqlite即可
+    """
+    if path is not None:
+        bind_models_to_sqlite([DbBarData, DbBarOverview, DbBarTradingDay, DbResampledBar], path)
+    _, cost = timed(legacy_save_bar, make_bars("legacy", size))
+    print("legacy 200/chunk: %.0f bars/sec" % (size / cost))
+    for batch_size in [200, 1000, 5000]:
+        _, cost = timed(save_bar, make_bars("bulk%s" % batch_size, size), batch_size=batch_size)
+        print("bulk batch_size=%s: %.0f bars/sec" % (batch_size, size / cost))
+    # 重复写入相同数据，即upsert覆盖的场景
+    _, cost = timed(save_bar, make_bars("bulk1000", size), batch_size=1000)
+    print("bulk upsert existing rows: %.0f bars/sec" % (size / cost))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,63 @@
+import datetime
+import time
+
+import numpy as np
+import pandas as pd
+from vnpy.trader.constant import Exchange
+from vnpy.trader.object import BarData
+
+from future_data.tq_data_downloader import klines_to_bars, vnpy_frequency
+
+
+def make_klines(size: int = 100000) -> pd.DataFrame:
+    """生成与天勤get_kline_serial格式一致的模拟k线"""
+    start = pd.Timestamp("2020-01-02 09:00:00", tz="Asia/Shanghai").value
+    close = 3000 + np.cumsum(np.random.randn(size))
+    return pd.DataFrame({
+        "datetime": (start + np.arange(size, dtype=np.int64) * 60 * 10 ** 9).astype(np.float64),
+        "open": close + np.random.randn(size),
+        "high": close + 2,
+        "low": close - 2,
+        "close": close,
+        "volume": np.random.randint(1, 1000, size).astype(np.float64),
+        "open_oi": np.random.randint(10000, 20000, size).astype(np.float64),
+        "close_oi": np.random.randint(10000, 20000, size).astype(np.float64),
+    })
+
+
+def convert_by_iloc(klines: pd.DataFrame, symbol: str, exchange: Exchange):
+    """原逐行iloc转换方式，作为对照"""
+    bars = []
+    for i in range(len(klines)):
+        bar: BarData = BarData(gateway_name="TQ",
+                               symbol=symbol,
+                               exchange=exchange,
+                               datetime=datetime.datetime.fromtimestamp(klines.iloc[i]["datetime"] / 1e9),
+                               interval=vnpy_frequency,
+                               volume=klines.volume.iloc[i],
+                               open_price=klines.open.iloc[i],
+                               high_price=klines.high.iloc[i],
+                               low_price=klines.low.iloc[i],
+                               close_price=klines.close.iloc[i],
+                               open_interest=klines.close_oi.iloc[i])
+        bars.append(bar)
+    return bars
+
+
+def benchmark(size: int = 100000):
+    klines = make_klines(size)
+    start_time = time.perf_counter()
+    old_bars = convert_by_iloc(klines, "rb2301", Exchange.SHFE)
+    old_cost = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    new_bars = klines_to_bars(klines, "rb2301", Exchange.SHFE)
+    new_cost = time.perf_counter() - start_time
+    assert len(old_bars) == len(new_bars)
+    assert old_bars[0].datetime == new_bars[0].datetime and old_bars[-1].datetime == new_bars[-1].datetime
+    print("rows=%s" % size)
+    print("iloc:       %.2fs, %.0f rows/sec" % (old_cost, size / old_cost))
+    print("vectorized: %.2fs, %.0f rows/sec" % (new_cost, size / new_cost))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import tracemalloc
+
+from future_data.bar_resample import DbResampledBar
+from future_data.bar_trading_day import DbBarTradingDay
+from future_data.db_pool import DbBarData, DbBarOverview
+from future_data.tq_data_downloader import download_from_tq
+from util.benchmark_util import bind_models_to_sqlite, timed
+from util.fake_tq_api import FakeTqApi
+
+PRODUCTS = ["SHFE.rb", "SHFE.hc", "SHFE.au", "SHFE.ag", "DCE.i", "DCE.m", "DCE.y", "DCE.j", "CZCE.TA", "CZCE.MA"]
+
+
+def make_vt_symbols(count: int) -> list:
+    """生成count个vnpy格式的合约，按品种和月份依次组合"""
+    vt_symbols = []
+    month = 2301
+    while len(vt_symbols) < count:
+        for product in PRODUCTS:
+            exchange, code = product.split(".")
+            vt_symbols.append("%s%s.%s" % (code, month, exchange))
+            if len(vt_symbols) >= count:
+                break
+        month += 1
+    return vt_symbols
+
+
+def benchmark(symbol_counts=(1, 10, 50), size: int = 5000, latency: float = 0.2, workers: int = 4,
+              use_sqlite: bool = True):
+    """
+    使用FakeTqApi测试从下载到入库的端到端吞吐量(bars/sec)，不需要天勤账号和网络
+    默认每次测试使用新的sqlite文件，use_sqlite=False时写入vnpy配置的MySQL
+    :param latency: 每次请求模拟的网络耗时(秒)
+    """
+    for count in symbol_counts:
+        if use_sqlite:
+            path = os.path.join(tempfile.mkdtemp(), "bench.db")
+            bind_models_to_sqlite([DbBarData, DbBarOverview, DbBarTradingDay, DbResampledBar], path)
+        vt_symbols = make_vt_symbols(count)
+        _, cost = timed(download_from_tq, vt_symbols, size=size, workers=workers,
+                        api_factory=lambda: FakeTqApi(latency=latency))
+        print("symbols=%s, bars=%s, %.2fs, %.0f bars/sec" % (count, count * size, cost, count * size / cost))
+
+
+def benchmark_memory(sizes=(1000, 200000), symbol_count: int = 4):
+    """统计不同下载数量下写入过程的Python内存峰值，流式写入时峰值只与块大小和队列长度有关"""
+    for size in sizes:
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        bind_models_to_sqlite([DbBarData, DbBarOverview, DbBarTradingDay, DbResampledBar], path)
+        # FakeTqApi生成的k线在下载线程中创建，与天勤返回的DataFrame一样只包含numpy列
+        tracemalloc.start()
+        download_from_tq(make_vt_symbols(symbol_count), size=size, api_factory=FakeTqApi)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("size=%s, symbols=%s, peak=%.1fMB" % (size, symbol_count, peak / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    benchmark()
+    benchmark_memory()
@@ -0,0 +1,95 @@
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+from peewee import chunked
+from vnpy.trader.constant import Direction, Offset
+
+from future_data.trade_data import (DbTradeData, TradeStatus, get_last_trade, get_unclosed_trades,
+                                    get_unclosed_trades_of_strategy, migrate_trade_indexes)
+from util.benchmark_util import bind_models_to_sqlite, timed
+
+SYMBOLS = ["rb2301.SHFE", "i2301.DCE", "TA301.CZCE", "m2301.DCE", "IF2212.CFFEX", "ag2212.SHFE", "FG301.CZCE",
+           "MA301.CZCE", "y2301.DCE", "au2212.SHFE"]
+STRATEGIES = ["strategy_%s" % i for i in range(20)]
+
+
+def make_trade_rows(size: int, unclosed_percent: float = 0.001):
+    """生成模拟的多年成交记录，开平各半，约unclosed_percent的开仓未平仓(实盘中未平仓记录只占极少数)"""
+    random.seed(0)
+    start = datetime(2015, 1, 1)
+    for i in range(size):
+        offset = Offset.OPEN if i % 2 == 0 else Offset.CLOSE
+        unclosed = offset == Offset.OPEN and random.random() < unclosed_percent
+        yield {
+            "strategy_name": random.choice(STRATEGIES),
+            "capital": 1000000,
+            "gateway_name": "CTP",
+            "symbol": random.choice(SYMBOLS),
+            "exchange": "SHFE",
+            "orderid": str(i),
+            "tradeid": str(i),
+            "direction": random.choice([Direction.LONG.name, Direction.SHORT.name]),
+            "offset": offset.name,
+            "price": 3000 + random.random() * 100,
+            "volume": 1,
+            "closed_volume": 0 if unclosed else 1,
+            "status": TradeStatus.UN_CLOSED.value if unclosed else TradeStatus.CLOSED.value,
+            "datetime": start + timedelta(minutes=i * 4),
+        }
+
+
+def run_queries(rounds: int = 50):
+    """执行热点查询，返回每次查询的平均耗时(毫秒)"""
+    costs = {}
+    for name, func, args in [
+        ("get_unclosed_trades", get_unclosed_trades, (STRATEGIES[0], SYMBOLS[0], Direction.LONG.name)),
+        ("get_last_trade", get_last_trade, (STRATEGIES[0], SYMBOLS[0], Direction.SHORT.name)),
+        ("get_unclosed_trades_of_strategy", get_unclosed_trades_of_strategy, (STRATEGIES[0],)),
+    ]:
+        _, cost = timed(lambda: [func(*args) for _ in range(rounds)])
+        costs[name] = cost / rounds * 1000
+    return costs
+
+
+def explain(trade_db):
+    """输出热点查询的执行计划(sqlite)"""
+    query = DbTradeData.select().where(
+        DbTradeData.strategy_name == STRATEGIES[0], DbTradeData.symbol == SYMBOLS[0],
+        DbTradeData.direction == Direction.LONG.name, DbTradeData.status == TradeStatus.UN_CLOSED.value,
+        DbTradeData.offset == Offset.OPEN.name).order_by(DbTradeData.datetime.asc())
+    sql, params = query.sql()
+    for row in trade_db.execute_sql("EXPLAIN QUERY PLAN " + sql, params):
+        print("  ", row[-1])
+
+
+def benchmark(sizes=(100000, 1000000)):
+    """
+    在模拟的成交表上对比补建索引前后的查询耗时，默认使用sqlite文件代替MySQL
+    表中只有(strategy_name, tradeid)索引时查询耗时随数据量线性增长，补建索引后基本不变
+    """
+    for size in sizes:
+        path = os.path.join(tempfile.mkdtemp(), "trade_benchmark.db")
+        trade_db = bind_models_to_sqlite([DbTradeData], path)
+        # 模拟升级前的表，只保留原有索引
+        for index in trade_db.get_indexes(DbTradeData._meta.table_name):
+            if index.name != "dbtradedata_strategy_name_tradeid":
+                trade_db.execute_sql("DROP INDEX %s" % index.name)
+        with trade_db.atomic():
+            for rows in chunked(make_trade_rows(size), 5000):
+                DbTradeData.insert_many(rows).execute()
+        print("rows=%s" % size)
+        explain(trade_db)
+        for name, cost in run_queries().items():
+            print("  before, %s: %.3f ms" % (name, cost))
+        _, cost = timed(migrate_trade_indexes)
+        print("  migrate: %.1f s" % cost)
+        explain(trade_db)
+        for name, cost in run_queries().items():
+            print("  after, %s: %.3f ms" % (name, cost))
+        trade_db.close()
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,19 +1,24 @@
 import numpy as np
 import pandas as pd
-from vnpy_ctastrategy.backtesting import BacktestingEngine
-from vnpy.trader.constant import Interval, Offset, Direction
+from vnpy.trader.constant import Interval, Offset, Direction, Exchange
 
+from future_data.bar_cache import install_bar_cache
+from future_data.bar_store import MemmapBacktestingEngine, BarStore
 from strategies.macd_hist_strategy import MacdHistStrategy
 
 
 def main():
+    # 使用本地缓存加载历史数据，重复回测时无需再从数据库读取
+    install_bar_cache()
     start = pd.to_datetime("20100101",
                            format='%Y%m%d %H:%M:%S.%f').tz_localize("Asia/Shanghai")
 
     end = pd.to_datetime("20200101",
                          format='%Y%m%d %H:%M:%S.%f').tz_localize("Asia/Shanghai")
+    # 十年分钟线数据量较大，导入到本地定长文件后按需读取，避免一次性创建全部BarData
+    BarStore().build_from_database("rb8888", Exchange.SHFE, Interval.MINUTE)
     # 创建引擎,设置回测模式
-    engine = BacktestingEngine()
+    engine = MemmapBacktestingEngine()
     engine.log_output = True
     # 配置引擎参数
     original_capital = 1000000
@@ -6,6 +6,7 @@ import pandas as pd
 from vnpy.trader.constant import Interval
 from vnpy_portfoliostrategy import BacktestingEngine
 
+from future_data.bar_cache import install_bar_cache
 from future_data.portfolio_global_config import vt_settings_with_short_code, global_vt_settings
 from strategies.base_cta_strategy import GLOBAL_SETTINGS
 from strategies.macd_hist_portfolio_strategy import MacdHistPortfolioStrategy
@@ -19,6 +20,8 @@ LOSE = "lose"
 
 def get_portfolio_daily_pnl():
     GLOBAL_SETTINGS["BACK_TESTING_DATA_SAVE"] = False
+    # 使用本地缓存加载历史数据，重复回测时无需再从数据库读取
+    install_bar_cache()
     start = pd.to_datetime("20100101",
                            format='%Y%m%d %H:%M:%S.%f').tz_localize("Asia/Shanghai")
     end = pd.to_datetime("20200101",
@@ -2,14 +2,15 @@ import multiprocessing
 from datetime import datetime, time
 from datetime import timedelta
 
-from peewee import fn
 from vnpy_ctastrategy import CtaEngine
-from vnpy_mysql.mysql_database import DbBarData
 from vnpy.trader.utility import load_json, save_json
 from vnpy_portfoliostrategy import StrategyEngine
 
 from log.log_init import get_logger
-from util.main_contract_detector import get_main_contract
+from future_data.bar_trading_day import backfill_trading_days, count_trading_days
+from future_data.db_pool import DbBarData, connection
+from future_data.main_contract_cache import get_main_contract_cache
+from util.trading_period import get_trading_day
 from util.message_alert import ding_message
 from util.vt_symbol_util import split_vnpy_format
 
@@ -19,6 +20,11 @@ logger.info("test")
 KEY_POS = "pos"
 KEY_CAPITAL = "capital"
 KEYS_UNCHANGEABLE = [KEY_POS, KEY_CAPITAL, "vt_used_capital", "vt_used_unit"]
+# 新主力合约已入库的交易日数超过该值才换月
+# 原按自然日计数(6/11)，有夜盘的品种N个交易日约占N+1个自然日(首个夜盘在前一自然日)，
+# 改按交易日计数后各减1，多数品种的换月时点不变，无夜盘的品种提前一天
+CTA_DAY_LIMIT = 5
+PORTFOLIO_DAY_LIMIT = 10
 
 
 class AutoChangeMonthConfig:
@@ -31,7 +37,7 @@ class AutoChangeMonthConfig:
 
 def get_change_month_for_cta_test():
     config = AutoChangeMonthConfig(settings_file_path="test_" + CtaEngine.setting_filename,
-                                   data_file_path="test_" + CtaEngine.data_filename, day_limit=6)
+                                   data_file_path="test_" + CtaEngine.data_filename, day_limit=CTA_DAY_LIMIT)
     cta_task = AutoChangeMonthTask(
         times=[time(6, 0)], config=config
     )
@@ -40,7 +46,8 @@ def get_change_month_for_cta_test():
 
 def get_change_month_for_portfolio_test():
     config = AutoChangeMonthConfig(settings_file_path="test_" + StrategyEngine.setting_filename,
-                                   data_file_path="test_" + StrategyEngine.data_filename, day_limit=11)
+                                   data_file_path="test_" + StrategyEngine.data_filename,
+                                   day_limit=PORTFOLIO_DAY_LIMIT)
     cta_task = AutoChangeMonthTask(
         times=[time(6, 0)], config=config
     )
@@ -49,7 +56,7 @@ def get_change_month_for_portfolio_test():
 
 def get_change_month_for_cta():
     config = AutoChangeMonthConfig(settings_file_path=CtaEngine.setting_filename,
-                                   data_file_path=CtaEngine.data_filename, day_limit=6)
+                                   data_file_path=CtaEngine.data_filename, day_limit=CTA_DAY_LIMIT)
     cta_task = AutoChangeMonthTask(
         times=[time(6, 0)], config=config
     )
@@ -58,7 +65,7 @@ def get_change_month_for_cta():
 
 def get_change_month_for_portfolio():
     config = AutoChangeMonthConfig(settings_file_path=StrategyEngine.setting_filename,
-                                   data_file_path=StrategyEngine.data_filename, day_limit=11)
+                                   data_file_path=StrategyEngine.data_filename, day_limit=PORTFOLIO_DAY_LIMIT)
     cta_task = AutoChangeMonthTask(
         times=[time(17, 30)],
         config=config)
@@ -79,7 +86,7 @@ def run_child(config: AutoChangeMonthConfig):
                     vt_symbols.add(vt_symbol)
             # print(strategy_name)
             logger.info(setting)
-        new_main_contracts = get_main_contract(vt_symbols, include_the_same=False)
+        new_main_contracts = get_main_contract_cache().get_main_contract(vt_symbols, include_the_same=False)
         logger.info(new_main_contracts)
         if len(new_main_contracts) <= 0:
             logger.info("no change")
@@ -205,12 +212,17 @@ def change_settings_of_portfolio(strategy_name, strategy_setting, strategy_data,
 
 
 def get_days_of_bar_data(symbol) -> int:
-    """return days of vt_symbol, to determine whether to change code used in strategies"""
-    query = DbBarData.select(fn.count(fn.left(DbBarData.datetime, 10).distinct())) \
-        .where(DbBarData.symbol == symbol)
-    days = query.scalar()
-    print(query)
-    # print(days)
+    """已入库的交易日数，用于判断新主力合约的数据是否足够换月，与CTA_DAY_LIMIT/PORTFOLIO_DAY_LIMIT比较"""
+    with connection(DbBarData._meta.database):
+        # 汇总不完整时先按k线重建，否则只统计了汇总表上线后的交易日
+        backfill_trading_days(symbol)
+        days = count_trading_days(symbol)
+        if days is not None:
+            return days
+        # 没有该合约的overview记录，无法确认汇总是否完整，退回全表统计，同样按交易日计数
+        query = DbBarData.select(DbBarData.datetime).where(DbBarData.symbol == symbol).tuples()
+        days = len({get_trading_day(dt) for (dt,) in query})
+    logger.info("days of %s counted from bar data: %s" % (symbol, days))
     return days
 
 
@@ -243,14 +255,21 @@ class AutoChangeMonthTask:
             if self.done:
                 # self.logger.info("self.done")
                 return
-            child_process = multiprocessing.Process(target=run_child,
-                                                    args=(self.config,))
-            child_process.start()
-            child_process.join()
+            self.run_change_month()
             self.done = True
         except Exception as e:
             logger.error(e, stack_info=True, exc_info=True)
 
+    def run_change_month(self):
+        """立即执行一次换月检查，不检查任务时间，由auto_change_month或调度器调用"""
+        if self.config is None:
+            logger.info("self.settings_file_path is None")
+            return
+        child_process = multiprocessing.Process(target=run_child,
+                                                args=(self.config,))
+        child_process.start()
+        child_process.join()
+
 
 if __name__ == '__main__':
     task = get_change_month_for_cta_test()
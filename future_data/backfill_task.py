@@ -0,0 +1,125 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from vnpy.trader.constant import Exchange
+from vnpy.trader.utility import get_folder_path
+
+from future_data.data_downloader import (download_rq_range, to_rq_symbol, TIME_FORMAT, DEFAULT_CHUNK_DAYS,
+                                        DEFAULT_RQ_CONCURRENCY)
+from future_data.bar_quality import get_missing_ranges, scan_symbol
+from log.log_init import get_logger
+
+logger = get_logger()
+
+DEFAULT_PROCESSES = 4
+
+
+class BackfillCheckpoint:
+    """
+    单个合约历史数据回补的断点，每段数据入库后保存下一段的开始时间
+    回补的开始时间变化时断点失效，结束时间延长时从断点继续
+    """
+
+    def __init__(self, vt_symbol: str, checkpoint_dir: str = None):
+        checkpoint_dir = checkpoint_dir if checkpoint_dir is not None else str(get_folder_path("backfill"))
+        self.path = os.path.join(checkpoint_dir, "%s.json" % vt_symbol)
+
+    def load(self, start: datetime):
+        """返回断点记录的(下一段开始时间, 已下载k线数)，无可用断点时返回(None, 0)"""
+        if not os.path.exists(self.path):
+            return None, 0
+        with open(self.path, "r") as f:
+            data = json.load(f)
+        if data.get("start") != start.strftime(TIME_FORMAT):
+            return None, 0
+        return datetime.strptime(data["next_start"], TIME_FORMAT), data.get("total", 0)
+
+    def save(self, start: datetime, next_start: datetime, total: int):
+        # 先写临时文件再替换，中断时不会留下损坏的断点
+        tmp_path = "%s.%s.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump({"start": start.strftime(TIME_FORMAT), "next_start": next_start.strftime(TIME_FORMAT),
+                       "total": total}, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def backfill_symbol(vt_symbol: str, start: datetime, end: datetime, chunk_days: int = DEFAULT_CHUNK_DAYS,
+                    checkpoint_dir: str = None, concurrency: int = DEFAULT_RQ_CONCURRENCY) -> int:
+    """回补单个合约[start, end]的分钟线，从上次的断点继续，返回本次下载的k线数"""
+    checkpoint = BackfillCheckpoint(vt_symbol, checkpoint_dir)
+    resume_start, saved_total = checkpoint.load(start)
+    chunk_start = start if resume_start is None else resume_start
+    if chunk_start >= end:
+        logger.info("backfill already done, %s, end=%s" % (vt_symbol, end))
+        return 0
+    if resume_start is not None:
+        logger.info("backfill resumed, %s, from=%s" % (vt_symbol, resume_start))
+    symbol, exchange = to_rq_symbol(vt_symbol)
+    totals = [saved_total]
+
+    def on_chunk(_, chunk_end: datetime, count: int):
+        totals[0] += count
+        checkpoint.save(start, chunk_end, totals[0])
+
+    count = download_rq_range(symbol, exchange, chunk_start, end, chunk_days=chunk_days, on_chunk=on_chunk,
+                              concurrency=concurrency)
+    logger.info("backfill done, %s, count=%s, total=%s" % (vt_symbol, count, totals[0]))
+    return count
+
+
+def backfill(vt_symbols: list, start, end, chunk_days: int = DEFAULT_CHUNK_DAYS, processes: int = DEFAULT_PROCESSES,
+             checkpoint_dir: str = None, concurrency: int = DEFAULT_RQ_CONCURRENCY) -> dict:
+    """
+    多进程并发回补多个合约，每个进程同一时间只处理一个合约的一段数据，内存占用与回补区间长度无关
+    单个合约失败不影响其他合约，重新执行时各合约从各自断点继续
+    :param concurrency: 每个进程内同时请求的时间段数量
+    :return: {vt_symbol: 下载的k线数或异常}
+    """
+    start = datetime.strptime(start, TIME_FORMAT) if type(start) == str else start
+    end = datetime.strptime(end, TIME_FORMAT) if type(end) == str else end
+    results = {}
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(backfill_symbol, vt_symbol, start, end, chunk_days, checkpoint_dir,
+                                   concurrency): vt_symbol
+                   for vt_symbol in vt_symbols}
+        for future in as_completed(futures):
+            vt_symbol = futures[future]
+            try:
+                results[vt_symbol] = future.result()
+            except (Exception, RuntimeError) as e:
+                logger.error("backfill failed, %s, %s" % (vt_symbol, e), exc_info=True)
+                results[vt_symbol] = e
+    return results
+
+
+def backfill_gaps(symbol: str, exchange: Exchange, concurrency: int = DEFAULT_RQ_CONCURRENCY) -> int:
+    """
+    按数据质量索引中的缺失区间补数据，补完后重新扫描该合约
+    米筐按日期查询，同一天或相邻日期的多个缺失区间合并为一次请求
+    :return: 下载的k线数
+    """
+    windows = []
+    for start, end in get_missing_ranges(symbol, exchange):
+        start = datetime.combine(start.date(), datetime.min.time())
+        end = datetime.combine(end.date(), datetime.min.time())
+        if len(windows) > 0 and start <= windows[-1][1] + timedelta(days=1):
+            windows[-1][1] = max(windows[-1][1], end)
+        else:
+            windows.append([start, end])
+    total = 0
+    for start, end in windows:
+        total += download_rq_range(symbol, exchange, start, end, concurrency=concurrency)
+    if len(windows) > 0:
+        scan_symbol(symbol, exchange)
+    logger.info("gaps backfilled, %s.%s, windows=%s, total=%s" % (symbol, exchange.value, len(windows), total))
+    return total
+
+
+if __name__ == '__main__':
+    print(backfill(["rb8888.SHFE", "TA209.CZCE"], "2013-01-01 00:00:00", "2023-01-01 00:00:00"))
@@ -0,0 +1,226 @@
+import json
+import os
+from datetime import datetime
+from functools import lru_cache
+
+import pandas as pd
+from vnpy.trader.constant import Exchange, Interval
+from vnpy.trader.database import DB_TZ
+from vnpy.trader.object import BarData
+from vnpy.trader.utility import get_folder_path, extract_vt_symbol
+
+from future_data.db_pool import DbBarData, DbBarOverview, connection
+from log.log_init import get_logger
+
+logger = get_logger()
+
+# 缓存中保存的列，读取时可按需只取部分列
+CACHE_COLUMNS = ["datetime", "open_price", "high_price", "low_price", "close_price",
+                 "volume", "turnover", "open_interest"]
+META_FILE = "_meta.json"
+MONTH_FORMAT = "%Y-%m"
+
+
+class BarCache:
+    """
+    回测用的本地列式k线缓存，按(合约, 交易所, 周期)分目录，按月分区储存为parquet
+    首次读取时从MySQL加载并写入缓存，之后直接读本地文件
+    以DbBarOverview的start/end/count判断缓存是否失效，历史k线被改写时由改写方调用clear
+    """
+
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir if cache_dir is not None else str(get_folder_path("bar_cache"))
+
+    def _get_dir(self, symbol: str, exchange: Exchange, interval: Interval) -> str:
+        path = os.path.join(self.cache_dir, "%s.%s" % (symbol, exchange.value), interval.value)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _load_meta(self, path: str) -> dict:
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.exists(meta_path):
+            return {}
+        with open(meta_path, "r") as f:
+            return json.load(f)
+
+    def _save_meta(self, path: str, meta: dict):
+        meta_path = os.path.join(path, META_FILE)
+        tmp_path = "%s.%s.tmp" % (meta_path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def _drop_months(self, path: str, first_month: str = None):
+        """删除first_month及之后的月份分区，first_month为None时全部删除"""
+        for file_name in os.listdir(path):
+            if not file_name.endswith(".parquet"):
+                continue
+            if first_month is None or file_name[:7] >= first_month:
+                os.remove(os.path.join(path, file_name))
+
+    def clear(self, symbol: str, exchange: Exchange):
+        """
+        删除合约全部周期的缓存，数据库中已入库的历史k线被改写时调用(如连续合约换月后调整历史价格)
+        改写不会改变DbBarOverview的start/end/count，无法通过overview判断失效
+        """
+        path = os.path.join(self.cache_dir, "%s.%s" % (symbol, exchange.value))
+        if not os.path.isdir(path):
+            return
+        for interval_value in os.listdir(path):
+            interval_path = os.path.join(path, interval_value)
+            if not os.path.isdir(interval_path):
+                continue
+            # 先删除meta，中途退出时下次读取按overview整体重建
+            meta_path = os.path.join(interval_path, META_FILE)
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            self._drop_months(interval_path)
+        logger.info("bar cache cleared, %s.%s" % (symbol, exchange.value))
+
+    def _validate(self, path: str, symbol: str, exchange: Exchange, interval: Interval):
+        """根据DbBarOverview删除已失效的分区，返回当前的overview"""
+        with connection(DbBarOverview._meta.database):
+            overview: DbBarOverview = DbBarOverview.get_or_none(
+                DbBarOverview.symbol == symbol,
+                DbBarOverview.exchange == exchange.value,
+                DbBarOverview.interval == interval.value,
+            )
+        if overview is None:
+            return None
+        meta = self._load_meta(path)
+        start, end = str(overview.start), str(overview.end)
+        if meta.get("start") != start or (meta.get("end") == end and meta.get("count") != overview.count):
+            # 补了更早的历史数据或中间数据有变化，整体重建
+            self._drop_months(path)
+        elif meta.get("end") != end:
+            # 仅向后追加了数据，只需重建最后缓存时间所在月份及之后的分区
+            self._drop_months(path, meta["end"][:7])
+        self._save_meta(path, {"start": start, "end": end, "count": overview.count})
+        return overview
+
+    def _load_month_from_db(self, symbol: str, exchange: Exchange, interval: Interval, month_start: datetime,
+                            month_end: datetime) -> pd.DataFrame:
+        query = DbBarData.select(*[getattr(DbBarData, c) for c in CACHE_COLUMNS]).where(
+            DbBarData.symbol == symbol,
+            DbBarData.exchange == exchange.value,
+            DbBarData.interval == interval.value,
+            DbBarData.datetime >= month_start,
+            DbBarData.datetime < month_end,
+        ).order_by(DbBarData.datetime).tuples()
+        with connection(DbBarData._meta.database):
+            records = list(query)
+        df = pd.DataFrame(records, columns=CACHE_COLUMNS)
+        df["datetime"] = pd.to_datetime(df["datetime"])
+        return df
+
+    def load_frame(self, symbol: str, exchange: Exchange, interval: Interval, start: datetime, end: datetime,
+                   columns: list = None) -> pd.DataFrame:
+        """
+        读取[start, end]内的k线DataFrame，datetime为数据库时区下的无时区时间
+        :param columns: 需要读取的列，默认全部
+        """
+        path = self._get_dir(symbol, exchange, interval)
+        overview = self._validate(path, symbol, exchange, interval)
+        if columns is None:
+            columns = CACHE_COLUMNS
+        elif "datetime" not in columns:
+            columns = ["datetime"] + columns
+        if overview is None:
+            return empty_frame(columns)
+        start = to_db_time(start)
+        end = to_db_time(end)
+        frames = []
+        for month_start in pd.date_range(start.replace(day=1, hour=0, minute=0, second=0, microsecond=0),
+                                         min(end, overview.end), freq="MS"):
+            month_end = month_start + pd.offsets.MonthBegin(1)
+            if month_end <= overview.start:
+                continue
+            file_path = os.path.join(path, "%s.parquet" % month_start.strftime(MONTH_FORMAT))
+            if not os.path.exists(file_path):
+                df = self._load_month_from_db(symbol, exchange, interval, month_start.to_pydatetime(),
+                                              month_end.to_pydatetime())
+                # 参数优化时多进程可能同时写入，先写临时文件再替换
+                tmp_path = "%s.%s.tmp" % (file_path, os.getpid())
+                df.to_parquet(tmp_path, index=False)
+                os.replace(tmp_path, file_path)
+                logger.info("bar cache saved, %s, rows=%s" % (file_path, len(df)))
+            frames.append(pd.read_parquet(file_path, columns=columns))
+        if len(frames) < 1:
+            return empty_frame(columns)
+        df = pd.concat(frames, ignore_index=True)
+        return df[(df["datetime"] >= start) & (df["datetime"] <= end)].reset_index(drop=True)
+
+    def load_bar_data(self, symbol: str, exchange: Exchange, interval: Interval, start: datetime,
+                      end: datetime) -> list:
+        """与vnpy数据库的load_bar_data返回格式一致"""
+        df = self.load_frame(symbol, exchange, interval, start, end)
+        if len(df) < 1:
+            # 回测引擎分段加载，早于已入库数据的时间段没有k线
+            return []
+        datetimes = df["datetime"].dt.tz_localize(DB_TZ).dt.to_pydatetime().tolist()
+        columns = [df[c].tolist() for c in CACHE_COLUMNS[1:]]
+        return [BarData(symbol=symbol,
+                        exchange=exchange,
+                        datetime=dt,
+                        interval=interval,
+                        open_price=open_price,
+                        high_price=high_price,
+                        low_price=low_price,
+                        close_price=close_price,
+                        volume=volume,
+                        turnover=turnover,
+                        open_interest=open_interest,
+                        gateway_name="DB")
+                for dt, open_price, high_price, low_price, close_price, volume, turnover, open_interest
+                in zip(datetimes, *columns)]
+
+
+def empty_frame(columns: list) -> pd.DataFrame:
+    """没有数据时返回的空DataFrame，datetime列保持时间类型，与有数据时一致"""
+    df = pd.DataFrame(columns=columns)
+    df["datetime"] = pd.to_datetime(df["datetime"])
+    return df
+
+
+def to_db_time(dt: datetime) -> datetime:
+    """转换为数据库时区下的无时区时间，与DbBarData中的datetime一致"""
+    dt = pd.Timestamp(dt)
+    if dt.tzinfo is not None:
+        dt = dt.tz_convert(DB_TZ).tz_localize(None)
+    return dt
+
+
+def install_bar_cache(cache_dir: str = None) -> bool:
+    """
+    将vnpy回测引擎的历史数据加载替换为本地缓存，在创建BacktestingEngine之前调用即可
+    未安装pyarrow时不做替换，仍从数据库读取
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        logger.warning("pyarrow not installed, bar cache disabled")
+        return False
+    import vnpy_ctastrategy.backtesting as cta_backtesting
+    import vnpy_portfoliostrategy.backtesting as portfolio_backtesting
+    cache = BarCache(cache_dir)
+
+    # 与vnpy原方法一致，同一进程内重复回测(如参数优化)时直接复用已加载的数据
+    @lru_cache(maxsize=999)
+    def load_cta_bar_data(symbol: str, exchange: Exchange, interval: Interval, start: datetime, end: datetime):
+        return cache.load_bar_data(symbol, exchange, interval, start, end)
+
+    @lru_cache(maxsize=999)
+    def load_portfolio_bar_data(vt_symbol: str, interval: Interval, start: datetime, end: datetime):
+        symbol, exchange = extract_vt_symbol(vt_symbol)
+        return cache.load_bar_data(symbol, exchange, interval, start, end)
+
+    cta_backtesting.load_bar_data = load_cta_bar_data
+    portfolio_backtesting.load_bar_data = load_portfolio_bar_data
+    return True
+
+
+if __name__ == '__main__':
+    bar_cache = BarCache()
+    bars = bar_cache.load_bar_data("rb8888", Exchange.SHFE, Interval.MINUTE,
+                                   datetime(2019, 1, 1), datetime(2019, 3, 1))
+    print(len(bars), bars[0], bars[-1])
@@ -0,0 +1,286 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+from peewee import AutoField, CharField, DateTimeField, IntegerField, Model, chunked
+from vnpy.trader.constant import Exchange, Interval
+
+from future_data.db_pool import DbBarData, DbBarOverview, connection, pool_db
+from log.log_init import get_logger
+from util.trading_period import get_trading_sessions
+
+logger = get_logger()
+
+# 问题类型
+ISSUE_GAP = "gap"
+ISSUE_DUPLICATE = "duplicate"
+ISSUE_ZERO_VOLUME = "zero_volume"
+ISSUE_OHLC = "ohlc"
+ISSUE_OFF_SESSION = "off_session"
+
+# 每次从数据库读取的k线数量
+DEFAULT_CHUNK_SIZE = 200000
+# 连续多少根零成交量k线视为异常
+DEFAULT_ZERO_VOLUME_RUN = 5
+DEFAULT_PROCESSES = 4
+MINUTES_OF_DAY = 24 * 60
+SCAN_FIELDS = ["datetime", "open_price", "high_price", "low_price", "close_price", "volume"]
+ONE_MINUTE = np.timedelta64(1, "m")
+
+
+class DbBarIssue(Model):
+    """k线数据质量问题索引，缺失区间(gap)可直接用于补数据"""
+
+    id = AutoField()
+    symbol: str = CharField(max_length=32)
+    exchange: str = CharField(max_length=16)
+    interval: str = CharField(max_length=8)
+    # 问题类型 gap duplicate zero_volume ohlc off_session
+    kind: str = CharField(max_length=16)
+    # 问题区间的首尾时间，数据库时区
+    start: datetime = DateTimeField()
+    end: datetime = DateTimeField()
+    # 缺失或异常的k线数量
+    count: int = IntegerField()
+    scan_time: datetime = DateTimeField()
+
+    class Meta:
+        database = pool_db
+        # 索引列限定长度，utf8mb4下VARCHAR(255)每列占1020字节，多列组合会超出InnoDB索引3072字节的上限
+        indexes = ((("symbol", "exchange", "interval", "kind", "start"), False),)
+
+
+class SessionCalendar:
+    """
+    将一天中的每分钟映射到所属交易时段及时段内的序号(跳过休息时段)，用于向量化计算k线之间缺失的分钟数
+    跨零点的夜盘归属于开盘当天
+    """
+
+    def __init__(self, sessions: list, breaks: list = None):
+        self.session_of_minute = np.full(MINUTES_OF_DAY, -1, dtype=np.int64)
+        self.offset_of_minute = np.zeros(MINUTES_OF_DAY, dtype=np.int64)
+        # 零点之后属于前一天夜盘的分钟
+        self.after_midnight = np.zeros(MINUTES_OF_DAY, dtype=np.int64)
+        self.session_starts = []
+        break_minutes = set()
+        for break_start, break_end in breaks or []:
+            break_minutes.update(range(_to_minute(break_start), _to_minute(break_end)))
+        for i, (session_start, session_end) in enumerate(sessions):
+            start, end = _to_minute(session_start), _to_minute(session_end)
+            self.session_starts.append(start)
+            length = end - start if end > start else end + MINUTES_OF_DAY - start
+            offset = 0
+            for j in range(length):
+                minute = (start + j) % MINUTES_OF_DAY
+                if minute in break_minutes:
+                    continue
+                self.session_of_minute[minute] = i
+                self.offset_of_minute[minute] = offset
+                self.after_midnight[minute] = 1 if start + j >= MINUTES_OF_DAY else 0
+                offset += 1
+        self.session_starts = np.array(self.session_starts, dtype=np.int64)
+
+    def locate(self, minutes: np.ndarray):
+        """
+        :param minutes: datetime64[m]数组
+        :return: 时段实例编号(-1为非交易时间), 时段内序号, 时段实例开盘时间
+        """
+        days = minutes.astype("M8[D]")
+        minute_of_day = (minutes - days).astype(np.int64)
+        session = self.session_of_minute[minute_of_day]
+        anchor = days - self.after_midnight[minute_of_day].astype("m8[D]")
+        key = np.where(session >= 0, anchor.astype(np.int64) * len(self.session_starts) + session, -1)
+        session_open = anchor + self.session_starts[np.maximum(session, 0)].astype("m8[m]")
+        return key, self.offset_of_minute[minute_of_day], session_open
+
+
+def _to_minute(t) -> int:
+    return t.hour * 60 + t.minute
+
+
+def _runs(mask: np.ndarray):
+    """返回mask中连续True区间的(开始下标, 结束下标(不含))"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    return edges[::2], edges[1::2]
+
+
+def _issue(kind: str, start, end, count: int) -> dict:
+    return {"kind": kind, "start": _to_datetime(start), "end": _to_datetime(end), "count": int(count)}
+
+
+def _to_datetime(value) -> datetime:
+    return np.datetime64(value, "us").astype(datetime)
+
+
+class BarQualityScanner:
+    """
+    按合约分块读取分钟线，以向量化方式检查：
+    交易时段内缺失的分钟(gap)、重复时间(duplicate)、连续零成交量(zero_volume)、OHLC不一致(ohlc)、非交易时间的k线(off_session)
+    每个时段只检查开盘后及时段内的缺失，不检查收盘前的缺失，避免各品种夜盘收盘时间及节假日不同导致误报
+    """
+
+    def __init__(self, symbol: str, exchange: Exchange, interval: Interval = Interval.MINUTE,
+                 zero_volume_run: int = DEFAULT_ZERO_VOLUME_RUN):
+        self.symbol = symbol
+        self.exchange = exchange
+        self.interval = interval
+        self.zero_volume_run = zero_volume_run
+        self.calendar = SessionCalendar(*get_trading_sessions(exchange.value))
+        self.issues = []
+        # 跨块延续的状态：上一块最后一根交易时段内k线的(时间, 时段实例, 序号)，以及未结束的零成交量区间
+        self.last = None
+        self.zero_start = None
+        self.zero_count = 0
+        self.zero_last = None
+
+    def scan(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> list:
+        with connection(DbBarData._meta.database):
+            fields = [getattr(DbBarData, name) for name in SCAN_FIELDS]
+            last_datetime = None
+            while True:
+                query = DbBarData.select(*fields).where(
+                    DbBarData.symbol == self.symbol,
+                    DbBarData.exchange == self.exchange.value,
+                    DbBarData.interval == self.interval.value,
+                )
+                if last_datetime is not None:
+                    query = query.where(DbBarData.datetime > last_datetime)
+                rows = list(query.order_by(DbBarData.datetime).limit(chunk_size).tuples())
+                if len(rows) < 1:
+                    break
+                self.check_chunk(*[np.array(column) for column in zip(*rows)])
+                last_datetime = rows[-1][0]
+                if len(rows) < chunk_size:
+                    break
+            self._finish_zero_volume()
+            self.issues.sort(key=lambda issue: (issue["start"], issue["kind"]))
+            return self.issues
+
+    def check_chunk(self, datetimes, open_prices, high_prices, low_prices, close_prices, volumes):
+        """检查按时间升序排列的一块k线，各参数为同长度的数组"""
+        minutes = np.asarray(datetimes, dtype="M8[us]").astype("M8[m]")
+        self._check_ohlc(minutes, *[np.asarray(c, dtype=np.float64)
+                                    for c in (open_prices, high_prices, low_prices, close_prices)])
+        self._check_zero_volume(minutes, np.asarray(volumes, dtype=np.float64))
+        if self.interval != Interval.MINUTE:
+            return
+        key, offset, session_open = self.calendar.locate(minutes)
+        off_session = key < 0
+        if off_session.any():
+            for start, end in zip(*_runs(off_session)):
+                self.issues.append(_issue(ISSUE_OFF_SESSION, minutes[start], minutes[end - 1], end - start))
+        in_session = ~off_session
+        minutes, key, offset, session_open = minutes[in_session], key[in_session], offset[in_session], \
+            session_open[in_session]
+        if len(minutes) < 1:
+            return
+        # 拼接上一块的最后一根k线，保证跨块的缺失也能检查到
+        if self.last is not None:
+            minutes = np.concatenate(([self.last[0]], minutes))
+            key = np.concatenate(([self.last[1]], key))
+            offset = np.concatenate(([self.last[2]], offset))
+            session_open = np.concatenate(([self.last[3]], session_open))
+            first = 1
+        else:
+            first = 0
+        same_session = key[1:] == key[:-1]
+        missing = offset[1:] - offset[:-1] - 1
+        duplicate = minutes[1:] == minutes[:-1]
+        for i in np.flatnonzero(duplicate):
+            self.issues.append(_issue(ISSUE_DUPLICATE, minutes[i + 1], minutes[i + 1], 1))
+        for i in np.flatnonzero(same_session & (missing > 0)):
+            self.issues.append(_issue(ISSUE_GAP, minutes[i] + ONE_MINUTE, minutes[i + 1] - ONE_MINUTE, missing[i]))
+        # 每个时段实例的第一根k线应为开盘时间
+        new_session = np.concatenate(([first == 0], ~same_session))
+        for i in np.flatnonzero(new_session & (offset > 0)):
+            self.issues.append(_issue(ISSUE_GAP, session_open[i], minutes[i] - ONE_MINUTE, offset[i]))
+        self.last = (minutes[-1], key[-1], offset[-1], session_open[-1])
+
+    def _check_ohlc(self, minutes, open_prices, high_prices, low_prices, close_prices):
+        invalid = (high_prices < np.maximum(open_prices, close_prices)) \
+            | (low_prices > np.minimum(open_prices, close_prices)) \
+            | (high_prices < low_prices) \
+            | ~(low_prices > 0)
+        for i in np.flatnonzero(invalid):
+            self.issues.append(_issue(ISSUE_OHLC, minutes[i], minutes[i], 1))
+
+    def _check_zero_volume(self, minutes, volumes):
+        starts, ends = _runs(volumes == 0)
+        for start, end in zip(starts, ends):
+            if start == 0 and self.zero_start is not None:
+                # 接续上一块末尾的零成交量区间
+                self.zero_count += end
+                self.zero_last = minutes[end - 1]
+            else:
+                self._finish_zero_volume()
+                self.zero_start, self.zero_count, self.zero_last = minutes[start], end - start, minutes[end - 1]
+            if end < len(volumes):
+                self._finish_zero_volume()
+        if len(volumes) > 0 and volumes[-1] != 0:
+            self._finish_zero_volume()
+
+    def _finish_zero_volume(self):
+        if self.zero_start is not None and self.zero_count >= max(self.zero_volume_run, 1):
+            self.issues.append(_issue(ISSUE_ZERO_VOLUME, self.zero_start, self.zero_last, self.zero_count))
+        self.zero_start, self.zero_count, self.zero_last = None, 0, None
+
+
+def save_issues(symbol: str, exchange: Exchange, interval: Interval, issues: list):
+    """以本次扫描结果替换该合约的问题索引"""
+    with connection(DbBarIssue._meta.database) as issue_db:
+        issue_db.create_tables([DbBarIssue])
+        scan_time = datetime.now()
+        with issue_db.atomic():
+            DbBarIssue.delete().where(
+                DbBarIssue.symbol == symbol,
+                DbBarIssue.exchange == exchange.value,
+                DbBarIssue.interval == interval.value,
+            ).execute()
+            rows = [dict(issue, symbol=symbol, exchange=exchange.value, interval=interval.value, scan_time=scan_time)
+                    for issue in issues]
+            for sub_rows in chunked(rows, 1000):
+                DbBarIssue.insert_many(sub_rows).execute()
+
+
+def scan_symbol(symbol: str, exchange: Exchange, interval: Interval = Interval.MINUTE,
+                chunk_size: int = DEFAULT_CHUNK_SIZE, save: bool = True) -> list:
+    """扫描单个合约并更新问题索引"""
+    issues = BarQualityScanner(symbol, exchange, interval).scan(chunk_size)
+    if save:
+        save_issues(symbol, exchange, interval, issues)
+    logger.info("bar quality scanned, %s.%s, issues=%s" % (symbol, exchange.value, len(issues)))
+    return issues
+
+
+def scan_all(interval: Interval = Interval.MINUTE, processes: int = DEFAULT_PROCESSES) -> dict:
+    """多进程扫描DbBarOverview中的全部合约，返回{vt_symbol: 问题数量或异常}"""
+    with connection(DbBarOverview._meta.database):
+        overviews = list(DbBarOverview.select().where(DbBarOverview.interval == interval.value))
+    results = {}
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(scan_symbol, o.symbol, Exchange(o.exchange), interval): "%s.%s" % (
+            o.symbol, o.exchange) for o in overviews}
+        for future in as_completed(futures):
+            vt_symbol = futures[future]
+            try:
+                results[vt_symbol] = len(future.result())
+            except (Exception, RuntimeError) as e:
+                logger.error("scan failed, %s, %s" % (vt_symbol, e), exc_info=True)
+                results[vt_symbol] = e
+    return results
+
+
+def get_missing_ranges(symbol: str, exchange: Exchange, interval: Interval = Interval.MINUTE) -> list:
+    """读取问题索引中的缺失区间[(start, end)]，时间为数据库时区"""
+    with connection(DbBarIssue._meta.database):
+        query = DbBarIssue.select(DbBarIssue.start, DbBarIssue.end).where(
+            DbBarIssue.symbol == symbol,
+            DbBarIssue.exchange == exchange.value,
+            DbBarIssue.interval == interval.value,
+            DbBarIssue.kind == ISSUE_GAP,
+        ).order_by(DbBarIssue.start).tuples()
+        return list(query)
+
+
+if __name__ == '__main__':
+    print(scan_all())
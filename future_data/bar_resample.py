@@ -0,0 +1,183 @@
+from datetime import datetime, time
+from typing import List
+
+from peewee import AutoField, CharField, DateField, DateTimeField, DoubleField, IntegerField, Model, chunked
+from vnpy.trader.constant import Exchange, Interval
+from vnpy.trader.database import DB_TZ
+from vnpy.trader.object import BarData
+
+from future_data.bar_trading_day import DbBarTradingDay
+from future_data.db_pool import DbBarData, connection, pool_db
+from log.log_init import get_logger
+from util.trading_period import get_trading_day, get_trading_day_range
+
+logger = get_logger()
+
+PERIOD_5M = "5m"
+PERIOD_15M = "15m"
+PERIOD_1H = "1h"
+PERIOD_1D = "1d"
+# 入库时由分钟线合成的周期
+RESAMPLE_PERIODS = [PERIOD_5M, PERIOD_15M, PERIOD_1H, PERIOD_1D]
+PERIOD_MINUTES = {PERIOD_5M: 5, PERIOD_15M: 15, PERIOD_1H: 60}
+# 读取为BarData时使用的周期，N分钟线与vnpy的BarGenerator一致标记为分钟线
+PERIOD_INTERVALS = {PERIOD_5M: Interval.MINUTE, PERIOD_15M: Interval.MINUTE, PERIOD_1H: Interval.HOUR,
+                    PERIOD_1D: Interval.DAILY}
+RESAMPLE_FIELDS = ["datetime", "open_price", "high_price", "low_price", "close_price", "volume", "turnover",
+                   "open_interest"]
+# 全量重建时每次处理的交易日数
+REBUILD_DAYS = 20
+
+_table_created = False
+
+
+class DbResampledBar(Model):
+    """由分钟线合成的多周期k线，日线按交易日划分(夜盘归属下一交易日)，k线时间为周期开始时间"""
+
+    id = AutoField()
+    # 唯一索引的字符列限定长度，与DbBarTradingDay一致
+    symbol: str = CharField(max_length=32)
+    exchange: str = CharField(max_length=16)
+    period: str = CharField(max_length=8)
+    datetime: datetime = DateTimeField()
+    trading_day = DateField()
+    open_price: float = DoubleField()
+    high_price: float = DoubleField()
+    low_price: float = DoubleField()
+    close_price: float = DoubleField()
+    volume: float = DoubleField()
+    turnover: float = DoubleField()
+    open_interest: float = DoubleField()
+    # 合成该k线的分钟线数量
+    bar_count: int = IntegerField()
+
+    class Meta:
+        database = pool_db
+        indexes = ((("symbol", "exchange", "period", "datetime"), True),)
+
+
+def _create_table():
+    global _table_created
+    if not _table_created:
+        DbResampledBar._meta.database.create_tables([DbResampledBar])
+        _table_created = True
+
+
+def get_period_start(dt: datetime, period: str) -> datetime:
+    """分钟线所属周期的开始时间，日线为交易日当天0点，N分钟线和小时线按自然时间对齐"""
+    if period == PERIOD_1D:
+        return datetime.combine(get_trading_day(dt), time())
+    minutes = PERIOD_MINUTES[period]
+    if minutes >= 60:
+        return dt.replace(minute=0, second=0, microsecond=0)
+    return dt.replace(minute=dt.minute // minutes * minutes, second=0, microsecond=0)
+
+
+def resample_rows(rows: list, period: str) -> list:
+    """
+    将按时间排序的分钟线合成为指定周期
+    :param rows: (datetime, open, high, low, close, volume, turnover, open_interest)元组列表
+    :return: DbResampledBar的行，不含symbol、exchange、period
+    """
+    results = []
+    current = None
+    for dt, open_price, high_price, low_price, close_price, volume, turnover, open_interest in rows:
+        start_dt = get_period_start(dt, period)
+        if current is None or current["datetime"] != start_dt:
+            current = {"datetime": start_dt, "trading_day": get_trading_day(dt), "open_price": open_price,
+                       "high_price": high_price, "low_price": low_price, "close_price": close_price,
+                       "volume": volume, "turnover": turnover, "open_interest": open_interest, "bar_count": 1}
+            results.append(current)
+            continue
+        current["high_price"] = max(current["high_price"], high_price)
+        current["low_price"] = min(current["low_price"], low_price)
+        current["close_price"] = close_price
+        current["volume"] += volume
+        current["turnover"] += turnover
+        current["open_interest"] = open_interest
+        current["bar_count"] += 1
+    return results
+
+
+def update_resampled_bars(symbol: str, exchange: str, interval: str, trading_days):
+    """
+    分钟线写入后重新合成涉及交易日的各周期k线
+    周期边界不跨交易日，按交易日范围读取分钟线即可得到完整的k线
+    """
+    with connection(DbResampledBar._meta.database):
+        if interval != Interval.MINUTE.value:
+            return
+        trading_days = sorted(trading_days)
+        if len(trading_days) < 1:
+            return
+        _create_table()
+        wanted = set(trading_days)
+        query = DbBarData.select(*[getattr(DbBarData, f) for f in RESAMPLE_FIELDS]).where(
+            DbBarData.symbol == symbol,
+            DbBarData.exchange == exchange,
+            DbBarData.interval == interval,
+            DbBarData.datetime >= get_trading_day_range(trading_days[0])[0],
+            DbBarData.datetime < get_trading_day_range(trading_days[-1])[1],
+        ).order_by(DbBarData.datetime).tuples()
+        rows = [row for row in query if get_trading_day(row[0]) in wanted]
+        resample_db = DbResampledBar._meta.database
+        with resample_db.atomic():
+            for period in RESAMPLE_PERIODS:
+                resampled = [dict(row, symbol=symbol, exchange=exchange, period=period)
+                             for row in resample_rows(rows, period)]
+                for sub_rows in chunked(resampled, 1000):
+                    DbResampledBar.replace_many(sub_rows).execute()
+
+
+def rebuild_resampled_bars(symbol: str, exchange: str, interval: str = Interval.MINUTE.value) -> int:
+    """按交易日汇总中记录的交易日重建某合约的各周期k线，用于上线前已入库的数据，返回交易日数"""
+    with connection(DbResampledBar._meta.database):
+        query = DbBarTradingDay.select(DbBarTradingDay.trading_day).where(
+            DbBarTradingDay.symbol == symbol,
+            DbBarTradingDay.exchange == exchange,
+            DbBarTradingDay.interval == interval,
+        ).order_by(DbBarTradingDay.trading_day).tuples()
+        trading_days = [trading_day for (trading_day,) in query]
+        for sub_days in chunked(trading_days, REBUILD_DAYS):
+            update_resampled_bars(symbol, exchange, interval, sub_days)
+        logger.info("resampled bars rebuilt, %s.%s, days=%s" % (symbol, exchange, len(trading_days)))
+        return len(trading_days)
+
+
+def load_resampled_bars(symbol: str, exchange: Exchange, period: str, count: int,
+                        before_day=None) -> List[BarData]:
+    """
+    读取最近count根合成k线，按时间正序返回
+    :param before_day: 只读取该交易日之前的k线，用于策略预热时排除未走完的当前交易日
+    """
+    with connection(DbResampledBar._meta.database):
+        _create_table()
+        query = DbResampledBar.select().where(
+            DbResampledBar.symbol == symbol,
+            DbResampledBar.exchange == exchange.value,
+            DbResampledBar.period == period,
+        )
+        if before_day is not None:
+            query = query.where(DbResampledBar.trading_day < before_day)
+        db_bars = list(query.order_by(DbResampledBar.datetime.desc()).limit(count))
+        bars = []
+        for db_bar in reversed(db_bars):
+            bars.append(BarData(
+                symbol=symbol,
+                exchange=exchange,
+                datetime=db_bar.datetime.replace(tzinfo=DB_TZ),
+                interval=PERIOD_INTERVALS[period],
+                volume=db_bar.volume,
+                turnover=db_bar.turnover,
+                open_interest=db_bar.open_interest,
+                open_price=db_bar.open_price,
+                high_price=db_bar.high_price,
+                low_price=db_bar.low_price,
+                close_price=db_bar.close_price,
+                gateway_name="DB",
+            ))
+        return bars
+
+
+if __name__ == '__main__':
+    print(load_resampled_bars("rb9999", Exchange.SHFE, PERIOD_1D, 10))
@@ -0,0 +1,184 @@
+import os
+from datetime import datetime
+
+import numpy as np
+from vnpy.trader.constant import Exchange, Interval
+from vnpy.trader.database import DB_TZ
+from vnpy.trader.object import BarData
+from vnpy.trader.utility import get_folder_path
+from vnpy_ctastrategy.backtesting import BacktestingEngine
+
+from future_data.bar_cache import to_db_time
+from future_data.db_pool import DbBarData, connection
+from log.log_init import get_logger
+
+logger = get_logger()
+
+# 定长记录格式，datetime为数据库时区下的本地时间
+BAR_DTYPE = np.dtype([
+    ("datetime", "M8[us]"),
+    ("open_price", "<f8"),
+    ("high_price", "<f8"),
+    ("low_price", "<f8"),
+    ("close_price", "<f8"),
+    ("volume", "<f8"),
+    ("open_interest", "<f8"),
+])
+# 迭代时每次转换为BarData的记录数
+ITER_CHUNK_SIZE = 4096
+
+
+class MemmapBarSequence:
+    """
+    基于memmap的k线只读序列，按需将记录转换为BarData，不会一次性创建全部对象
+    支持len、下标、切片与迭代，可直接作为回测引擎的history_data使用
+    """
+
+    def __init__(self, records: np.ndarray, symbol: str, exchange: Exchange, interval: Interval):
+        self.records = records
+        self.symbol = symbol
+        self.exchange = exchange
+        self.interval = interval
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return MemmapBarSequence(self.records[item], self.symbol, self.exchange, self.interval)
+        if not -len(self.records) <= item < len(self.records):
+            raise IndexError("bar index out of range")
+        return self._to_bars(self.records[item:][:1])[0]
+
+    def __iter__(self):
+        for i in range(0, len(self.records), ITER_CHUNK_SIZE):
+            for bar in self._to_bars(self.records[i:i + ITER_CHUNK_SIZE]):
+                yield bar
+
+    def clear(self):
+        """兼容回测引擎clear_data中的history_data.clear()"""
+        self.records = self.records[:0]
+
+    def _to_bars(self, records: np.ndarray) -> list:
+        datetimes = records["datetime"].tolist()
+        columns = [records[name].tolist() for name in BAR_DTYPE.names[1:]]
+        return [BarData(symbol=self.symbol,
+                        exchange=self.exchange,
+                        datetime=dt.replace(tzinfo=DB_TZ),
+                        interval=self.interval,
+                        open_price=open_price,
+                        high_price=high_price,
+                        low_price=low_price,
+                        close_price=close_price,
+                        volume=volume,
+                        open_interest=open_interest,
+                        gateway_name="DB")
+                for dt, open_price, high_price, low_price, close_price, volume, open_interest
+                in zip(datetimes, *columns)]
+
+
+class BarStore:
+    """
+    按合约储存的追加写k线文件，每条记录定长，可直接用np.memmap打开并按日期零拷贝切片
+    适合多年分钟线回测，内存占用与回测区间长度基本无关
+    """
+
+    def __init__(self, store_dir: str = None):
+        self.store_dir = store_dir if store_dir is not None else str(get_folder_path("bar_store"))
+
+    def get_path(self, symbol: str, exchange: Exchange, interval: Interval) -> str:
+        return os.path.join(self.store_dir, "%s.%s.%s.bin" % (symbol, exchange.value, interval.value))
+
+    def open(self, symbol: str, exchange: Exchange, interval: Interval) -> np.ndarray:
+        """只读打开全部记录，文件不存在时返回空数组"""
+        path = self.get_path(symbol, exchange, interval)
+        if not os.path.exists(path) or os.path.getsize(path) < BAR_DTYPE.itemsize:
+            return np.empty(0, dtype=BAR_DTYPE)
+        # 忽略写入中断导致的不完整尾部记录
+        count = os.path.getsize(path) // BAR_DTYPE.itemsize
+        return np.memmap(path, dtype=BAR_DTYPE, mode="r", shape=(count,))
+
+    def get_last_datetime(self, symbol: str, exchange: Exchange, interval: Interval):
+        records = self.open(symbol, exchange, interval)
+        if len(records) < 1:
+            return None
+        return records["datetime"][-1].astype(datetime)
+
+    def append(self, symbol: str, exchange: Exchange, interval: Interval, records: np.ndarray) -> int:
+        """追加记录，仅写入晚于已有最后时间的部分，保证文件按时间有序"""
+        if records is None or len(records) < 1:
+            return 0
+        records = np.sort(records.astype(BAR_DTYPE, copy=False), order="datetime")
+        last_datetime = self.get_last_datetime(symbol, exchange, interval)
+        if last_datetime is not None:
+            records = records[records["datetime"] > np.datetime64(last_datetime, "us")]
+        if len(records) < 1:
+            return 0
+        path = self.get_path(symbol, exchange, interval)
+        # 截掉不完整的尾部记录后再追加
+        if os.path.exists(path) and os.path.getsize(path) % BAR_DTYPE.itemsize != 0:
+            with open(path, "r+b") as f:
+                f.truncate(os.path.getsize(path) // BAR_DTYPE.itemsize * BAR_DTYPE.itemsize)
+        with open(path, "ab") as f:
+            f.write(records.tobytes())
+        return len(records)
+
+    def build_from_database(self, symbol: str, exchange: Exchange, interval: Interval,
+                            chunk_size: int = 200000) -> int:
+        """从DbBarData分批导入上次导入之后的数据，内存占用仅与chunk_size有关"""
+        fields = [DbBarData.datetime] + [getattr(DbBarData, name) for name in BAR_DTYPE.names[1:]]
+        last_datetime = self.get_last_datetime(symbol, exchange, interval)
+        total = 0
+        while True:
+            query = DbBarData.select(*fields).where(
+                DbBarData.symbol == symbol,
+                DbBarData.exchange == exchange.value,
+                DbBarData.interval == interval.value,
+            )
+            if last_datetime is not None:
+                query = query.where(DbBarData.datetime > last_datetime)
+            # 每批读取后归还连接，写入文件期间不占用连接池
+            with connection(DbBarData._meta.database):
+                rows = list(query.order_by(DbBarData.datetime).limit(chunk_size).tuples())
+            if len(rows) < 1:
+                break
+            total += self.append(symbol, exchange, interval, np.array(rows, dtype=BAR_DTYPE))
+            last_datetime = rows[-1][0]
+            if len(rows) < chunk_size:
+                break
+        logger.info("bar store built, %s.%s, new=%s" % (symbol, exchange.value, total))
+        return total
+
+    def view(self, symbol: str, exchange: Exchange, interval: Interval, start: datetime,
+             end: datetime) -> MemmapBarSequence:
+        """按[start, end]二分查找切片，不复制数据"""
+        records = self.open(symbol, exchange, interval)
+        datetimes = records["datetime"]
+        left = np.searchsorted(datetimes, np.datetime64(to_db_time(start).to_pydatetime(), "us"), side="left")
+        right = np.searchsorted(datetimes, np.datetime64(to_db_time(end).to_pydatetime(), "us"), side="right")
+        return MemmapBarSequence(records[left:right], symbol, exchange, interval)
+
+
+class MemmapBacktestingEngine(BacktestingEngine):
+    """从BarStore按需读取回测数据的CTA回测引擎，使用前需先调用BarStore.build_from_database导入数据"""
+
+    def __init__(self, store_dir: str = None):
+        super().__init__()
+        self.bar_store = BarStore(store_dir)
+
+    def load_data(self) -> None:
+        self.output("开始加载历史数据")
+        if not self.end:
+            self.end = datetime.now()
+        if self.start >= self.end:
+            self.output("起始日期必须小于结束日期")
+            return
+        self.history_data = self.bar_store.view(self.symbol, self.exchange, self.interval, self.start, self.end)
+        self.output("历史数据加载完成，数据量：%s" % len(self.history_data))
+
+
+if __name__ == '__main__':
+    store = BarStore()
+    store.build_from_database("rb8888", Exchange.SHFE, Interval.MINUTE)
+    bars = store.view("rb8888", Exchange.SHFE, Interval.MINUTE, datetime(2019, 1, 1), datetime(2019, 2, 1))
+    print(len(bars), bars[0], bars[-1])
@@ -0,0 +1,146 @@
+from datetime import datetime
+
+from peewee import AutoField, CharField, DateField, DateTimeField, IntegerField, Model, chunked, fn
+
+from future_data.db_pool import DbBarData, DbBarOverview, connection, pool_db
+from log.log_init import get_logger
+from util.trading_period import get_trading_day, get_trading_day_range
+
+logger = get_logger()
+
+_table_created = False
+
+
+class DbBarTradingDay(Model):
+    """每个合约每个交易日的k线汇总，随k线写入增量维护，用于按交易日计数而无需扫描DbBarData"""
+
+    id = AutoField()
+    # 唯一索引的字符列限定长度，utf8mb4下VARCHAR(255)每列占1020字节，三列加日期已接近InnoDB索引3072字节的上限
+    symbol: str = CharField(max_length=32)
+    exchange: str = CharField(max_length=16)
+    interval: str = CharField(max_length=8)
+    trading_day = DateField()
+    bar_count: int = IntegerField()
+    # 该交易日第一根和最后一根k线的时间，数据库时区
+    first_datetime: datetime = DateTimeField()
+    last_datetime: datetime = DateTimeField()
+
+    class Meta:
+        database = pool_db
+        indexes = ((("symbol", "exchange", "interval", "trading_day"), True),)
+
+
+def _create_table():
+    global _table_created
+    if not _table_created:
+        DbBarTradingDay._meta.database.create_tables([DbBarTradingDay])
+        _table_created = True
+
+
+def get_trading_days_of_rows(rows: list) -> set:
+    """DbBarData行覆盖的交易日"""
+    return {get_trading_day(row["datetime"]) for row in rows}
+
+
+def update_trading_days(symbol: str, exchange: str, interval: str, trading_days):
+    """
+    重新统计指定交易日的k线数量和首尾时间，写入后调用
+    按唯一索引读取这些交易日范围内的k线时间，不受重复写入(覆盖)的影响
+    """
+    with connection(DbBarTradingDay._meta.database):
+        trading_days = sorted(trading_days)
+        if len(trading_days) < 1:
+            return
+        _create_table()
+        start_dt = get_trading_day_range(trading_days[0])[0]
+        end_dt = get_trading_day_range(trading_days[-1])[1]
+        query = DbBarData.select(DbBarData.datetime).where(
+            DbBarData.symbol == symbol,
+            DbBarData.exchange == exchange,
+            DbBarData.interval == interval,
+            DbBarData.datetime >= start_dt,
+            DbBarData.datetime < end_dt,
+        ).tuples()
+        wanted = set(trading_days)
+        # trading_day -> [数量, 首, 尾]
+        summaries = {}
+        for (dt,) in query:
+            trading_day = get_trading_day(dt)
+            if trading_day not in wanted:
+                continue
+            summary = summaries.get(trading_day)
+            if summary is None:
+                summaries[trading_day] = [1, dt, dt]
+            else:
+                summary[0] += 1
+                summary[1] = min(summary[1], dt)
+                summary[2] = max(summary[2], dt)
+        rows = [{"symbol": symbol, "exchange": exchange, "interval": interval, "trading_day": trading_day,
+                 "bar_count": count, "first_datetime": first_dt, "last_datetime": last_dt}
+                for trading_day, (count, first_dt, last_dt) in summaries.items()]
+        summary_db = DbBarTradingDay._meta.database
+        with summary_db.atomic():
+            for sub_rows in chunked(rows, 1000):
+                DbBarTradingDay.replace_many(sub_rows).execute()
+
+
+def rebuild_trading_days(symbol: str, exchange: str, interval: str) -> int:
+    """根据DbBarData全量重建某合约的交易日汇总，用于汇总表上线前已有的数据，返回交易日数"""
+    with connection(DbBarTradingDay._meta.database):
+        _create_table()
+        query = DbBarData.select(DbBarData.datetime).where(
+            DbBarData.symbol == symbol,
+            DbBarData.exchange == exchange,
+            DbBarData.interval == interval,
+        ).tuples()
+        trading_days = {get_trading_day(dt) for (dt,) in query}
+        summary_db = DbBarTradingDay._meta.database
+        with summary_db.atomic():
+            DbBarTradingDay.delete().where(
+                DbBarTradingDay.symbol == symbol,
+                DbBarTradingDay.exchange == exchange,
+                DbBarTradingDay.interval == interval,
+            ).execute()
+            update_trading_days(symbol, exchange, interval, trading_days)
+        logger.info("trading days rebuilt, %s.%s, days=%s" % (symbol, exchange, len(trading_days)))
+        return len(trading_days)
+
+
+def backfill_trading_days(symbol: str) -> int:
+    """
+    汇总未覆盖DbBarOverview记录的起始时间时(汇总表上线前已入库的数据)，重建该合约的交易日汇总
+    每个合约只需重建一次，之后随k线写入增量维护
+    :return: 重建的合约周期数
+    """
+    with connection(DbBarTradingDay._meta.database):
+        _create_table()
+        rebuilt = 0
+        for overview in DbBarOverview.select().where(DbBarOverview.symbol == symbol):
+            first_datetime = DbBarTradingDay.select(fn.min(DbBarTradingDay.first_datetime)).where(
+                DbBarTradingDay.symbol == overview.symbol,
+                DbBarTradingDay.exchange == overview.exchange,
+                DbBarTradingDay.interval == overview.interval,
+            ).scalar()
+            if first_datetime is not None and first_datetime <= overview.start:
+                continue
+            rebuild_trading_days(overview.symbol, overview.exchange, overview.interval)
+            rebuilt += 1
+        return rebuilt
+
+
+def count_trading_days(symbol: str, exchange: str = None, interval: str = None) -> int:
+    """合约已入库的交易日数，汇总表中没有该合约时返回None"""
+    with connection(DbBarTradingDay._meta.database):
+        _create_table()
+        query = DbBarTradingDay.select(fn.count(DbBarTradingDay.trading_day.distinct())) \
+            .where(DbBarTradingDay.symbol == symbol)
+        if exchange is not None:
+            query = query.where(DbBarTradingDay.exchange == exchange)
+        if interval is not None:
+            query = query.where(DbBarTradingDay.interval == interval)
+        days = query.scalar()
+        return days if days else None
+
+
+if __name__ == '__main__':
+    print(count_trading_days("rb2301"))
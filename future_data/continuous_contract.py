@@ -0,0 +1,257 @@
+import re
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from peewee import AutoField, CharField, DateField, DoubleField, Model, fn
+from vnpy.trader.constant import Exchange, Interval
+
+from future_data.bar_cache import BarCache
+from future_data.bar_resample import DbResampledBar, PERIOD_1D
+from future_data.bar_trading_day import DbBarTradingDay
+from future_data.data_downloader import BAR_VALUE_FIELDS, save_bar_rows
+from future_data.db_pool import DbBarData, DbBarOverview, connection, pool_db
+from log.log_init import get_logger
+from util.trading_period import get_trading_day_range
+
+logger = get_logger()
+
+# 复权方式
+ADJUST_RATIO = "ratio"
+ADJUST_DIFFERENCE = "difference"
+# 本地合成的后复权连续合约代码，与数据商的8888/9999区分
+ADJUSTED_CODES = {ADJUST_RATIO: "7777", ADJUST_DIFFERENCE: "6666"}
+# 不参与合成的连续合约代码
+CONTINUOUS_CODES = {"8888", "9999", "7777", "6666"}
+# 选择主力合约的依据
+ROLL_BY_OPEN_INTEREST = "open_interest"
+ROLL_BY_VOLUME = "volume"
+PRICE_FIELDS = ["open_price", "high_price", "low_price", "close_price"]
+SEGMENT_FIELDS = ["datetime"] + BAR_VALUE_FIELDS
+# 增量合成时读取最后交易日之前若干天的日线，用于判断换月
+METRICS_LOOKBACK_DAYS = 10
+
+_table_created = False
+
+
+class DbContractRoll(Model):
+    """本地连续合约的换月记录，trading_day为使用新合约的第一个交易日，首条记录old_contract为空，表示合成起点"""
+
+    id = AutoField()
+    symbol: str = CharField()
+    exchange: str = CharField()
+    trading_day = DateField()
+    old_contract: str = CharField()
+    new_contract: str = CharField()
+    # 换月前一交易日新旧合约的收盘价
+    old_close: float = DoubleField()
+    new_close: float = DoubleField()
+    # 换月前的数据需要乘以(比例复权)或加上(差值复权)的调整值
+    factor: float = DoubleField()
+
+    class Meta:
+        database = pool_db
+        indexes = ((("symbol", "exchange", "trading_day"), True),)
+
+
+def _create_table():
+    global _table_created
+    if not _table_created:
+        DbContractRoll._meta.database.create_tables([DbContractRoll])
+        _table_created = True
+
+
+def get_adjusted_symbol(product: str, adjust: str = ADJUST_RATIO) -> str:
+    return product + ADJUSTED_CODES[adjust]
+
+
+def get_month_contracts(product: str, exchange: Exchange) -> list:
+    """DbBarOverview中该品种已入库的各月份合约"""
+    pattern = re.compile(r"^%s(\d{3,4})$" % re.escape(product))
+    query = DbBarOverview.select(DbBarOverview.symbol).where(
+        DbBarOverview.exchange == exchange.value,
+        DbBarOverview.interval == Interval.MINUTE.value,
+        DbBarOverview.symbol.startswith(product),
+    ).tuples()
+    contracts = []
+    for (symbol,) in query:
+        match = pattern.match(symbol)
+        if match is not None and match.group(1) not in CONTINUOUS_CODES:
+            contracts.append(symbol)
+    return sorted(contracts)
+
+
+def load_daily_metrics(contracts: list, exchange: Exchange, since: date = None) -> dict:
+    """
+    读取各月份合约的日线，返回以交易日为索引、合约为列的DataFrame
+    :return: {"close_price": df, "volume": df, "open_interest": df}
+    """
+    query = DbResampledBar.select(DbResampledBar.symbol, DbResampledBar.trading_day, DbResampledBar.close_price,
+                                  DbResampledBar.volume, DbResampledBar.open_interest).where(
+        DbResampledBar.exchange == exchange.value,
+        DbResampledBar.period == PERIOD_1D,
+        DbResampledBar.symbol.in_(contracts),
+    )
+    if since is not None:
+        query = query.where(DbResampledBar.trading_day >= since)
+    df = pd.DataFrame(list(query.tuples()),
+                      columns=["symbol", "trading_day", "close_price", "volume", "open_interest"])
+    return {field: df.pivot(index="trading_day", columns="symbol", values=field).sort_index()
+            for field in ["close_price", "volume", "open_interest"]}
+
+
+def get_adjust_factor(old_close: float, new_close: float, adjust: str) -> float:
+    if adjust == ADJUST_RATIO:
+        return new_close / old_close
+    return new_close - old_close
+
+
+def combine_factors(factors, adjust: str) -> float:
+    """多次换月的调整值合并为一个"""
+    if adjust == ADJUST_RATIO:
+        return float(np.prod(factors)) if len(factors) > 0 else 1.0
+    return float(np.sum(factors)) if len(factors) > 0 else 0.0
+
+
+def select_rolls(metrics: dict, roll_by: str, current: str, retired: set, start_day: date):
+    """
+    按前一交易日的持仓量或成交量逐日确定主力合约，只向未使用过的合约换月，不回到旧合约
+    :return: (分段列表[[合约, 首个交易日, 最后交易日]], 换月列表[(交易日, 旧合约, 新合约, 旧收盘, 新收盘)])
+    """
+    values = metrics[roll_by]
+    closes = metrics["close_price"]
+    days = list(values.index)
+    segments = []
+    rolls = []
+    for i, day in enumerate(days):
+        if day < start_day:
+            continue
+        # 首个交易日没有前一日数据时使用当日数据
+        previous = values.iloc[i - 1] if i > 0 else values.iloc[i]
+        candidates = previous.drop(labels=[c for c in retired if c in previous.index]).dropna()
+        if current is None:
+            if len(candidates) < 1:
+                continue
+            current = candidates.idxmax()
+        elif len(candidates) > 0:
+            leader = candidates.idxmax()
+            current_value = previous.get(current, np.nan)
+            if leader != current and (np.isnan(current_value) or candidates[leader] > current_value):
+                old_close = closes.iloc[i - 1].get(current, np.nan) if i > 0 else np.nan
+                new_close = closes.iloc[i - 1].get(leader, np.nan) if i > 0 else np.nan
+                if not np.isnan(old_close) and not np.isnan(new_close):
+                    rolls.append((day, current, leader, float(old_close), float(new_close)))
+                    retired.add(current)
+                    current = leader
+        if len(segments) > 0 and segments[-1][0] == current:
+            segments[-1][2] = day
+        else:
+            segments.append([current, day, day])
+    return segments, rolls
+
+
+def load_segment_rows(contract: str, exchange: Exchange, first_day: date, last_day: date) -> dict:
+    """读取合约在[first_day, last_day]交易日内的分钟线，按字段返回numpy数组"""
+    query = DbBarData.select(*[getattr(DbBarData, f) for f in SEGMENT_FIELDS]).where(
+        DbBarData.symbol == contract,
+        DbBarData.exchange == exchange.value,
+        DbBarData.interval == Interval.MINUTE.value,
+        DbBarData.datetime >= get_trading_day_range(first_day)[0],
+        DbBarData.datetime < get_trading_day_range(last_day)[1],
+    ).order_by(DbBarData.datetime).tuples()
+    records = list(query)
+    if len(records) < 1:
+        return {}
+    columns = list(zip(*records))
+    return {field: np.array(column) for field, column in zip(SEGMENT_FIELDS, columns)}
+
+
+def rescale_history(symbol: str, exchange: Exchange, before_day: date, factor: float, adjust: str):
+    """换月后调整连续合约已入库的历史价格(分钟线及合成k线)，在数据库中直接批量更新"""
+    start_dt = get_trading_day_range(before_day)[0]
+    for model, condition in [(DbBarData, DbBarData.datetime < start_dt),
+                             (DbResampledBar, DbResampledBar.trading_day < before_day)]:
+        fields = {getattr(model, f): (getattr(model, f) * factor if adjust == ADJUST_RATIO
+                                      else getattr(model, f) + factor)
+                  for f in PRICE_FIELDS}
+        model.update(fields).where(model.symbol == symbol, model.exchange == exchange.value, condition).execute()
+
+
+def build_continuous_contract(product: str, exchange: Exchange, adjust: str = ADJUST_RATIO,
+                              roll_by: str = ROLL_BY_OPEN_INTEREST) -> int:
+    """
+    用已入库的各月份合约分钟线合成后复权连续合约，写入DbBarData，symbol为品种+7777(比例)/6666(差值)
+    依赖入库时合成的日线选择主力合约，已合成过时只处理最后一个交易日之后的数据，
+    发生换月时在数据库中批量调整历史价格，不重新计算全部数据
+    :return: 写入的k线数
+    """
+    with connection(DbContractRoll._meta.database):
+        _create_table()
+        symbol = get_adjusted_symbol(product, adjust)
+        contracts = get_month_contracts(product, exchange)
+        if len(contracts) < 1:
+            logger.info("no month contracts, %s.%s" % (product, exchange.value))
+            return 0
+        # 上次合成的状态
+        rolls_done = list(DbContractRoll.select().where(DbContractRoll.symbol == symbol,
+                                                        DbContractRoll.exchange == exchange.value)
+                          .order_by(DbContractRoll.trading_day))
+        last_day = DbBarTradingDay.select(fn.max(DbBarTradingDay.trading_day)).where(
+            DbBarTradingDay.symbol == symbol,
+            DbBarTradingDay.exchange == exchange.value,
+            DbBarTradingDay.interval == Interval.MINUTE.value,
+        ).scalar()
+        current, retired, start_day, since = None, set(), date.min, None
+        if last_day is not None and len(rolls_done) > 0:
+            # 最后一个交易日可能未走完，从该日重新写入
+            start_day = last_day
+            retired = {roll.old_contract for roll in rolls_done}
+            current = rolls_done[-1].new_contract
+            since = last_day - timedelta(days=METRICS_LOOKBACK_DAYS)
+        metrics = load_daily_metrics(contracts, exchange, since)
+        if len(metrics["close_price"]) < 1:
+            return 0
+        segments, rolls = select_rolls(metrics, roll_by, current, retired, start_day)
+        if len(segments) < 1:
+            return 0
+        factors = [get_adjust_factor(old_close, new_close, adjust) for _, _, _, old_close, new_close in rolls]
+        total = 0
+        rescaled = False
+        with DbContractRoll._meta.database.atomic():
+            if current is None:
+                DbContractRoll.create(symbol=symbol, exchange=exchange.value, trading_day=segments[0][1], old_contract="",
+                                      new_contract=segments[0][0], old_close=0, new_close=0,
+                                      factor=combine_factors([], adjust))
+            elif len(rolls) > 0:
+                rescale_history(symbol, exchange, rolls[0][0], combine_factors(factors, adjust), adjust)
+                rescaled = True
+            for (day, old_contract, new_contract, old_close, new_close), factor in zip(rolls, factors):
+                DbContractRoll.create(symbol=symbol, exchange=exchange.value, trading_day=day, old_contract=old_contract,
+                                      new_contract=new_contract, old_close=old_close, new_close=new_close, factor=factor)
+                logger.info("contract rolled, %s, %s -> %s, day=%s" % (symbol, old_contract, new_contract, day))
+            # 第k段之后发生的换月调整值，按分段整体调整价格
+            roll_index = 0
+            for contract, first_day, end_day in segments:
+                while roll_index < len(rolls) and rolls[roll_index][0] <= first_day:
+                    roll_index += 1
+                factor = combine_factors(factors[roll_index:], adjust)
+                columns = load_segment_rows(contract, exchange, first_day, end_day)
+                if len(columns) < 1:
+                    continue
+                for field in PRICE_FIELDS:
+                    columns[field] = columns[field] * factor if adjust == ADJUST_RATIO else columns[field] + factor
+                rows = [dict(zip(SEGMENT_FIELDS, values), symbol=symbol, exchange=exchange.value,
+                             interval=Interval.MINUTE.value)
+                        for values in zip(*[columns[field].tolist() for field in SEGMENT_FIELDS])]
+                save_bar_rows(symbol, exchange.value, Interval.MINUTE.value, rows)
+                total += len(rows)
+        if rescaled:
+            # 事务提交后再删除回测缓存，避免其他进程在提交前重新缓存调整前的价格
+            BarCache().clear(symbol, exchange)
+        logger.info("continuous contract built, %s.%s, segments=%s, rolls=%s, total=%s"
+                    % (symbol, exchange.value, len(segments), len(rolls), total))
+        return total
+
+
+if __name__ == '__main__':
+    logger.info("continuous contract rows written: %s" % build_continuous_contract("rb", Exchange.SHFE))
@@ -5,15 +5,20 @@ import pytz
 
 from log.log_init import get_logger
 import time
-from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-from vnpy.trader.database import (database, get_database)  # 重要，需要此步骤加载vnpy的数据库管理器
-from vnpy_mysql.mysql_database import DbBarOverview, db
+from peewee import chunked
+from vnpy.trader.database import (database, get_database, convert_tz)  # 重要，需要此步骤加载vnpy的数据库管理器
 from vnpy.trader.constant import Exchange, Interval
 from vnpy.trader.object import BarData, HistoryRequest
 from vnpy_rqdata.rqdata_datafeed import RqdataDatafeed
 from vnpy.trader.setting import SETTINGS
 
+from future_data.bar_resample import update_resampled_bars
+from future_data.bar_trading_day import get_trading_days_of_rows, update_trading_days
+from future_data.db_pool import DbBarData, DbBarOverview, connection
 from util.vt_symbol_util import split_vnpy_format
 
 logger = get_logger()
@@ -32,6 +37,21 @@ end = time.strftime(TIME_FORMAT, time.localtime())
 frequency = '1m'
 vnpy_frequency = Interval.MINUTE
 USE_RQ = False
+# save_bar单次executemany包含的k线数量
+DEFAULT_BATCH_SIZE = 1000
+# DbBarData中需要写入的字段
+BAR_FIELDS = ["symbol", "exchange", "datetime", "interval", "volume", "turnover", "open_interest",
+              "open_price", "high_price", "low_price", "close_price"]
+# 参与内容比对的字段
+BAR_VALUE_FIELDS = BAR_FIELDS[4:]
+# 米筐历史数据分段下载时每段的天数
+DEFAULT_CHUNK_DAYS = 30
+# 米筐分段下载时同时请求的时间段数量
+DEFAULT_RQ_CONCURRENCY = 4
+# 流式写入时每块的k线数量，决定写入过程的内存上限
+STREAM_CHUNK_SIZE = 5000
+
+_rq_client = None
 
 
 def download_data(vt_symbol, start_date=start, end_date=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())):
@@ -39,28 +59,233 @@ def download_data(vt_symbol, start_date=start, end_date=time.strftime("%Y-%m-%d
         download_data_from_rq(vt_symbol, start_date, end_date)
 
 
-def save_bar(bars):
+def get_bar_overview_end(symbol: str, exchange: Exchange, interval: Interval = vnpy_frequency):
+    """读取DbBarOverview中已入库数据的最后时间，作为增量同步的水位线，无数据时返回None"""
+    with connection(DbBarOverview._meta.database):
+        overview: DbBarOverview = DbBarOverview.get_or_none(
+            DbBarOverview.symbol == symbol,
+            DbBarOverview.exchange == exchange.value,
+            DbBarOverview.interval == interval.value,
+        )
+    if overview is None:
+        return None
+    return overview.end
+
+
+def _quote(bar_db, name: str) -> str:
+    return "%s%s%s" % (bar_db.quote[0], name, bar_db.quote[1])
+
+
+def bar_to_row(bar: BarData) -> dict:
+    """BarData转换为DbBarData的一行，时间按数据库时区转换，与vnpy_mysql保持一致"""
+    return {
+        "symbol": bar.symbol,
+        "exchange": bar.exchange.value,
+        "datetime": convert_tz(bar.datetime),
+        "interval": bar.interval.value,
+        "volume": bar.volume,
+        "turnover": bar.turnover,
+        "open_interest": bar.open_interest,
+        "open_price": bar.open_price,
+        "high_price": bar.high_price,
+        "low_price": bar.low_price,
+        "close_price": bar.close_price,
+    }
+
+
+def _row_digest(values) -> int:
+    """k线内容的哈希值，用于判断是否与库中数据完全一致"""
+    return hash(tuple(float(v) for v in values))
+
+
+def drop_unchanged_rows(symbol: str, exchange: str, interval: str, rows: list) -> list:
+    """
+    按(symbol, exchange, interval, datetime)读取库中已有的k线，比对内容哈希，丢弃完全相同的行
+    仅查询本次数据覆盖的时间范围，走唯一索引
+    """
+    if rows is None or len(rows) < 1:
+        return rows
+    query = DbBarData.select(DbBarData.datetime, *[getattr(DbBarData, f) for f in BAR_VALUE_FIELDS]).where(
+        DbBarData.symbol == symbol,
+        DbBarData.exchange == exchange,
+        DbBarData.interval == interval,
+        DbBarData.datetime >= min(row["datetime"] for row in rows),
+        DbBarData.datetime <= max(row["datetime"] for row in rows),
+    ).tuples()
+    stored = {values[0]: _row_digest(values[1:]) for values in query}
+    if len(stored) < 1:
+        return rows
+    return [row for row in rows
+            if stored.get(row["datetime"]) != _row_digest(row[f] for f in BAR_VALUE_FIELDS)]
+
+
+def save_bar(bars, batch_size: int = DEFAULT_BATCH_SIZE, skip_unchanged: bool = True):
+    """
+    批量写入k线，按合约分组，每个合约在一个事务内多行upsert，最后只更新一次DbBarOverview
+    :param bars: BarData列表，可包含多个合约
+    :param batch_size: 每次executemany写入的行数
+    :param skip_unchanged: 是否跳过与库中完全相同的k线，仅写入新增或有变化的数据
+    """
     if bars is None or len(bars) < 1:
         return
-    database = get_database()
-    batch_size = 200
-    start_idx = 0
-    while start_idx < len(bars):
-        end_idx = start_idx + batch_size
-        if end_idx > len(bars):
-            end_idx = len(bars)
-        sub_list = bars[start_idx:end_idx]
-        if len(sub_list) > 0:
-            print(sub_list[-1])
-            database.save_bar_data(sub_list)
-        print("data saved, start= %s, total =%s" % (start_idx, len(bars)))
-        logger.info("data saved, start= %s, total =%s" % (start_idx, len(bars)))
-        start_idx += batch_size
-        pass
-    pass
+    save_bar_chunks([bars], batch_size=batch_size, skip_unchanged=skip_unchanged)
 
 
-def download_data_from_rq(vt_symbol, start_date=start, end_date=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())):
+def save_bar_chunks(bar_chunks, batch_size: int = DEFAULT_BATCH_SIZE, skip_unchanged: bool = True) -> int:
+    """
+    流式写入k线，bar_chunks为BarData列表的可迭代对象(如生成器)，逐块转换、去重、写入
+    内存中只保留当前块，每个合约在全部写完后更新一次DbBarOverview
+    :return: 实际写入的k线数
+    """
+    writer = BarWriter(batch_size=batch_size, skip_unchanged=skip_unchanged)
+    try:
+        for bars in bar_chunks:
+            writer.write(bars)
+    finally:
+        writer.close()
+    return writer.count
+
+
+def group_bar_rows(bars) -> dict:
+    """按(symbol, exchange, interval)分组并转换为DbBarData的行"""
+    groups = {}
+    for bar in bars:
+        key = (bar.symbol, bar.exchange.value, bar.interval.value)
+        if key not in groups:
+            groups[key] = []
+        groups[key].append(bar_to_row(bar))
+    return groups
+
+
+class BarWriter:
+    """
+    k线流水线的写入端，每次write一块k线，立即转换、去重并写入，不在内存中累积
+    flush/close时为写入过的合约更新一次DbBarOverview，以及涉及交易日的汇总和多周期k线
+    """
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, skip_unchanged: bool = True):
+        self.batch_size = batch_size
+        self.skip_unchanged = skip_unchanged
+        # (symbol, exchange, interval) -> [start, end, 写入数, 跳过数]
+        self.stats = {}
+        # (symbol, exchange, interval) -> 写入过的交易日
+        self.trading_days = {}
+        self.count = 0
+
+    def write(self, bars):
+        if bars is None or len(bars) < 1:
+            return
+        # 每块k线的去重和写入共用一个连接，写完归还连接池
+        with connection(DbBarData._meta.database):
+            for (symbol, exchange, interval), rows in group_bar_rows(bars).items():
+                total = len(rows)
+                if self.skip_unchanged:
+                    rows = drop_unchanged_rows(symbol, exchange, interval, rows)
+                stat = self.stats.setdefault((symbol, exchange, interval), [None, None, 0, 0])
+                stat[3] += total - len(rows)
+                if len(rows) < 1:
+                    continue
+                write_bar_rows(rows, self.batch_size)
+                start_dt = min(row["datetime"] for row in rows)
+                end_dt = max(row["datetime"] for row in rows)
+                stat[0] = start_dt if stat[0] is None else min(stat[0], start_dt)
+                stat[1] = end_dt if stat[1] is None else max(stat[1], end_dt)
+                stat[2] += len(rows)
+                self.count += len(rows)
+                self.trading_days.setdefault((symbol, exchange, interval), set()).update(
+                    get_trading_days_of_rows(rows))
+
+    def flush(self):
+        """更新已写入合约的DbBarOverview，用于长时间写入过程中保存阶段性结果"""
+        with connection(DbBarData._meta.database):
+            for (symbol, exchange, interval), (start_dt, end_dt, count, skipped) in self.stats.items():
+                if skipped > 0:
+                    logger.info("unchanged bars skipped, symbol=%s, skipped=%s, total=%s"
+                                % (symbol, skipped, count + skipped))
+                if count < 1:
+                    continue
+                update_bar_overview(symbol, exchange, interval, start_dt, end_dt)
+                trading_days = self.trading_days.get((symbol, exchange, interval), [])
+                update_trading_days(symbol, exchange, interval, trading_days)
+                update_resampled_bars(symbol, exchange, interval, trading_days)
+                logger.info("data saved, symbol=%s, total=%s, end=%s" % (symbol, count, end_dt))
+        self.stats = {}
+        self.trading_days = {}
+
+    def close(self):
+        self.flush()
+
+
+def write_bar_rows(rows: list, batch_size: int = DEFAULT_BATCH_SIZE):
+    """在一个事务内写入DbBarData行，重复的k线直接覆盖，不更新DbBarOverview"""
+    # 使用模型当前绑定的数据库，便于切换到其他数据库(如测试用的sqlite)
+    bar_db = DbBarData._meta.database
+    # 直接使用executemany，跳过peewee逐个字段生成SQL的开销，pymysql会将其改写为多行REPLACE语句
+    sql = "REPLACE INTO %s (%s) VALUES (%s)" % (
+        _quote(bar_db, DbBarData._meta.table_name),
+        ", ".join(_quote(bar_db, field) for field in BAR_FIELDS),
+        ", ".join([bar_db.param] * len(BAR_FIELDS)))
+    with connection(bar_db), bar_db.atomic():
+        cursor = bar_db.cursor()
+        for sub_rows in chunked(rows, max(batch_size, 1)):
+            cursor.executemany(sql, [tuple(row[field] for field in BAR_FIELDS) for row in sub_rows])
+
+
+def save_bar_rows(symbol: str, exchange: str, interval: str, rows: list, batch_size: int = DEFAULT_BATCH_SIZE):
+    """将同一合约的DbBarData行写入数据库，重复的k线直接覆盖"""
+    if rows is None or len(rows) < 1:
+        return
+    bar_db = DbBarData._meta.database
+    with connection(bar_db), bar_db.atomic():
+        write_bar_rows(rows, batch_size)
+        update_bar_overview(symbol, exchange, interval,
+                            min(row["datetime"] for row in rows), max(row["datetime"] for row in rows))
+        trading_days = get_trading_days_of_rows(rows)
+        update_trading_days(symbol, exchange, interval, trading_days)
+        update_resampled_bars(symbol, exchange, interval, trading_days)
+    logger.info("data saved, symbol=%s, total=%s, end=%s" % (symbol, len(rows), rows[-1]["datetime"]))
+
+
+def update_bar_overview(symbol: str, exchange: str, interval: str, start_dt: datetime, end_dt: datetime):
+    """写入完成后更新DbBarOverview，每次写入仅统计一次数量"""
+    overview: DbBarOverview = DbBarOverview.get_or_none(
+        DbBarOverview.symbol == symbol,
+        DbBarOverview.exchange == exchange,
+        DbBarOverview.interval == interval,
+    )
+    if overview is None:
+        overview = DbBarOverview()
+        overview.symbol = symbol
+        overview.exchange = exchange
+        overview.interval = interval
+        overview.start = start_dt
+        overview.end = end_dt
+    else:
+        overview.start = min(start_dt, overview.start)
+        overview.end = max(end_dt, overview.end)
+    overview.count = DbBarData.select().where(
+        DbBarData.symbol == symbol,
+        DbBarData.exchange == exchange,
+        DbBarData.interval == interval,
+    ).count()
+    overview.save()
+
+
+def get_rq_client() -> RqdataDatafeed:
+    """进程内只初始化一次米筐客户端"""
+    global _rq_client
+    if _rq_client is None:
+        # 兼容早期版本vnpy
+        SETTINGS["rqdata.username"] = SETTINGS["datafeed.username"] = "xxxxx"
+        SETTINGS["rqdata.password"] = SETTINGS["datafeed.password"] = "xxxxx"
+        rq_client = RqdataDatafeed()
+        rq_client.init()
+        _rq_client = rq_client
+    return _rq_client
+
+
+def to_rq_symbol(vt_symbol):
+    """vnpy格式合约转换为米筐查询使用的(symbol, exchange)"""
     exchange, symbol, month = split_vnpy_format(vt_symbol)
     exchange_code = exchange
     assert exchange_code in mapping_rq
@@ -69,45 +294,97 @@ def download_data_from_rq(vt_symbol, start_date=start, end_date=time.strftime("%
     if exchange == Exchange.CZCE and month != "9999" and month != "8888":
         # 郑商所月份仅有3位，为兼容将4位转为3位
         security_code_inner = symbol + month[-3:]
+    return security_code_inner, exchange
+
+
+def split_date_windows(start_date: datetime, end_date: datetime, chunk_days: int = DEFAULT_CHUNK_DAYS) -> list:
+    """将[start_date, end_date]按chunk_days切分为首尾相接的时间段"""
+    windows = []
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days), end_date)
+        windows.append((chunk_start, chunk_end))
+        if chunk_end >= end_date:
+            break
+        chunk_start = chunk_end
+    return windows
+
+
+def query_rq_window(symbol: str, exchange: Exchange, window_start: datetime, window_end: datetime) -> list:
+    req = HistoryRequest(symbol=symbol, exchange=exchange, start=window_start, end=window_end,
+                         interval=vnpy_frequency)
+    data_list = get_rq_client().query_bar_history(req)
+    return data_list if data_list is not None else []
+
+
+def download_rq_range(symbol: str, exchange: Exchange, start_date: datetime, end_date: datetime,
+                      chunk_days: int = DEFAULT_CHUNK_DAYS, on_chunk=None,
+                      concurrency: int = DEFAULT_RQ_CONCURRENCY) -> int:
+    """
+    按日期分段并发下载，按时间顺序逐段入库
+    同时最多有concurrency段在下载或等待写入，内存占用与总区间长度无关
+    :param on_chunk: 每段入库后的回调，参数为(chunk_start, chunk_end, count)，可用于记录断点
+    :param concurrency: 同时请求的时间段数量，共用进程内同一个米筐客户端
+    :return: 下载的k线总数
+    """
+    # 在主线程中初始化客户端，避免多个线程同时初始化
+    get_rq_client()
+    windows = split_date_windows(start_date, end_date, chunk_days)
+    writer = BarWriter()
+    totals = [0]
+
+    def save_window(window, future):
+        data_list = future.result()
+        # 米筐按日期查询，相邻两段在边界处的重复k线由去重跳过
+        for bars in chunked(data_list, STREAM_CHUNK_SIZE):
+            writer.write(bars)
+        # 记录断点前更新overview
+        writer.flush()
+        logger.info("rq chunk saved, symbol=%s, start=%s, end=%s, count=%s"
+                    % (symbol, window[0], window[1], len(data_list)))
+        totals[0] += len(data_list)
+        if on_chunk is not None:
+            on_chunk(window[0], window[1], len(data_list))
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix="rq-window") as executor:
+        pending = deque()
+        try:
+            for window in windows:
+                pending.append((window, executor.submit(query_rq_window, symbol, exchange, *window)))
+                # 按顺序写入最早提交的时间段，保持在途的时间段数不超过concurrency
+                if len(pending) >= max(concurrency, 1):
+                    save_window(*pending.popleft())
+            while len(pending) > 0:
+                save_window(*pending.popleft())
+        finally:
+            for _, future in pending:
+                future.cancel()
+            writer.close()
+    return totals[0]
+
+
+def download_data_from_rq(vt_symbol, start_date=start, end_date=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())):
+    security_code_inner, exchange = to_rq_symbol(vt_symbol)
     logger.info('security_code= %s' % security_code_inner)
-    database = get_database()
-    # database.db.connect(reuse_if_open=True)
-    with db.atomic():
-        # database.db.ping(reconnect=True)
+    get_database()
+    with connection(DbBarOverview._meta.database):
         overview: DbBarOverview = DbBarOverview.get_or_none(
             DbBarOverview.symbol == security_code_inner,
             DbBarOverview.exchange == exchange.value,
             DbBarOverview.interval == vnpy_frequency.value,
         )
-        logger.info('DbBarOverview= %s' % overview)
-        if overview is not None:
-            # 仅可处理向后新增的数据，如处理历史数据，可直接删除overview
-            start_date = overview.end
-            logger.info("start_date changed, new=%s" % start_date)
-        # 兼容早期版本vnpy
-        SETTINGS["rqdata.username"] = SETTINGS["datafeed.username"] = "xxxxx"
-        SETTINGS["rqdata.password"] = SETTINGS["datafeed.password"] = "xxxxx"
-        rqClient = RqdataDatafeed()
-        rqClient.init()
-        start_date = datetime.strptime(start_date, TIME_FORMAT) if type(start_date) == str else start_date
-        end_date = datetime.strptime(end_date, TIME_FORMAT) if type(end_date) == str else end_date
-        print("start_date=%s" % start_date)
-        print("end_date=%s" % end_date)
-        req = HistoryRequest(symbol=security_code_inner, exchange=exchange,
-                             start=start_date, end=end_date,
-                             interval=vnpy_frequency)
-        data_list = rqClient.query_bar_history(req)
-        if data_list is None or len(data_list) < 1:
-            logger.error("none data returned")
-            return
-        logger.info("start_date=%s" % start_date.replace(tzinfo=pytz.timezone("Etc/GMT-8")))
-        logger.info(data_list[-1].datetime)
-        if len(data_list) < 1:
-            logger.error("all data saved")
-            return
-        logger.info("new_start_data=%s" % data_list[0].datetime)
-        save_bar(data_list)
-        pass
+    logger.info('DbBarOverview= %s' % overview)
+    if overview is not None:
+        # 仅可处理向后新增的数据，如处理历史数据，可直接删除overview
+        start_date = overview.end
+        logger.info("start_date changed, new=%s" % start_date)
+    start_date = datetime.strptime(start_date, TIME_FORMAT) if type(start_date) == str else start_date
+    end_date = datetime.strptime(end_date, TIME_FORMAT) if type(end_date) == str else end_date
+    print("start_date=%s" % start_date)
+    print("end_date=%s" % end_date)
+    total = download_rq_range(security_code_inner, exchange, start_date, end_date)
+    if total < 1:
+        logger.error("none data returned")
 
 
 if __name__ == '__main__':
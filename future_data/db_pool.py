@@ -0,0 +1,112 @@
+import os
+from contextlib import contextmanager
+
+from peewee import Database, DatabaseProxy
+from playhouse.pool import PooledDatabase, PooledMySQLDatabase
+from vnpy.trader.setting import SETTINGS
+from vnpy_mysql import mysql_database
+
+from log.log_init import get_logger
+
+logger = get_logger()
+
+# 连接池配置，可在vt_setting.json中通过同名配置项修改
+# 每个进程最多同时持有的连接数
+DEFAULT_POOL_SIZE = 8
+# 连接建立后超过该时间(秒)在取出或归还时关闭重建，应小于MySQL的wait_timeout(默认8小时)
+DEFAULT_STALE_TIMEOUT = 3600
+# 连接数达到上限时等待其他线程归还连接的时间(秒)
+DEFAULT_WAIT_TIMEOUT = 10
+# 建立连接的超时时间(秒)
+DEFAULT_CONNECT_TIMEOUT = 5
+
+
+def create_pool() -> PooledMySQLDatabase:
+    """按vnpy的数据库配置创建连接池"""
+    return PooledMySQLDatabase(
+        SETTINGS.get("database.database", "vnpy"),
+        user=SETTINGS.get("database.user", "root"),
+        password=SETTINGS.get("database.password", ""),
+        host=SETTINGS.get("database.host", "localhost"),
+        port=int(SETTINGS.get("database.port", 3306)),
+        max_connections=int(SETTINGS.get("database.pool_size", DEFAULT_POOL_SIZE)),
+        stale_timeout=int(SETTINGS.get("database.pool_stale_timeout", DEFAULT_STALE_TIMEOUT)),
+        timeout=int(SETTINGS.get("database.pool_wait_timeout", DEFAULT_WAIT_TIMEOUT)),
+        connect_timeout=int(SETTINGS.get("database.connect_timeout", DEFAULT_CONNECT_TIMEOUT)),
+    )
+
+
+# 本项目的表模型均绑定到该代理，每个进程使用自己的连接池
+pool_db = DatabaseProxy()
+pool_db.initialize(create_pool())
+
+
+class DbBarData(mysql_database.DbBarData):
+    """
+    vnpy_mysql的k线表，本项目的下载、换月等流程通过该模型经连接池读写同一张表
+    vnpy自身的DbBarData不改绑，仍使用vnpy的数据库连接，其事务不受影响
+    """
+
+    class Meta:
+        database = pool_db
+        table_name = mysql_database.DbBarData._meta.table_name
+
+
+class DbBarOverview(mysql_database.DbBarOverview):
+    """vnpy_mysql的k线汇总表，说明同DbBarData"""
+
+    class Meta:
+        database = pool_db
+        table_name = mysql_database.DbBarOverview._meta.table_name
+
+
+def _reset_after_fork():
+    """fork出的子进程换用新的连接池，继承的连接与父进程共用socket，不关闭也不再使用"""
+    pool_db.initialize(create_pool())
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _ping(database: Database) -> bool:
+    """检查当前线程的连接是否存活，sqlite等没有ping的连接视为存活"""
+    ping = getattr(database.connection(), "ping", None)
+    if ping is None:
+        return True
+    try:
+        # 不自动重连，失效的连接由调用方丢弃
+        ping(False)
+    except Exception:
+        return False
+    return True
+
+
+@contextmanager
+def connection(database: Database = None):
+    """
+    取出当前线程的连接，退出时归还(连接池)或关闭
+    当前线程已持有连接时(嵌套调用或事务中)直接复用，由最外层归还
+    事务外取得的连接先ping一次，被服务端按wait_timeout断开的连接丢弃后重新连接
+    :param database: 模型绑定的数据库，默认为连接池，测试时模型可能绑定到其他数据库
+    """
+    database = database if database is not None else pool_db
+    if isinstance(database, DatabaseProxy):
+        database = database.obj
+    opened = database.is_closed()
+    if opened:
+        database.connect()
+    if not database.in_transaction() and not _ping(database):
+        logger.info("database connection lost, reconnecting")
+        if isinstance(database, PooledDatabase):
+            database.manual_close()
+        else:
+            database.close()
+        database.connect()
+        opened = True
+    try:
+        yield database
+    finally:
+        if opened and not database.is_closed() and not database.in_transaction():
+            database.close()
+
@@ -13,7 +13,8 @@ from vnpy_ctp import CtpGateway
 
 from log.log_init import get_logger
 from future_data.data_downloader import download_data
-from future_data.tq_data_downloader import download_from_tq
+from future_data.tq_data_downloader import download_from_tq, DEFAULT_WORKERS, DEFAULT_QUEUE_SIZE
+from future_data.tq_data_service import DataServiceClient, DataServiceTimeout
 # from util.main_contract_detector import check_all_symbol_main_contract
 # from util.message_alert import ding_message
 
@@ -49,6 +50,8 @@ def get_instance_for_manual():
     cta_task = DownloadDataTask(times=[time(15, 30), time(3, 45)], vt_symbols=vt_symbols)
     cta_task.default_download_size = 2000
     cta_task.download_new_main_contract = False
+    # 合约较多，加大并发以确保在触发窗口内完成
+    cta_task.download_workers = 8
     return cta_task
 
 
@@ -75,16 +78,23 @@ def get_instance_for_portfolio():
     return portfolio_cta_task
 
 
-def run_child(vt_symbols, download_size, download_new_main_contract):
+def get_download_size(download_size, now: datetime):
+    """开盘前的下载仅需补齐少量数据"""
+    download_for_day_open = now.time() >= DAY_OPEN >= (now - timedelta(minutes=30)).time()
+    return 30 if download_for_day_open else download_size
+
+
+def run_child(vt_symbols, download_size, download_new_main_contract, incremental=True,
+              workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE):
     try:
         while True:
             now = datetime.now()
             logger.info("-------------start download-------------")
             if API_SOURCE == ApiSource.TQ:
-                download_for_day_open = now.time() >= DAY_OPEN >= (now - timedelta(minutes=30)).time()
-                size = 30 if download_for_day_open else download_size
+                size = get_download_size(download_size, now)
                 logger.info("-------------start download TQ-------------")
-                download_from_tq(vt_symbols, size=size)
+                download_from_tq(vt_symbols, size=size, incremental=incremental,
+                                 workers=workers, queue_size=queue_size)
                 logger.info("-------------end download TQ-------------")
                 # if not download_for_day_open and download_new_main_contract:
                 #     logger.info("-------------start download new main contract TQ-------------")
@@ -122,6 +132,13 @@ class DownloadDataTask:
         self.default_download_size = 1000
         # 是否需要检测并自动下载新的主力合约
         self.download_new_main_contract = True
+        # 是否按已入库数据的最后时间增量下载，default_download_size作为单次下载的上限
+        self.incremental_download = True
+        # 并发下载的线程数(每个线程一个天勤连接)，以及已下载待写入数据库的k线块数上限
+        self.download_workers = DEFAULT_WORKERS
+        self.download_queue_size = DEFAULT_QUEUE_SIZE
+        # 是否优先交由常驻数据服务下载，复用其已登录的天勤连接，服务不可用时仍开启子进程下载
+        self.use_data_service = False
 
     def download(self):
         try:
@@ -146,32 +163,62 @@ class DownloadDataTask:
             if self.done:
                 # self.logger.info("self.done")
                 return
-            # copy配置项，避免添加配置文件中的选项后导致数组无限增加
-            vt_symbols = self.vt_symbols[:]
-            # 根据engine读取对应的配置文件并添加到待下载列表
-            if self.engine is not None:
-                strategy_setting = load_json(self.engine.setting_filename)
-                for strategy_name, strategy_config in strategy_setting.items():
-                    if "vt_symbol" in strategy_config and strategy_config["vt_symbol"] not in vt_symbols:
-                        vt_symbols.append(strategy_config["vt_symbol"])
-                    if "vt_symbols" in strategy_config:
-                        for vt_symbol in strategy_config["vt_symbols"]:
-                            if vt_symbol not in vt_symbols:
-                                vt_symbols.append(vt_symbol)
-            if len(vt_symbols) < 1:
-                logger.info("len(vt_symbols) < 1")
-                return
-            # 开启子进程单独下载。因tqsdk是一个阻塞api，如在当前进程开启，流程会被挂起
-            logger.info("start download, vts= %s" % vt_symbols)
-            child_process = multiprocessing.Process(target=run_child, args=(
-                vt_symbols, self.default_download_size, self.download_new_main_contract))
-            child_process.start()
-            # 等待子进程结束，确保下载数据完成再执行策略启动等动作
-            child_process.join()
+            self.run_download()
             self.done = True
         except Exception as e:
             logger.error(e, stack_info=True, exc_info=True)
 
+    def run_download(self):
+        """立即执行一次下载，不检查任务时间，由download或调度器调用，异常直接抛出"""
+        if self.engine is None and len(self.vt_symbols) < 1:
+            logger.info("self.engine is None and self.vt_symbols is empty")
+            return
+        # copy配置项，避免添加配置文件中的选项后导致数组无限增加
+        vt_symbols = self.vt_symbols[:]
+        # 根据engine读取对应的配置文件并添加到待下载列表
+        if self.engine is not None:
+            strategy_setting = load_json(self.engine.setting_filename)
+            for strategy_name, strategy_config in strategy_setting.items():
+                if "vt_symbol" in strategy_config and strategy_config["vt_symbol"] not in vt_symbols:
+                    vt_symbols.append(strategy_config["vt_symbol"])
+                if "vt_symbols" in strategy_config:
+                    for vt_symbol in strategy_config["vt_symbols"]:
+                        if vt_symbol not in vt_symbols:
+                            vt_symbols.append(vt_symbol)
+        if len(vt_symbols) < 1:
+            logger.info("len(vt_symbols) < 1")
+            return
+        if self.use_data_service and API_SOURCE == ApiSource.TQ and self.download_by_service(vt_symbols):
+            return
+        # 开启子进程单独下载。因tqsdk是一个阻塞api，如在当前进程开启，流程会被挂起
+        logger.info("start download, vts= %s" % vt_symbols)
+        child_process = multiprocessing.Process(target=run_child, args=(
+            vt_symbols, self.default_download_size, self.download_new_main_contract, self.incremental_download,
+            self.download_workers, self.download_queue_size))
+        child_process.start()
+        # 等待子进程结束，确保下载数据完成再执行策略启动等动作
+        child_process.join()
+
+    def download_by_service(self, vt_symbols) -> bool:
+        """
+        通过数据服务下载，服务不可用时返回False
+        等待超时时服务仍在下载同一批合约，先等服务处理完再返回False由子进程补下载，避免两边同时写入
+        服务在等待时间内仍未完成时抛出DataServiceTimeout，本次不再下载
+        """
+        client = DataServiceClient()
+        try:
+            logger.info("start download by data service, vts= %s" % vt_symbols)
+            client.download(vt_symbols, size=get_download_size(self.default_download_size, datetime.now()),
+                            incremental=self.incremental_download, queue_size=self.download_queue_size)
+            return True
+        except DataServiceTimeout as e:
+            logger.info(e)
+            client.wait_idle()
+            return False
+        except ConnectionError as e:
+            logger.info(e)
+            return False
+
     def close(self):
         # 关闭engine等资源
         if self.engine is not None and self.engine.main_engine is not None:
@@ -0,0 +1,235 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from vnpy.trader.utility import load_json, save_json
+
+from log.log_init import get_logger
+
+logger = get_logger()
+
+DEFAULT_HISTORY_FILE = "job_history.json"
+DEFAULT_MAX_WORKERS = 4
+# 每个任务保留的运行记录数
+HISTORY_SIZE = 20
+# 与原轮询方式一致，触发时间过后10分钟内启动仍视为准时
+DEFAULT_MISFIRE_GRACE = timedelta(minutes=10)
+# 重启后最多补跑多久以前错过的触发
+DEFAULT_CATCH_UP_LIMIT = timedelta(days=1)
+# 调度线程最长休眠时间，避免系统休眠或调整时钟后错过触发
+MAX_WAIT_SECONDS = 60
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class CronTrigger:
+    """
+    按每天的固定时间点触发，可限定星期
+    :param times: 触发时间点列表
+    :param weekdays: 允许触发的星期，0为周一，None为每天
+    """
+
+    def __init__(self, times: list, weekdays: list = None):
+        self.times = sorted(times)
+        self.weekdays = None if weekdays is None else set(weekdays)
+
+    def get_fire_times(self, start: datetime, end: datetime) -> list:
+        """返回(start, end]内的全部触发时间"""
+        fire_times = []
+        day = start.date()
+        while day <= end.date():
+            if self.weekdays is None or day.weekday() in self.weekdays:
+                for t in self.times:
+                    fire_time = datetime.combine(day, t)
+                    if start < fire_time <= end:
+                        fire_times.append(fire_time)
+            day += timedelta(days=1)
+        return fire_times
+
+    def next_fire_time(self, after: datetime):
+        """返回晚于after的下一个触发时间，无可触发时间时返回None"""
+        if len(self.times) < 1:
+            return None
+        fire_times = self.get_fire_times(after, after + timedelta(days=8))
+        return fire_times[0] if len(fire_times) > 0 else None
+
+
+class Job:
+
+    def __init__(self, name: str, func, trigger: CronTrigger, misfire_grace: timedelta = DEFAULT_MISFIRE_GRACE,
+                 catch_up: bool = True):
+        self.name = name
+        self.func = func
+        self.trigger = trigger
+        self.misfire_grace = misfire_grace
+        # 重启后是否补跑停机期间错过的触发，多次错过只补跑一次
+        self.catch_up = catch_up
+        self.next_fire_time = None
+        self.running = False
+
+
+class JobScheduler:
+    """
+    定时任务调度器，替代主进程中每5秒轮询各任务的方式
+    调度线程休眠到最近的触发时间，到点后将任务交给线程池执行，各任务互不阻塞
+    同一任务上次未结束时跳过本次触发，运行记录保存在json文件中，重启后据此补跑错过的触发
+    """
+
+    def __init__(self, history_file: str = DEFAULT_HISTORY_FILE, max_workers: int = DEFAULT_MAX_WORKERS):
+        self.history_file = history_file
+        self.jobs = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.lock = threading.RLock()
+        # 任务执行结束或被提交时通知wait_job
+        self.changed = threading.Condition(self.lock)
+        self.wakeup = threading.Event()
+        self.active = False
+        self.thread = None
+        self.history = load_json(history_file)
+
+    def add_job(self, name: str, func, times: list, weekdays: list = None,
+                misfire_grace: timedelta = DEFAULT_MISFIRE_GRACE, catch_up: bool = True) -> Job:
+        job = Job(name, func, CronTrigger(times, weekdays), misfire_grace, catch_up)
+        with self.lock:
+            self.jobs[name] = job
+        if self.active:
+            self._schedule(job, datetime.now())
+            self.wakeup.set()
+        return job
+
+    def start(self):
+        if self.active:
+            return
+        self.active = True
+        now = datetime.now()
+        for job in list(self.jobs.values()):
+            self._schedule(job, now)
+        self.thread = threading.Thread(target=self._run, name="job-scheduler", daemon=True)
+        self.thread.start()
+        logger.info("job scheduler started, jobs=%s" % list(self.jobs))
+
+    def stop(self, wait: bool = True):
+        self.active = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.executor.shutdown(wait=wait)
+        logger.info("job scheduler stopped")
+
+    def _schedule(self, job: Job, now: datetime):
+        """计算下一次触发时间，并补跑错过的触发"""
+        missed = self._get_missed_fire_time(job, now)
+        if missed is not None:
+            logger.info("catch up missed job %s, fire_time=%s" % (job.name, missed))
+            self._submit(job, missed)
+        job.next_fire_time = job.trigger.next_fire_time(now)
+
+    def _get_missed_fire_time(self, job: Job, now: datetime):
+        """返回最近一次错过的触发时间，无运行记录时只检查宽限时间内的触发，与原轮询方式一致"""
+        record = self.history.get(job.name)
+        if job.catch_up and record is not None and record.get("last_fire_time"):
+            since = max(datetime.strptime(record["last_fire_time"], TIME_FORMAT), now - DEFAULT_CATCH_UP_LIMIT)
+        else:
+            since = now - job.misfire_grace
+        fire_times = job.trigger.get_fire_times(since, now)
+        return fire_times[-1] if len(fire_times) > 0 else None
+
+    def _run(self):
+        while self.active:
+            now = datetime.now()
+            next_times = []
+            for job in list(self.jobs.values()):
+                if job.next_fire_time is not None and job.next_fire_time <= now:
+                    if now - job.next_fire_time <= job.misfire_grace:
+                        self._submit(job, job.next_fire_time)
+                    else:
+                        logger.warning("job %s misfired, fire_time=%s" % (job.name, job.next_fire_time))
+                    with self.lock:
+                        job.next_fire_time = job.trigger.next_fire_time(now)
+                        self.changed.notify_all()
+                if job.next_fire_time is not None:
+                    next_times.append(job.next_fire_time)
+            wait = MAX_WAIT_SECONDS
+            if len(next_times) > 0:
+                wait = min(wait, max((min(next_times) - datetime.now()).total_seconds(), 0))
+            self.wakeup.wait(wait)
+            self.wakeup.clear()
+
+    def _submit(self, job: Job, fire_time: datetime):
+        with self.lock:
+            if job.running:
+                logger.warning("job %s is still running, skip fire_time=%s" % (job.name, fire_time))
+                self._record(job, fire_time, None, None, "skipped")
+                return
+            job.running = True
+        self.executor.submit(self._execute, job, fire_time)
+
+    def _execute(self, job: Job, fire_time: datetime):
+        start = datetime.now()
+        status = "success"
+        try:
+            logger.info("job %s started, fire_time=%s" % (job.name, fire_time))
+            job.func()
+        except (Exception, RuntimeError) as e:
+            status = "error: %s" % e
+            logger.error(e, stack_info=True, exc_info=True)
+        finally:
+            with self.lock:
+                job.running = False
+                self.changed.notify_all()
+            self._record(job, fire_time, start, datetime.now(), status)
+            logger.info("job %s finished, status=%s, cost=%s" % (job.name, status, datetime.now() - start))
+
+    def _record(self, job: Job, fire_time: datetime, start: datetime, end: datetime, status: str):
+        with self.lock:
+            record = self.history.setdefault(job.name, {"last_fire_time": None, "runs": []})
+            fire_time_str = fire_time.strftime(TIME_FORMAT)
+            if record["last_fire_time"] is None or record["last_fire_time"] < fire_time_str:
+                record["last_fire_time"] = fire_time_str
+            record["runs"].append({
+                "fire_time": fire_time_str,
+                "start": start.strftime(TIME_FORMAT) if start is not None else None,
+                "end": end.strftime(TIME_FORMAT) if end is not None else None,
+                "status": status,
+            })
+            record["runs"] = record["runs"][-HISTORY_SIZE:]
+            save_json(self.history_file, self.history)
+
+    def is_pending(self, name: str) -> bool:
+        """任务正在执行，或已到触发时间但调度线程尚未提交"""
+        job = self.jobs.get(name)
+        if job is None:
+            return False
+        return job.running or (job.next_fire_time is not None and job.next_fire_time <= datetime.now())
+
+    def wait_job(self, name: str, timeout: float) -> bool:
+        """
+        等待任务当前这次执行结束，用于有先后依赖的流程(如下载完成后再启动策略)
+        :return: 是否在超时前结束，任务未在执行且未到触发时间时立即返回True
+        """
+        with self.changed:
+            return self.changed.wait_for(lambda: not self.is_pending(name), timeout=timeout)
+
+    def wait_jobs(self, names: list, timeout: float) -> bool:
+        """依次等待多个任务当前这次执行结束，共用同一个超时时间，返回是否全部在超时前结束"""
+        deadline = time.time() + timeout
+        for name in names:
+            if not self.wait_job(name, max(deadline - time.time(), 0)):
+                return False
+        return True
+
+    def get_history(self, name: str) -> list:
+        with self.lock:
+            return list(self.history.get(name, {}).get("runs", []))
+
+
+if __name__ == '__main__':
+    scheduler = JobScheduler(history_file="test_" + DEFAULT_HISTORY_FILE)
+    now_time = datetime.now()
+    scheduler.add_job("hello", lambda: print("hello", datetime.now()),
+                      times=[(now_time + timedelta(seconds=s)).time().replace(microsecond=0) for s in (3, 6)])
+    scheduler.start()
+    threading.Event().wait(8)
+    scheduler.stop()
+    print(scheduler.get_history("hello"))
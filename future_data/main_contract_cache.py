@@ -0,0 +1,190 @@
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from vnpy.trader.utility import get_file_path
+
+from future_data.tq_data_service import get_main_contract_from_service
+from log.log_init import get_logger
+from util.trading_period import get_trading_day
+from util.vt_symbol_util import split_vnpy_format
+
+logger = get_logger()
+
+CACHE_FILE = "main_contract_cache.json"
+DEFAULT_TTL = timedelta(days=1)
+# 刷新锁超过该时间视为持有者已退出，可被其他进程接管；等待锁的最长时间相同
+LOCK_TIMEOUT_SECONDS = 60
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+DATE_FORMAT = "%Y-%m-%d"
+
+
+def get_product(vt_symbol: str) -> str:
+    """vnpy格式合约对应的品种，如rb2301.SHFE -> rb.SHFE"""
+    exchange, code, month = split_vnpy_format(vt_symbol)
+    return "%s.%s" % (code, exchange)
+
+
+class MainContractCache:
+    """
+    品种->当前主力合约的本地缓存，多个进程共用同一个json文件
+    每个品种记录主力合约、发现换月的日期、刷新时间及所属交易日，
+    同一交易日内且未超过ttl时直接读取缓存，否则批量向天勤查询过期的品种
+    文件未变化时直接使用进程内已解析的结果，读取只需一次stat
+    """
+
+    def __init__(self, path: str = None, ttl: timedelta = DEFAULT_TTL, loader=None):
+        self.path = path if path is not None else str(get_file_path(CACHE_FILE))
+        self.ttl = ttl
+        # 查询主力合约的方法，参数为vt_symbols，返回{vt_symbol: 主力合约}
+        self.loader = loader if loader is not None else self._load_from_tq
+        self._mtime = None
+        self._data = {}
+
+    @staticmethod
+    def _load_from_tq(vt_symbols) -> dict:
+        return get_main_contract_from_service(vt_symbols, include_the_same=True)
+
+    def read(self) -> dict:
+        """
+        读取全部缓存 {品种: {main, detected_date, updated, trading_day}}
+        detected_date为本缓存刷新时发现主力合约变化的日期，不是天勤实际切换主力的日期，
+        两次刷新之间发生的换月按下一次刷新的日期记录
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        if mtime != self._mtime:
+            with open(self.path, "r") as f:
+                self._data = json.load(f)
+            self._mtime = mtime
+        return self._data
+
+    def is_fresh(self, entry: dict, now: datetime = None) -> bool:
+        if entry is None:
+            return False
+        now = now if now is not None else datetime.now()
+        updated = datetime.strptime(entry["updated"], TIME_FORMAT)
+        return entry["trading_day"] == get_trading_day(now).strftime(DATE_FORMAT) and now - updated < self.ttl
+
+    def get(self, vt_symbol: str):
+        """返回vt_symbol所属品种的当前主力合约"""
+        return self.get_main_contracts([vt_symbol])[vt_symbol]
+
+    def get_main_contracts(self, vt_symbols) -> dict:
+        """:return: {vt_symbol: 当前主力合约}，过期或缺失的品种合并为一次查询"""
+        vt_symbols = list(vt_symbols)
+        data = self.read()
+        stale = [vt_symbol for vt_symbol in vt_symbols if not self.is_fresh(data.get(get_product(vt_symbol)))]
+        if len(stale) > 0:
+            data = self.refresh(stale)
+        return {vt_symbol: data[get_product(vt_symbol)]["main"] for vt_symbol in vt_symbols
+                if get_product(vt_symbol) in data}
+
+    def get_main_contract(self, vt_symbols, include_the_same=False) -> dict:
+        """与main_contract_detector.get_main_contract返回格式一致"""
+        main_contracts = self.get_main_contracts(vt_symbols)
+        return {vt_symbol: main for vt_symbol, main in main_contracts.items()
+                if include_the_same or main != vt_symbol}
+
+    def refresh(self, vt_symbols) -> dict:
+        """查询并写入vt_symbols所属品种的主力合约，其他进程正在刷新时等待其完成"""
+        lock_path = self.path + ".lock"
+        token = self._acquire(lock_path)
+        try:
+            # 等待期间其他进程可能已刷新
+            data = self.read()
+            if all(self.is_fresh(data.get(get_product(vt_symbol))) for vt_symbol in vt_symbols):
+                return data
+            if token is None:
+                # 持有者仍在刷新且未超时，本次不持锁查询，文件整体替换，不会写坏
+                logger.info("main contract cache lock busy, refresh without lock")
+            main_contracts = self.loader(list(vt_symbols))
+            now = datetime.now()
+            data = dict(self.read())
+            for vt_symbol, main in main_contracts.items():
+                product = get_product(vt_symbol)
+                entry = data.get(product)
+                detected_date = entry.get("detected_date", entry.get("changed_date")) if entry is not None else None
+                if entry is not None and entry["main"] != main:
+                    detected_date = now.strftime(DATE_FORMAT)
+                    logger.info("main contract changed, %s: %s -> %s" % (product, entry["main"], main))
+                data[product] = {"main": main, "detected_date": detected_date, "updated": now.strftime(TIME_FORMAT),
+                                 "trading_day": get_trading_day(now).strftime(DATE_FORMAT)}
+            self._write(data)
+            return data
+        finally:
+            if token is not None:
+                self._release(lock_path, token)
+
+    @staticmethod
+    def _read_token(lock_path: str):
+        try:
+            with open(lock_path, "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _acquire(self, lock_path: str):
+        """
+        创建锁文件并写入本进程的标识，已被其他进程持有时等待其释放
+        锁超过LOCK_TIMEOUT_SECONDS未释放时视为持有者已退出，接管该锁
+        :return: 锁标识，等待超时返回None
+        """
+        token = "%s:%s" % (os.getpid(), uuid.uuid4().hex)
+        deadline = time.time() + LOCK_TIMEOUT_SECONDS
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                with os.fdopen(fd, "w") as f:
+                    f.write(token)
+                return token
+            except FileExistsError:
+                pass
+            try:
+                expired = time.time() - os.path.getmtime(lock_path) > LOCK_TIMEOUT_SECONDS
+            except FileNotFoundError:
+                continue
+            if expired:
+                # 只删除确认过期的那个锁，避免删掉其他进程刚接管的新锁
+                owner = self._read_token(lock_path)
+                logger.info("main contract cache lock expired, owner=%s" % owner)
+                self._release(lock_path, owner)
+                continue
+            if time.time() > deadline:
+                return None
+            time.sleep(0.1)
+
+    def _release(self, lock_path: str, token: str):
+        """只删除标识一致的锁文件"""
+        if token is None or self._read_token(lock_path) != token:
+            return
+        try:
+            os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+
+    def _write(self, data: dict):
+        tmp_path = "%s.%s.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, self.path)
+        self._data = data
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+
+_cache: MainContractCache = None
+
+
+def get_main_contract_cache() -> MainContractCache:
+    global _cache
+    if _cache is None:
+        _cache = MainContractCache()
+    return _cache
+
+
+if __name__ == '__main__':
+    print(get_main_contract_cache().get_main_contract(["rb2301.SHFE", "i2301.DCE"], include_the_same=True))
@@ -0,0 +1,84 @@
+from collections import deque
+
+from vnpy.trader.constant import Direction, Offset
+from vnpy.trader.object import TradeData
+
+from future_data.trade_data import DbTradeData, TradeStatus, get_unclosed_trades_of_strategy, \
+    submit_closed_volume, get_trade_writer
+
+# 初始化时等待未写入交易记录的最长时间(秒)
+DEFAULT_LOAD_TIMEOUT = 30.0
+
+
+class PositionLedger:
+    """
+    单个策略的持仓明细，按(合约, 方向)保存未完全平仓的开仓成交，平仓时先进先出匹配
+    初始化时从数据库读取一次，之后只在内存中匹配，开仓记录的平仓进度由后台线程写回DbTradeData
+    明细中的元素为DbTradeData(启动前的开仓，带主键id)或TradeData(本次运行的开仓)，均带有closed_volume和status
+    """
+
+    def __init__(self, strategy_name: str, persist: bool = True):
+        self.strategy_name = strategy_name
+        # 是否将平仓进度写回数据库，回测时不写入
+        self.persist = persist
+        # (vt_symbol, 方向名称) -> deque
+        self.positions = {}
+
+    def load(self):
+        """从数据库读取策略全部未平仓的开仓记录，先等待上次退出时未写入的交易记录写入完成"""
+        get_trade_writer().flush(DEFAULT_LOAD_TIMEOUT)
+        self.positions = {}
+        for db_trade in get_unclosed_trades_of_strategy(self.strategy_name):
+            self._get_queue(db_trade.symbol, db_trade.direction).append(db_trade)
+
+    def _get_queue(self, vt_symbol: str, direction: str) -> deque:
+        key = (vt_symbol, direction)
+        queue = self.positions.get(key)
+        if queue is None:
+            queue = self.positions[key] = deque()
+        return queue
+
+    def get_open_trades(self, vt_symbol: str, direction: Direction) -> list:
+        return list(self._get_queue(vt_symbol, direction.name))
+
+    def get_open_volume(self, vt_symbol: str, direction: Direction) -> int:
+        return sum(t.volume - t.closed_volume for t in self._get_queue(vt_symbol, direction.name))
+
+    def update_trade(self, trade: TradeData) -> list:
+        """
+        记录新的成交，开仓加入明细，平仓按先进先出匹配反方向的开仓
+        :return: 平仓匹配结果[(开仓记录, 匹配手数)]，开仓时为空
+        """
+        trade.closed_volume = 0
+        trade.status = TradeStatus.UN_CLOSED.value
+        if trade.offset == Offset.NONE:
+            return []
+        if trade.offset == Offset.OPEN:
+            self._get_queue(trade.vt_symbol, trade.direction.name).append(trade)
+            return []
+        direction = Direction.SHORT if trade.direction == Direction.LONG else Direction.LONG
+        queue = self._get_queue(trade.vt_symbol, direction.name)
+        matches = []
+        while len(queue) > 0 and trade.closed_volume < trade.volume:
+            last_trade = queue[0]
+            # 按较小值匹配当前成交量与开仓数据未平仓量
+            c_volume = min(last_trade.volume - last_trade.closed_volume, trade.volume - trade.closed_volume)
+            last_trade.closed_volume += c_volume
+            trade.closed_volume += c_volume
+            if last_trade.volume <= last_trade.closed_volume:
+                last_trade.status = TradeStatus.CLOSED.value
+                queue.popleft()
+            if self.persist:
+                self._submit_closed_volume(trade.vt_symbol, last_trade)
+            matches.append((last_trade, c_volume))
+        return matches
+
+    def _submit_closed_volume(self, vt_symbol: str, last_trade):
+        """从数据库读取的开仓按主键更新，本次运行的开仓尚无主键，按委托编号和保存的成交时间定位"""
+        if isinstance(last_trade, DbTradeData):
+            submit_closed_volume(self.strategy_name, vt_symbol, last_trade.tradeid, last_trade.closed_volume,
+                                 last_trade.status, trade_id=last_trade.id)
+            return
+        submit_closed_volume(self.strategy_name, vt_symbol, last_trade.tradeid, last_trade.closed_volume,
+                             last_trade.status, orderid=last_trade.orderid,
+                             trade_datetime=getattr(last_trade, "db_datetime", last_trade.datetime))
@@ -0,0 +1,81 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from future_data.db_pool import connection
+from future_data.trade_data import DbRoundTrip, create_round_trip_table
+
+ROUND_TRIP_FIELDS = ["strategy_name", "symbol", "direction", "open_tradeid", "close_tradeid", "open_price",
+                     "close_price", "volume", "gross_pnl", "net_pnl", "capital", "open_datetime", "close_datetime",
+                     "holding_seconds"]
+
+
+def load_round_trips(strategy_name: str = None, start: datetime = None, end: datetime = None) -> pd.DataFrame:
+    """
+    按(策略, 平仓时间)索引顺序读取开平仓盈亏，不指定策略时读取全部策略
+    :param start: 平仓时间不早于start
+    :param end: 平仓时间早于end
+    """
+    create_round_trip_table()
+    query = DbRoundTrip.select(*[getattr(DbRoundTrip, f) for f in ROUND_TRIP_FIELDS])
+    if strategy_name is not None:
+        query = query.where(DbRoundTrip.strategy_name == strategy_name)
+    if start is not None:
+        query = query.where(DbRoundTrip.close_datetime >= start)
+    if end is not None:
+        query = query.where(DbRoundTrip.close_datetime < end)
+    query = query.order_by(DbRoundTrip.strategy_name, DbRoundTrip.close_datetime).tuples()
+    with connection(DbRoundTrip._meta.database):
+        records = list(query)
+    return pd.DataFrame(records, columns=ROUND_TRIP_FIELDS)
+
+
+def get_equity_curve(strategy_name: str, start: datetime = None, end: datetime = None) -> pd.DataFrame:
+    """
+    策略的资金曲线，以平仓时间为索引
+    :return: 列为net_pnl(单笔盈亏)、equity(累计盈亏)、capital(平仓后资金)、drawdown(累计盈亏回撤)
+    """
+    df = load_round_trips(strategy_name, start, end)
+    return to_equity_curve(df)
+
+
+def to_equity_curve(df: pd.DataFrame) -> pd.DataFrame:
+    curve = df[["close_datetime", "net_pnl", "capital"]].set_index("close_datetime")
+    curve["equity"] = curve["net_pnl"].cumsum()
+    curve["drawdown"] = curve["equity"] - curve["equity"].cummax().clip(lower=0)
+    return curve
+
+
+def calculate_stats(df: pd.DataFrame) -> dict:
+    """单个策略的开平仓统计，df为按平仓时间排序的盈亏记录"""
+    if len(df) < 1:
+        return {"count": 0}
+    net_pnl = df["net_pnl"].to_numpy()
+    profit = net_pnl[net_pnl > 0].sum()
+    loss = -net_pnl[net_pnl < 0].sum()
+    curve = to_equity_curve(df)
+    return {
+        "count": len(df),
+        "volume": int(df["volume"].sum()),
+        "win_rate": float((net_pnl > 0).mean()),
+        "gross_pnl": float(df["gross_pnl"].sum()),
+        "net_pnl": float(net_pnl.sum()),
+        "avg_net_pnl": float(net_pnl.mean()),
+        "profit_factor": float(profit / loss) if loss > 0 else np.inf,
+        "max_drawdown": float(curve["drawdown"].min()),
+        "avg_holding_hours": float(df["holding_seconds"].mean() / 3600),
+        "start": df["close_datetime"].iloc[0],
+        "end": df["close_datetime"].iloc[-1],
+    }
+
+
+def get_strategy_stats(strategy_name: str = None, start: datetime = None, end: datetime = None) -> pd.DataFrame:
+    """各策略的开平仓统计，一次读取全部记录后按策略分组计算，每个策略一行"""
+    df = load_round_trips(strategy_name, start, end)
+    stats = {name: calculate_stats(group) for name, group in df.groupby("strategy_name", sort=False)}
+    return pd.DataFrame.from_dict(stats, orient="index")
+
+
+if __name__ == '__main__':
+    print(get_strategy_stats())
@@ -0,0 +1,166 @@
+import atexit
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from vnpy.trader.object import TickData
+from vnpy.trader.utility import get_folder_path
+
+from log.log_init import get_logger
+
+logger = get_logger()
+
+# 定长记录格式，datetime为tick自带时区下的本地时间
+TICK_DTYPE = np.dtype([
+    ("datetime", "M8[us]"),
+    ("last_price", "<f8"),
+    ("volume", "<f8"),
+    ("turnover", "<f8"),
+    ("open_interest", "<f8"),
+    ("bid_price_1", "<f8"),
+    ("bid_volume_1", "<f8"),
+    ("ask_price_1", "<f8"),
+    ("ask_volume_1", "<f8"),
+])
+# 每个合约在内存中最多缓存的tick数量，写入跟不上时丢弃最早的tick
+DEFAULT_BUFFER_SIZE = 100000
+# 定时写入间隔(秒)
+DEFAULT_FLUSH_INTERVAL = 1.0
+# 单个合约缓存达到该数量时提前唤醒写入线程
+DEFAULT_FLUSH_BATCH = 5000
+
+
+class TickRecorder:
+    """
+    tick记录器，行情回调中仅将tick转为元组放入该合约的环形缓冲区，不做任何IO
+    后台线程定时批量取出并按合约、日期追加写入定长二进制文件，可用np.memmap直接读取
+    """
+
+    def __init__(self, root: str = None, buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, flush_batch: int = DEFAULT_FLUSH_BATCH):
+        self.root = root if root is not None else str(get_folder_path("tick_data"))
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.buffers = {}
+        self.wakeup = threading.Event()
+        self.flush_lock = threading.Lock()
+        self.active = False
+        self.thread = None
+        # 统计
+        self.recorded = 0
+        self.written = 0
+        self.dropped = {}
+        self.flush_count = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    def start(self):
+        if self.active:
+            return
+        self.active = True
+        self.thread = threading.Thread(target=self._run, name="tick-recorder", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """停止写入线程并写入剩余的tick"""
+        self.active = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def record(self, tick: TickData):
+        buffer = self.buffers.get(tick.vt_symbol)
+        if buffer is None:
+            buffer = self.buffers.setdefault(tick.vt_symbol, deque(maxlen=self.buffer_size))
+        if len(buffer) >= self.buffer_size:
+            self.dropped[tick.vt_symbol] = self.dropped.get(tick.vt_symbol, 0) + 1
+        buffer.append((tick.datetime.replace(tzinfo=None), tick.last_price, tick.volume, tick.turnover,
+                       tick.open_interest, tick.bid_price_1, tick.bid_volume_1, tick.ask_price_1,
+                       tick.ask_volume_1))
+        self.recorded += 1
+        if len(buffer) >= self.flush_batch:
+            self.wakeup.set()
+
+    def _run(self):
+        while self.active:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(e, stack_info=True, exc_info=True)
+
+    def flush(self):
+        """取出全部缓存的tick并写入文件"""
+        with self.flush_lock:
+            start = time.perf_counter()
+            written = 0
+            for vt_symbol, buffer in list(self.buffers.items()):
+                count = len(buffer)
+                if count < 1:
+                    continue
+                # deque的popleft是线程安全的，取出期间新到的tick留到下次写入
+                records = np.array([buffer.popleft() for _ in range(count)], dtype=TICK_DTYPE)
+                self._append(vt_symbol, records)
+                written += count
+            if written < 1:
+                return
+            self.written += written
+            self.flush_count += 1
+            self.last_flush_latency = time.perf_counter() - start
+            self.max_flush_latency = max(self.max_flush_latency, self.last_flush_latency)
+
+    def _append(self, vt_symbol: str, records: np.ndarray):
+        days = records["datetime"].astype("M8[D]")
+        for day in np.unique(days):
+            path = self.get_path(vt_symbol, str(day).replace("-", ""))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 截掉中断写入留下的不完整尾部记录后再追加
+            if os.path.exists(path) and os.path.getsize(path) % TICK_DTYPE.itemsize != 0:
+                with open(path, "r+b") as f:
+                    f.truncate(os.path.getsize(path) // TICK_DTYPE.itemsize * TICK_DTYPE.itemsize)
+            with open(path, "ab") as f:
+                f.write(records[days == day].tobytes())
+
+    def get_path(self, vt_symbol: str, day: str) -> str:
+        """:param day: 日期，格式为YYYYMMDD"""
+        return os.path.join(self.root, vt_symbol, "%s.bin" % day)
+
+    def load(self, vt_symbol: str, day: str) -> np.ndarray:
+        """只读打开某合约一天的tick，文件不存在时返回空数组"""
+        path = self.get_path(vt_symbol, day)
+        if not os.path.exists(path) or os.path.getsize(path) < TICK_DTYPE.itemsize:
+            return np.empty(0, dtype=TICK_DTYPE)
+        return np.memmap(path, dtype=TICK_DTYPE, mode="r", shape=(os.path.getsize(path) // TICK_DTYPE.itemsize,))
+
+    def get_stats(self) -> dict:
+        return {
+            "recorded": self.recorded,
+            "written": self.written,
+            "buffered": sum(len(buffer) for buffer in list(self.buffers.values())),
+            "dropped": sum(self.dropped.values()),
+            "dropped_by_symbol": dict(self.dropped),
+            "flush_count": self.flush_count,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+        }
+
+
+_recorder: TickRecorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_tick_recorder() -> TickRecorder:
+    """进程内共享的tick记录器，首次获取时启动，进程退出时写入剩余数据"""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = TickRecorder()
+            _recorder.start()
+            atexit.register(_recorder.close)
+    return _recorder
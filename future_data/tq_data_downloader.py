@@ -1,13 +1,21 @@
 import datetime
+import queue
+import threading
 
+import numpy as np
 from tqsdk import TqApi, TqAuth
 from vnpy.trader.constant import Interval, Exchange
 from vnpy.trader.object import BarData
 
+from config.account_config import AccountConfig
 # from util.message_alert import ding_message
-from future_data.data_downloader import save_bar
+from future_data.data_downloader import BarWriter, get_bar_overview_end, STREAM_CHUNK_SIZE
+from log.log_init import get_logger
+from util.trading_period import estimate_trading_minutes
 from util.vt_symbol_util import split_vnpy_format
 
+logger = get_logger()
+
 vnpy_frequency = Interval.MINUTE
 
 mapping_rq = {'CFFEX': Exchange.CFFEX,  # 中国金融期货交易所
@@ -17,42 +25,215 @@ mapping_rq = {'CFFEX': Exchange.CFFEX,  # 中国金融期货交易所
               'DCE': Exchange.DCE  # 大商所
               }
 
+# 并发下载的默认线程数及待写入队列长度
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 8
+# 下载线程结束标记
+_PRODUCER_DONE = object()
+
+# 天勤k线的时间为UTC纳秒时间戳，按本地时区转换，与datetime.fromtimestamp保持一致
+LOCAL_TZ = datetime.datetime.now().astimezone().tzinfo
+
+
+def klines_to_bars(klines, symbol: str, exchange: Exchange, interval: Interval = vnpy_frequency,
+                   gateway_name: str = "TQ") -> list:
+    """
+    按列批量将天勤k线DataFrame转换为BarData列表
+    先用numpy一次性取出各列并过滤无效行，避免逐行调用iloc带来的pandas标量索引开销
+    """
+    if klines is None or len(klines) < 1:
+        return []
+    timestamps = klines["datetime"].to_numpy(dtype=np.float64)
+    # 合约上市时间不足data_length时，天勤会以NaN补齐前面的k线，直接过滤
+    valid = ~np.isnan(timestamps)
+    if not valid.all():
+        klines = klines[valid]
+        timestamps = timestamps[valid]
+    if len(timestamps) < 1:
+        return []
+    # 纳秒转为本地时间，与原逐行转换结果一致(不含时区信息)
+    datetimes = np.round(timestamps / 1e3).astype(np.int64).astype("datetime64[us]").tolist()
+    offset = LOCAL_TZ.utcoffset(None) or datetime.timedelta()
+    volumes = klines["volume"].to_numpy(dtype=np.float64).tolist()
+    opens = klines["open"].to_numpy(dtype=np.float64).tolist()
+    highs = klines["high"].to_numpy(dtype=np.float64).tolist()
+    lows = klines["low"].to_numpy(dtype=np.float64).tolist()
+    closes = klines["close"].to_numpy(dtype=np.float64).tolist()
+    open_interests = klines["close_oi"].to_numpy(dtype=np.float64).tolist()
+    return [BarData(gateway_name=gateway_name,
+                    symbol=symbol,
+                    exchange=exchange,
+                    datetime=dt + offset,
+                    interval=interval,
+                    volume=volume,
+                    open_price=open_price,
+                    high_price=high_price,
+                    low_price=low_price,
+                    close_price=close_price,
+                    open_interest=open_interest)
+            for dt, volume, open_price, high_price, low_price, close_price, open_interest
+            in zip(datetimes, volumes, opens, highs, lows, closes, open_interests)]
+
+
+def filter_klines_since(klines, watermark: datetime.datetime):
+    """仅保留时间不早于水位线的k线，水位线对应的k线可能是当时未走完的分钟线，需要重新写入"""
+    if watermark is None or klines is None or len(klines) < 1:
+        return klines
+    watermark_ns = watermark.replace(tzinfo=LOCAL_TZ).timestamp() * 1e9
+    return klines[klines["datetime"].to_numpy(dtype=np.float64) >= watermark_ns]
+
+
+def get_incremental_size(symbol: str, exchange: Exchange, size: int):
+    """
+    根据DbBarOverview的水位线计算需要补齐的k线数量
+    :return: 本次下载数量, 水位线(无数据时为None)
+    """
+    watermark = get_bar_overview_end(symbol, exchange, vnpy_frequency)
+    if watermark is None:
+        return size, None
+    # 多取1根用于覆盖水位线上未走完的k线
+    missing = estimate_trading_minutes(watermark, limit=size) + 1
+    return min(size, missing), watermark
+
+
+def get_klines(api: TqApi, vt_symbol: str, size: int, incremental: bool = False):
+    """
+    从天勤获取单个合约的k线DataFrame
+    :return: klines, vnpy格式的symbol, exchange
+    """
+    exchange, code, month = split_vnpy_format(vt_symbol)
+    tq_symbol = "%s.%s%s" % (exchange, code, month)
+    symbol = "%s%s" % (code, month)
+    if month == '9999':
+        tq_symbol = "KQ.m@%s.%s" % (exchange, code)
+    if month == '8888':
+        tq_symbol = "KQ.i@%s.%s" % (exchange, code)
+    data_length, watermark = size, None
+    if incremental:
+        data_length, watermark = get_incremental_size(symbol, mapping_rq.get(exchange), size)
+        logger.info("incremental download %s, watermark=%s, size=%s" % (vt_symbol, watermark, data_length))
+    klines = api.get_kline_serial(tq_symbol, 60, data_length=data_length)
+    return filter_klines_since(klines, watermark), symbol, mapping_rq.get(exchange)
+
 
-def download_from_tq(vt_symbols: list, size: int = 5000):
+def klines_to_bar_chunks(klines, symbol: str, exchange: Exchange, chunk_size: int = STREAM_CHUNK_SIZE):
+    """按chunk_size逐块转换k线，不会同时创建全部BarData"""
+    if klines is None:
+        return
+    for i in range(0, len(klines), max(chunk_size, 1)):
+        bars = klines_to_bars(klines.iloc[i:i + chunk_size], symbol, exchange)
+        if len(bars) > 0:
+            yield bars
+
+
+def fetch_bars(api: TqApi, vt_symbol: str, size: int, incremental: bool = False) -> list:
+    """从天勤获取单个合约的k线并转换为BarData"""
+    klines, symbol, exchange = get_klines(api, vt_symbol, size, incremental)
+    return klines_to_bars(klines, symbol, exchange)
+
+
+def fetch_bar_chunks(api: TqApi, vt_symbol: str, size: int, incremental: bool = False,
+                     chunk_size: int = STREAM_CHUNK_SIZE):
+    """从天勤获取单个合约的k线，按块生成BarData列表"""
+    klines, symbol, exchange = get_klines(api, vt_symbol, size, incremental)
+    return klines_to_bar_chunks(klines, symbol, exchange, chunk_size)
+
+
+def create_tq_api() -> TqApi:
+    return TqApi(auth=TqAuth(AccountConfig.tq_acct, AccountConfig.tq_pass))
+
+
+def download_from_tq(vt_symbols: list, size: int = 5000, incremental: bool = False,
+                     workers: int = DEFAULT_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE,
+                     api_factory=create_tq_api, api: TqApi = None):
+    """
+    流水线下载：多个下载线程各自持有一个TqApi并发获取k线，写入方依次存入数据库
+    :param vt_symbols: vnpy格式的合约列表
+    :param size: 每个合约最多下载的k线数量
+    :param incremental: 是否按DbBarOverview水位线增量同步，仅下载并写入缺失的k线
+    :param workers: 并发下载的线程数，即同时打开的TqApi连接数
+    :param queue_size: 已下载待写入的k线块数上限，写入较慢时下载线程会等待，避免内存无限增长
+    :param api_factory: 创建TqApi的方法，便于替换为其他实现
+    :param api: 复用已登录的TqApi，此时在当前线程用该api下载，另开workers-1个线程各自创建TqApi，
+                写入放到单独线程，且不会关闭该api
+    """
     if vt_symbols is None or len(vt_symbols) < 1:
         return
-    api = None
-    try:
-        api = TqApi(auth=TqAuth("username", "password"))
-        for vt_symbol in vt_symbols:
-            exchange, code, month = split_vnpy_format(vt_symbol)
-            tq_symbol = "%s.%s%s" % (exchange, code, month)
-            symbol = "%s%s" % (code, month)
-            if month == '9999':
-                tq_symbol = "KQ.m@%s.%s" % (exchange, code)
-            if month == '8888':
-                tq_symbol = "KQ.i@%s.%s" % (exchange, code)
-            klines = api.get_kline_serial(tq_symbol, 60, data_length=size)
-            bars = []
-            for i in range(len(klines)):
-                bar: BarData = BarData(gateway_name="TQ",
-                                       symbol=symbol,
-                                       exchange=mapping_rq.get(exchange),
-                                       datetime=datetime.datetime.fromtimestamp(klines.iloc[i]["datetime"] / 1e9),
-                                       interval=vnpy_frequency,
-                                       volume=klines.volume.iloc[i],
-                                       open_price=klines.open.iloc[i],
-                                       high_price=klines.high.iloc[i],
-                                       low_price=klines.low.iloc[i],
-                                       close_price=klines.close.iloc[i],
-                                       open_interest=klines.close_oi.iloc[i])
-                bars.append(bar)
-            save_bar(bars)
-    except Exception as e:
-        # ding_message("天勤下载数据异常,%s" % e)
-        raise e
-    finally:
-        if api:
-            api.close()
-    pass
+    symbol_queue = queue.Queue()
+    for vt_symbol in vt_symbols:
+        symbol_queue.put(vt_symbol)
+    bar_queue = queue.Queue(maxsize=max(queue_size, 1))
+    errors = []
+    producer_count = max(1, min(workers, len(vt_symbols)))
+
+    def produce(shared_api: TqApi = None):
+        """下载线程，直到待下载队列为空"""
+        tq_api = shared_api
+        try:
+            if tq_api is None:
+                tq_api = api_factory()
+            while True:
+                try:
+                    vt_symbol = symbol_queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    # 按块放入队列，队列满时等待写入，内存中最多保留queue_size块
+                    for bars in fetch_bar_chunks(tq_api, vt_symbol, size, incremental):
+                        bar_queue.put((vt_symbol, bars))
+                except Exception as e:
+                    logger.error("download %s failed, %s" % (vt_symbol, e), exc_info=True)
+                    errors.append(e)
+        except Exception as e:
+            logger.error(e, stack_info=True, exc_info=True)
+            errors.append(e)
+        finally:
+            if tq_api and shared_api is None:
+                tq_api.close()
+            bar_queue.put(_PRODUCER_DONE)
+
+    def consume():
+        """写入阶段，在所有下载线程结束前持续消费队列，全部写完后每个合约更新一次overview"""
+        writer = BarWriter()
+        finished = 0
+        while finished < producer_count:
+            item = bar_queue.get()
+            if item is _PRODUCER_DONE:
+                finished += 1
+                continue
+            vt_symbol, bars = item
+            try:
+                writer.write(bars)
+            except Exception as e:
+                # 写入异常不能中断消费，否则下载线程会阻塞在队列上
+                logger.error("save %s failed, %s" % (vt_symbol, e), exc_info=True)
+                errors.append(e)
+        try:
+            writer.close()
+        except Exception as e:
+            logger.error(e, stack_info=True, exc_info=True)
+            errors.append(e)
 
+    if api is not None:
+        # TqApi只能在创建它的线程中使用，复用的api在当前线程下载
+        producers = [threading.Thread(target=produce, name="tq-download-%s" % i, daemon=True)
+                     for i in range(1, producer_count)]
+        writer = threading.Thread(target=consume, name="tq-writer", daemon=True)
+        writer.start()
+        for producer in producers:
+            producer.start()
+        produce(api)
+        for producer in producers:
+            producer.join()
+        writer.join()
+    else:
+        producers = [threading.Thread(target=produce, name="tq-download-%s" % i, daemon=True)
+                     for i in range(producer_count)]
+        for producer in producers:
+            producer.start()
+        consume()
+        for producer in producers:
+            producer.join()
+    if len(errors) > 0:
+        # ding_message("天勤下载数据异常,%s" % errors[0])
+        raise errors[0]
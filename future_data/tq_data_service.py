@@ -0,0 +1,232 @@
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing.connection import Listener, Client
+
+from log.log_init import get_logger
+from future_data.tq_data_downloader import download_from_tq, create_tq_api, DEFAULT_QUEUE_SIZE
+from util.main_contract_detector import get_main_contract, check_all_symbol_main_contract
+
+logger = get_logger()
+
+# 本地IPC地址及认证密钥，仅监听本机
+DATA_SERVICE_ADDRESS = ("127.0.0.1", 16888)
+DATA_SERVICE_AUTHKEY = b"vnpy_tq_data_service"
+# 空闲时驱动TqApi收发数据的间隔，保持天勤连接活跃
+KEEP_ALIVE_SECONDS = 5
+# 每次下载都会在常驻的TqApi上新增k线订阅(长度不同时不会复用)，累计订阅数超过该值后重新登录释放订阅
+MAX_KLINE_SUBSCRIPTIONS = 200
+# 客户端等待响应的时间(秒)，超时视为服务不可用，由调用方在当前进程执行
+DEFAULT_REQUEST_TIMEOUT = 60
+DEFAULT_DOWNLOAD_TIMEOUT = 1800
+
+CMD_PING = "ping"
+CMD_STOP = "stop"
+CMD_DOWNLOAD = "download"
+CMD_MAIN_CONTRACT = "main_contract"
+CMD_CHECK_ALL_MAIN_CONTRACT = "check_all_main_contract"
+
+
+class DataServiceTimeout(ConnectionError):
+    """服务在超时时间内未响应，之前的请求可能仍在处理"""
+
+
+class TqDataService:
+    """
+    常驻的数据服务，进程内只登录一次天勤并长期持有TqApi
+    通过本地IPC接收下载k线、查询主力合约等请求，省去每次任务的连接和认证耗时
+    TqApi只能在创建它的线程中使用，所有请求都在主线程中依次处理，下载只使用常驻的TqApi，不另开连接
+    """
+
+    def __init__(self, address=DATA_SERVICE_ADDRESS, authkey: bytes = DATA_SERVICE_AUTHKEY, api_factory=create_tq_api):
+        self.address = address
+        self.authkey = authkey
+        self.api_factory = api_factory
+        self.api = None
+        # 当前TqApi上累计的k线订阅数
+        self.subscriptions = 0
+        self.active = False
+        self.connections = queue.Queue()
+
+    def get_api(self):
+        if self.api is None:
+            self.api = self.api_factory()
+            logger.info("data service TqApi connected")
+        return self.api
+
+    def reset_api(self):
+        """请求异常时关闭连接，下次请求重新登录"""
+        if self.api is not None:
+            try:
+                self.api.close()
+            except Exception as e:
+                logger.error(e, exc_info=True)
+        self.api = None
+        self.subscriptions = 0
+
+    def run(self):
+        listener = Listener(self.address, authkey=self.authkey)
+        self.active = True
+        threading.Thread(target=self._accept, args=(listener,), name="data-service-accept", daemon=True).start()
+        logger.info("data service started, address=%s" % (self.address,))
+        try:
+            self.get_api()
+            while self.active:
+                try:
+                    conn = self.connections.get(timeout=KEEP_ALIVE_SECONDS)
+                except queue.Empty:
+                    self._keep_alive()
+                    continue
+                self._serve(conn)
+        finally:
+            self.active = False
+            listener.close()
+            self.reset_api()
+            logger.info("data service stopped")
+
+    def _accept(self, listener: Listener):
+        """单独线程接收连接，主线程空闲时可以继续驱动TqApi"""
+        while self.active:
+            try:
+                self.connections.put(listener.accept())
+            except Exception as e:
+                if self.active:
+                    logger.error(e, exc_info=True)
+
+    def _keep_alive(self):
+        try:
+            self.get_api().wait_update(deadline=time.time() + 1)
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            self.reset_api()
+
+    def _serve(self, conn):
+        """一个连接可以连续发送多个请求，直到客户端关闭"""
+        try:
+            while self.active:
+                try:
+                    request: dict = conn.recv()
+                except (EOFError, OSError):
+                    break
+                try:
+                    response = {"ok": True, "result": self.handle(request)}
+                except Exception as e:
+                    logger.error(e, stack_info=True, exc_info=True)
+                    self.reset_api()
+                    response = {"ok": False, "error": repr(e)}
+                try:
+                    conn.send(response)
+                except OSError as e:
+                    # 客户端等待超时后已断开
+                    logger.info("data service client gone, %s" % e)
+                    break
+        finally:
+            conn.close()
+
+    def handle(self, request: dict):
+        cmd = request.get("cmd")
+        if cmd == CMD_PING:
+            return True
+        if cmd == CMD_STOP:
+            self.active = False
+            return True
+        if cmd == CMD_DOWNLOAD:
+            # 全部合约在常驻的TqApi上依次订阅，写入在单独线程进行，每次任务不再新建和认证TqApi
+            download_from_tq(request["vt_symbols"], size=request.get("size", 5000),
+                             incremental=request.get("incremental", False), workers=1,
+                             queue_size=request.get("queue_size", DEFAULT_QUEUE_SIZE), api=self.get_api())
+            self.subscriptions += len(request["vt_symbols"])
+            if self.subscriptions >= MAX_KLINE_SUBSCRIPTIONS:
+                logger.info("data service TqApi recycled, subscriptions=%s" % self.subscriptions)
+                self.reset_api()
+            return True
+        if cmd == CMD_MAIN_CONTRACT:
+            return get_main_contract(request["vt_symbols"], include_the_same=request.get("include_the_same", False),
+                                     tq_api=self.get_api())
+        if cmd == CMD_CHECK_ALL_MAIN_CONTRACT:
+            return check_all_symbol_main_contract(request["vt_symbols"], tq_api=self.get_api())
+        raise ValueError("unknown cmd %s" % cmd)
+
+
+class DataServiceClient:
+    """数据服务客户端，服务不可用时抛出ConnectionError"""
+
+    def __init__(self, address=DATA_SERVICE_ADDRESS, authkey: bytes = DATA_SERVICE_AUTHKEY):
+        self.address = address
+        self.authkey = authkey
+
+    def request(self, cmd: str, timeout: float = DEFAULT_REQUEST_TIMEOUT, **kwargs):
+        """发送请求并等待响应，连接失败、服务退出或超时均抛出ConnectionError"""
+        try:
+            conn = Client(self.address, authkey=self.authkey)
+        except OSError as e:
+            raise ConnectionError("data service unavailable, %s" % e)
+        try:
+            kwargs["cmd"] = cmd
+            conn.send(kwargs)
+            if not conn.poll(timeout):
+                raise DataServiceTimeout("data service timeout, cmd=%s" % cmd)
+            response = conn.recv()
+        except (EOFError, OSError) as e:
+            # 服务在处理请求时退出
+            raise ConnectionError("data service disconnected, %s" % e)
+        finally:
+            conn.close()
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def wait_idle(self, timeout: float = DEFAULT_DOWNLOAD_TIMEOUT):
+        """服务依次处理请求，ping返回时之前的请求已处理完毕，超时抛出DataServiceTimeout"""
+        return self.request(CMD_PING, timeout=timeout)
+
+    def is_alive(self) -> bool:
+        try:
+            return self.request(CMD_PING)
+        except Exception:
+            return False
+
+    def download(self, vt_symbols: list, size: int = 5000, incremental: bool = False,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, timeout: float = DEFAULT_DOWNLOAD_TIMEOUT):
+        """服务只使用常驻的TqApi下载，没有并发线程数参数"""
+        return self.request(CMD_DOWNLOAD, timeout=timeout, vt_symbols=vt_symbols, size=size,
+                            incremental=incremental, queue_size=queue_size)
+
+    def get_main_contract(self, vt_symbols, include_the_same=False) -> dict:
+        return self.request(CMD_MAIN_CONTRACT, vt_symbols=list(vt_symbols), include_the_same=include_the_same)
+
+    def check_all_symbol_main_contract(self, vt_symbols):
+        return self.request(CMD_CHECK_ALL_MAIN_CONTRACT, vt_symbols=list(vt_symbols))
+
+    def stop(self):
+        return self.request(CMD_STOP)
+
+
+def run_data_service(address=DATA_SERVICE_ADDRESS, authkey: bytes = DATA_SERVICE_AUTHKEY):
+    try:
+        TqDataService(address, authkey).run()
+    except (Exception, RuntimeError) as e:
+        logger.error(e, stack_info=True, exc_info=True)
+
+
+def start_data_service(address=DATA_SERVICE_ADDRESS, authkey: bytes = DATA_SERVICE_AUTHKEY):
+    """启动数据服务子进程，服务已在运行时直接返回None"""
+    if DataServiceClient(address, authkey).is_alive():
+        return None
+    process = multiprocessing.Process(target=run_data_service, args=(address, authkey), name="tq-data-service")
+    process.start()
+    return process
+
+
+def get_main_contract_from_service(vt_symbols, include_the_same=False) -> dict:
+    """优先通过数据服务查询主力合约，服务不可用时直接连接天勤"""
+    try:
+        return DataServiceClient().get_main_contract(vt_symbols, include_the_same=include_the_same)
+    except ConnectionError as e:
+        logger.info(e)
+    return get_main_contract(vt_symbols, include_the_same=include_the_same)
+
+
+if __name__ == '__main__':
+    run_data_service()
@@ -1,6 +1,11 @@
+import atexit
+import glob
+import json
+import os
+import threading
 import time
-from vnpy.trader.database import (database,get_database)  # 重要，需要此步骤加载vnpy的数据库管理器
-from vnpy_mysql.mysql_database import db
+from queue import Queue, Empty
+from vnpy.trader.database import (database, get_database, convert_tz)  # 重要，需要此步骤加载vnpy的数据库管理器
 from datetime import datetime
 from enum import Enum
 
@@ -15,10 +20,43 @@ from peewee import (
     ModelSelect,
     ModelDelete,
     chunked,
-    fn, Desc
+    fn, Desc,
+    SQL, Entity, NodeList, CommaNodeList
 )
 from vnpy.trader.constant import Exchange, Direction, Offset
 from vnpy.trader.object import TradeData
+from vnpy.trader.utility import get_file_path
+
+from future_data.db_pool import connection, pool_db
+from log.log_init import get_logger
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+logger = get_logger()
+
+# 后台写入的操作类型
+OP_INSERT = "insert"
+OP_UPDATE = "update"
+OP_ROUND_TRIP = "round_trip"
+# 尚未写入数据库的操作日志，每个进程一个文件，文件名带进程号，另有同名.lock文件标记进程仍在运行
+JOURNAL_FILE = "trade_journal.jsonl"
+JOURNAL_PATTERN = "trade_journal*.jsonl"
+# 数据库可用但多次写入失败的操作，移出日志后追加到该文件，需人工处理
+DEAD_LETTER_FILE = "trade_dead_letter.jsonl"
+# 单个事务最多写入的操作数
+DEFAULT_WRITE_BATCH = 200
+DEFAULT_WRITE_QUEUE_SIZE = 10000
+# 数据库不可用时的重试间隔(秒)
+DEFAULT_RETRY_INTERVAL = 5.0
+# 同一批操作写入失败的重试次数，之后数据库仍可用则逐条写入，失败的操作移入死信文件
+DEFAULT_MAX_RETRIES = 5
+# 策略停止或进程退出时等待写入完成的时间(秒)
+DEFAULT_CLOSE_TIMEOUT = 30.0
 
 
 class TradeStatus(Enum):
@@ -33,24 +71,24 @@ class DbTradeData(Model):
     """交易记录"""
 
     id = AutoField()
-    # 策略名称
-    strategy_name: str = CharField()
+    # 策略名称，索引列限定长度，utf8mb4下VARCHAR(255)每列占1020字节，多列组合会超出InnoDB索引3072字节的上限
+    strategy_name: str = CharField(max_length=128)
     # 成交后资金量
     capital: float = FloatField()
     # gateway engine的名称
     gateway_name: str = CharField()
     # 期货合约编码
-    symbol: str = CharField()
+    symbol: str = CharField(max_length=32)
     # 交易所编码
     exchange: str = CharField()
     # 下单指令id
     orderid: str = CharField()
     # 交易id
-    tradeid: str = CharField()
+    tradeid: str = CharField(max_length=64)
     # 交易方向 LONG SHORT
-    direction: str = CharField()
+    direction: str = CharField(max_length=16)
     # 平仓开仓 OPEN CLOSE 或CLOSETODAY
-    offset: str = CharField()
+    offset: str = CharField(max_length=16)
     # 成交价
     price: float = FloatField()
     # 成交量
@@ -63,14 +101,111 @@ class DbTradeData(Model):
     datetime: datetime = DateTimeField()
 
     class Meta:
-        database = db
-        indexes = ((("strategy_name", "tradeid"), False),)
+        database = pool_db
+        indexes = (
+            (("strategy_name", "tradeid"), False),
+            # get_unclosed_trades、get_unclosed_trades_of_strategy，未平仓记录按状态过滤后只剩少量行
+            (("strategy_name", "status", "offset", "symbol", "direction", "datetime"), False),
+            # get_last_trade，按时间倒序取第一条
+            (("strategy_name", "symbol", "direction", "offset", "datetime"), False),
+        )
+
+
+class DbRoundTrip(Model):
+    """
+    开平仓配对后的单笔盈亏，平仓按先进先出匹配开仓时写入，一笔平仓匹配多笔开仓时记录多行
+    按(策略, 平仓时间)有序存储，资金曲线和策略统计只需按索引顺序扫描一次
+    """
+
+    id = AutoField()
+    # 唯一索引的字符列限定长度，与DbTradeData一致
+    strategy_name: str = CharField(max_length=128)
+    # 期货合约编码 rb2301.SHFE
+    symbol: str = CharField(max_length=32)
+    # 开仓方向 LONG SHORT
+    direction: str = CharField(max_length=16)
+    open_tradeid: str = CharField(max_length=64)
+    close_tradeid: str = CharField(max_length=64)
+    open_price: float = FloatField()
+    close_price: float = FloatField()
+    # 本次配对的手数
+    volume: int = IntegerField()
+    # 不含手续费和滑点的盈亏
+    gross_pnl: float = FloatField()
+    # 扣除手续费和滑点后的盈亏
+    net_pnl: float = FloatField()
+    # 平仓后资金量
+    capital: float = FloatField()
+    open_datetime: datetime = DateTimeField()
+    close_datetime: datetime = DateTimeField()
+    # 持仓时间(秒)
+    holding_seconds: int = IntegerField()
+
+    class Meta:
+        database = pool_db
+        # 后台写入重放日志时依赖唯一索引去重，utf8mb4下索引长度约1160字节，在InnoDB 3072字节的上限内
+        indexes = ((("strategy_name", "close_datetime", "symbol", "open_tradeid", "close_tradeid"), True),)
+
+
+_round_trip_table_created = False
+
+
+def create_round_trip_table():
+    global _round_trip_table_created
+    if not _round_trip_table_created:
+        with connection(DbRoundTrip._meta.database) as trade_db:
+            trade_db.create_tables([DbRoundTrip])
+        _round_trip_table_created = True
+
+
+def shrink_trade_columns(trade_db) -> list:
+    """
+    MySQL中将已有表的字符列改为Meta中的长度，旧表为VARCHAR(255)，需先缩短才能创建组合索引
+    已有数据超出新长度时抛出ValueError，不截断数据，返回修改的列名
+    """
+    table_name = DbTradeData._meta.table_name
+    lengths = dict(trade_db.execute_sql(
+        "SELECT COLUMN_NAME, CHARACTER_MAXIMUM_LENGTH FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table_name,)).fetchall())
+    fields = [field for field in DbTradeData._meta.sorted_fields
+              if isinstance(field, CharField) and (lengths.get(field.column_name) or 0) > field.max_length]
+    if len(fields) < 1:
+        return []
+    used = DbTradeData.select(*[fn.MAX(fn.CHAR_LENGTH(field)) for field in fields]).tuples().get()
+    for field, length in zip(fields, used):
+        if length is not None and length > field.max_length:
+            raise ValueError("%s.%s has values longer than %s" % (table_name, field.column_name, field.max_length))
+    # 合并为一条ALTER，大表只重建一次
+    ctx = trade_db.get_sql_context()
+    ctx.literal("ALTER TABLE ").sql(Entity(table_name)).literal(" ")
+    ctx.sql(CommaNodeList([NodeList((SQL("MODIFY"), field.ddl(ctx))) for field in fields]))
+    trade_db.execute_sql(*ctx.query())
+    columns = [field.column_name for field in fields]
+    logger.info("columns shrunk, %s: %s" % (table_name, columns))
+    return columns
+
+
+def migrate_trade_indexes() -> list:
+    """为已有的DbTradeData表补建Meta中新增的索引，已存在的索引跳过，返回新建的索引名"""
+    table_name = DbTradeData._meta.table_name
+    created = []
+    with connection(DbTradeData._meta.database) as trade_db:
+        if isinstance(trade_db, PeeweeMySQLDatabase):
+            # 索引列长度在建索引前调整，sqlite不限制VARCHAR长度
+            shrink_trade_columns(trade_db)
+        existing = {index.name for index in trade_db.get_indexes(table_name)}
+        for index in DbTradeData._meta.fields_to_index():
+            if index._name in existing:
+                continue
+            # MySQL不支持CREATE INDEX IF NOT EXISTS，逐个检查后创建
+            trade_db.execute(DbTradeData._schema._create_index(index, safe=False))
+            created.append(index._name)
+            logger.info("index created, %s.%s" % (table_name, index._name))
+    return created
 
 
 def get_last_trade(strategy_name: str, symbol: str, direction: str):
-    # database=get_database()
-    # database.db.connect(reuse_if_open=True)
-    with db.atomic():
+    with connection(DbTradeData._meta.database) as trade_db, trade_db.atomic():
         results = DbTradeData.select().where(
             DbTradeData.strategy_name == strategy_name
             , DbTradeData.symbol == symbol
@@ -99,9 +234,7 @@ def get_last_trade(strategy_name: str, symbol: str, direction: str):
 #
 def get_unclosed_trades(strategy_name: str, symbol: str, direction: str):
     """获取所有未完全平仓的数据"""
-    # database=get_database()
-    # database.db.connect(reuse_if_open=True)
-    with db.atomic():
+    with connection(DbTradeData._meta.database) as trade_db, trade_db.atomic():
         results = DbTradeData.select().where(
             DbTradeData.strategy_name == strategy_name
             , DbTradeData.symbol == symbol
@@ -117,48 +250,444 @@ def get_unclosed_trades(strategy_name: str, symbol: str, direction: str):
     pass
 
 
+def get_unclosed_trades_of_strategy(strategy_name: str):
+    """一次读取策略全部未完全平仓的开仓记录，按时间正序，用于初始化持仓明细"""
+    with connection(DbTradeData._meta.database) as trade_db, trade_db.atomic():
+        return list(DbTradeData.select().where(
+            DbTradeData.strategy_name == strategy_name
+            , DbTradeData.status == TradeStatus.UN_CLOSED.value
+            , DbTradeData.offset == Offset.OPEN.name).order_by(
+            DbTradeData.datetime.asc(), DbTradeData.id.asc()))
+
+
+def update_closed_volume(strategy_name: str, symbol: str, tradeid: str, closed_volume: int, status: int,
+                         trade_id: int = None, orderid: str = None, trade_datetime: datetime = None):
+    """
+    更新开仓记录的已平仓手数和状态
+    :param trade_id: 从数据库读取的开仓记录的主键，有主键时只更新该行
+    :param orderid: 本次运行中的开仓没有主键，成交编号每个交易日及每次回测重新编号，
+    需同时按委托编号和保存的成交时间定位该行，避免更新到编号相同的旧开仓
+    :param trade_datetime: 开仓记录保存的成交时间
+    """
+    with connection(DbTradeData._meta.database) as trade_db, trade_db.atomic():
+        query = DbTradeData.update(closed_volume=closed_volume, status=status)
+        if trade_id is not None:
+            query = query.where(DbTradeData.id == trade_id)
+        else:
+            query = query.where(
+                DbTradeData.strategy_name == strategy_name
+                , DbTradeData.tradeid == tradeid
+                , DbTradeData.symbol == symbol
+                , DbTradeData.offset == Offset.OPEN.name
+                , DbTradeData.status == TradeStatus.UN_CLOSED.value)
+            if orderid is not None:
+                query = query.where(DbTradeData.orderid == orderid)
+            if trade_datetime is not None:
+                query = query.where(DbTradeData.datetime == trade_datetime)
+        query.execute()
+
+
+def _try_lock(f) -> bool:
+    """对打开的文件加非阻塞的排他锁，进程退出时由系统释放"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class TradeWriter:
+    """
+    交易记录的后台写入线程，策略线程只将写入操作追加到本地日志并放入队列
+    后台线程按提交顺序批量写入数据库，数据库不可用时保留在队列中重试，
+    数据库可用但多次写入失败的操作逐条写入，仍失败的移入死信文件，不阻塞后续操作
+    每个进程使用自己的日志文件，并持有对应.lock文件的锁，日志中只保留本进程尚未确认写入的操作
+    启动时接管锁已释放(所属进程已退出)的日志并重新写入，进程异常退出时成交记录不会丢失
+    """
+
+    def __init__(self, journal_dir: str = None, batch_size: int = DEFAULT_WRITE_BATCH,
+                 queue_size: int = DEFAULT_WRITE_QUEUE_SIZE, retry_interval: float = DEFAULT_RETRY_INTERVAL,
+                 max_retries: int = DEFAULT_MAX_RETRIES, fsync: bool = True):
+        self.journal_dir = journal_dir if journal_dir is not None else os.path.dirname(str(get_file_path(JOURNAL_FILE)))
+        name, ext = os.path.splitext(JOURNAL_FILE)
+        self.journal_path = os.path.join(self.journal_dir, "%s.%s%s" % (name, os.getpid(), ext))
+        self.dead_letter_path = os.path.join(self.journal_dir, DEAD_LETTER_FILE)
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.max_retries = max_retries
+        self.fsync = fsync
+        # 队列满时阻塞提交方，避免数据库长时间不可用时内存无限增长
+        self.queue = Queue(maxsize=queue_size)
+        self.condition = threading.Condition()
+        self.journal = None
+        self.journal_lock = None
+        self.submitted = 0
+        self.committed = 0
+        self.active = False
+        self.thread = None
+        # 盈亏表是否已建立
+        self.tables_created = False
+
+    def start(self):
+        if self.active:
+            return
+        self.journal_lock = open(self.journal_path + ".lock", "a")
+        if not _try_lock(self.journal_lock):
+            raise RuntimeError("trade journal is locked by another process: %s" % self.journal_path)
+        ops = self._replay()
+        self.active = True
+        self.thread = threading.Thread(target=self._run, name="trade-writer", daemon=True)
+        self.thread.start()
+        # 写入线程启动后再放入队列，重放的操作超过队列长度时不会阻塞
+        for op in ops:
+            self.queue.put(op)
+
+    def _replay(self) -> list:
+        """
+        读取本进程及已退出进程未确认写入的操作，转存到本进程的日志后删除原日志
+        插入操作写入前检查是否已存在，多个进程同时启动时同一个日志只会被一个进程接管
+        """
+        ops = []
+        orphans = []
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, JOURNAL_PATTERN))):
+            if path == self.journal_path:
+                # 同一进程号的旧进程已退出(本进程已持有锁)
+                ops.extend(self._read_journal(path))
+                continue
+            lock = open(path + ".lock", "a")
+            if not _try_lock(lock):
+                # 所属进程仍在运行
+                lock.close()
+                continue
+            if os.path.exists(path):
+                ops.extend(self._read_journal(path))
+            orphans.append((path, lock))
+        for op in ops:
+            op["replay"] = True
+        self.journal = open(self.journal_path, "w", encoding="utf-8")
+        for op in ops:
+            self.journal.write(json.dumps(op) + "\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        for path, lock in orphans:
+            _remove_file(path)
+            lock.close()
+            _remove_file(path + ".lock")
+        self.submitted = len(ops)
+        if len(ops) > 0:
+            logger.info("trade journal replayed, ops=%s, journals=%s" % (len(ops), len(orphans)))
+        return ops
+
+    @staticmethod
+    def _read_journal(path: str) -> list:
+        ops = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    ops.append(json.loads(line))
+                except ValueError:
+                    # 写入中断的最后一行
+                    logger.info("broken trade journal line skipped: %s" % line)
+        return ops
+
+    def submit_insert(self, row: dict):
+        self._submit({"type": OP_INSERT, "row": dict(row, datetime=row["datetime"].isoformat())})
+
+    def submit_update(self, strategy_name: str, symbol: str, tradeid: str, closed_volume: int, status: int,
+                      trade_id: int = None, orderid: str = None, trade_datetime: datetime = None):
+        self._submit({"type": OP_UPDATE, "strategy_name": strategy_name, "symbol": symbol, "tradeid": tradeid,
+                      "closed_volume": closed_volume, "status": status, "id": trade_id, "orderid": orderid,
+                      "datetime": trade_datetime.isoformat() if trade_datetime is not None else None})
+
+    def submit_round_trip(self, row: dict):
+        self._submit({"type": OP_ROUND_TRIP, "row": dict(row, open_datetime=row["open_datetime"].isoformat(),
+                                                          close_datetime=row["close_datetime"].isoformat())})
+
+    def _submit(self, op: dict):
+        with self.condition:
+            self.journal.write(json.dumps(op) + "\n")
+            self.journal.flush()
+            if self.fsync:
+                os.fsync(self.journal.fileno())
+            self.submitted += 1
+        self.queue.put(op)
+
+    def _create_tables(self):
+        """
+        启动后建立一次盈亏表，数据库不可用时在下一批写入前再次尝试
+        建表失败只影响盈亏记录的写入，由重试和死信处理，不阻塞交易记录
+        """
+        try:
+            create_round_trip_table()
+            self.tables_created = True
+        except Exception as e:
+            logger.error(e, stack_info=True, exc_info=True)
+
+    def _run(self):
+        self._create_tables()
+        while self.active or not self.queue.empty():
+            try:
+                op = self.queue.get(timeout=0.5)
+            except Empty:
+                continue
+            batch = [op]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            if not self.tables_created:
+                self._create_tables()
+            if not self._write_with_retry(batch):
+                # 关闭时数据库仍不可用，保留日志等待下次启动
+                return
+            with self.condition:
+                self.committed += len(batch)
+                if self.committed >= self.submitted:
+                    # 全部写入完成，清空日志
+                    self.journal.truncate(0)
+                    self.journal.seek(0)
+                self.condition.notify_all()
+
+    def _write_with_retry(self, batch: list) -> bool:
+        """
+        写入一批操作，失败max_retries次后若数据库仍可用，逐条写入并将失败的操作移入死信文件
+        :return: 是否已处理完毕，关闭时数据库仍不可用返回False
+        """
+        retries = 0
+        while len(batch) > 0:
+            try:
+                self._write(batch)
+                return True
+            except Exception as e:
+                logger.error(e, stack_info=True, exc_info=True)
+            if not self.active:
+                return False
+            retries += 1
+            if retries >= self.max_retries and self._is_db_available():
+                batch = self._write_each(batch)
+                retries = 0
+                continue
+            time.sleep(self.retry_interval)
+        return True
+
+    def _write_each(self, batch: list) -> list:
+        """逐条写入，返回因数据库不可用而未写入的操作"""
+        for i, op in enumerate(batch):
+            try:
+                self._write([op])
+            except Exception as e:
+                if not self._is_db_available():
+                    return batch[i:]
+                self._dead_letter(op, e)
+        return []
+
+    def _dead_letter(self, op: dict, e: Exception):
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"op": op, "error": str(e), "time": datetime.now().isoformat()}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        logger.error("trade op moved to dead letter %s, op=%s, error=%s" % (self.dead_letter_path, op, e))
+
+    @staticmethod
+    def _is_db_available() -> bool:
+        try:
+            with connection(DbTradeData._meta.database) as trade_db:
+                trade_db.execute_sql("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    def _write(self, batch: list):
+        """在一个事务内按顺序写入，连续的插入合并为一条多行插入，写完后连接归还连接池"""
+        round_trips = [dict(op["row"], open_datetime=datetime.fromisoformat(op["row"]["open_datetime"]),
+                            close_datetime=datetime.fromisoformat(op["row"]["close_datetime"]))
+                       for op in batch if op["type"] == OP_ROUND_TRIP]
+        with connection(DbTradeData._meta.database) as trade_db, trade_db.atomic():
+            rows = []
+            for op in batch:
+                if op["type"] == OP_ROUND_TRIP:
+                    continue
+                if op["type"] == OP_INSERT:
+                    row = dict(op["row"], datetime=datetime.fromisoformat(op["row"]["datetime"]))
+                    if not op.get("replay") or not self._exists(row):
+                        rows.append(row)
+                    continue
+                if len(rows) > 0:
+                    DbTradeData.insert_many(rows).execute()
+                    rows = []
+                trade_datetime = datetime.fromisoformat(op["datetime"]) if op.get("datetime") else None
+                update_closed_volume(op["strategy_name"], op["symbol"], op["tradeid"], op["closed_volume"],
+                                     op["status"], op.get("id"), op.get("orderid"), trade_datetime)
+            if len(rows) > 0:
+                DbTradeData.insert_many(rows).execute()
+            # 盈亏记录与交易记录互不依赖，最后统一写入，重放时已存在的记录被忽略
+            for sub_rows in chunked(round_trips, self.batch_size):
+                DbRoundTrip.insert_many(sub_rows).on_conflict_ignore().execute()
+
+    @staticmethod
+    def _exists(row: dict) -> bool:
+        """
+        重放的插入是否已写入，成交编号每个交易日及每次回测重新编号，需同时比较委托编号和成交时间，
+        避免把未写入的成交误判为编号相同的旧成交
+        """
+        return DbTradeData.select().where(
+            DbTradeData.strategy_name == row["strategy_name"]
+            , DbTradeData.tradeid == row["tradeid"]
+            , DbTradeData.symbol == row["symbol"]
+            , DbTradeData.offset == row["offset"]
+            , DbTradeData.orderid == row["orderid"]
+            , DbTradeData.datetime == row["datetime"]).exists()
+
+    def flush(self, timeout: float = None) -> bool:
+        """等待当前已提交的操作全部写入，返回是否在超时前完成"""
+        with self.condition:
+            target = self.submitted
+            return self.condition.wait_for(lambda: self.committed >= target, timeout=timeout)
+
+    def close(self, timeout: float = DEFAULT_CLOSE_TIMEOUT):
+        if not self.active:
+            return
+        self.flush(timeout)
+        self.active = False
+        self.thread.join(timeout)
+        self.journal.close()
+        with self.condition:
+            finished = self.committed >= self.submitted
+        if finished:
+            # 全部写入完成，删除本进程的日志
+            _remove_file(self.journal_path)
+        self.journal_lock.close()
+        if finished:
+            _remove_file(self.journal_path + ".lock")
+
+
+_writer: TradeWriter = None
+_writer_lock = threading.Lock()
+
+
+def get_trade_writer() -> TradeWriter:
+    """进程内共享的交易记录写入线程，首次获取时重放日志并启动，进程退出时写入剩余数据"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = TradeWriter()
+            _writer.start()
+            atexit.register(_writer.close)
+    return _writer
+
+
+def submit_closed_volume(strategy_name: str, symbol: str, tradeid: str, closed_volume: int, status: int,
+                         trade_id: int = None, orderid: str = None, trade_datetime: datetime = None):
+    """
+    提交到后台线程更新已平仓手数，立即返回
+    :param trade_id: DbTradeData的主键，本次运行的开仓没有主键时按orderid和trade_datetime定位
+    """
+    get_trade_writer().submit_update(strategy_name, symbol, tradeid, closed_volume, status, trade_id, orderid,
+                                     trade_datetime)
+
+
+def wait_trade_updates(timeout: float = DEFAULT_CLOSE_TIMEOUT):
+    """等待已提交的交易记录全部写入，用于策略停止时"""
+    if _writer is not None:
+        _writer.flush(timeout)
+
+
+def to_db_datetime(dt: datetime) -> datetime:
+    """带时区的成交时间转换为数据库时区，与DbTradeData中保存的时间一致"""
+    if dt.tzinfo is None:
+        return dt
+    return convert_tz(dt)
+
+
+def save_round_trip(strategy_name: str, open_trade, close_trade: TradeData, volume: int, gross_pnl: float,
+                    net_pnl: float, capital: float, use_local_time=False):
+    """
+    提交一笔开平仓配对的盈亏，由后台线程写入DbRoundTrip
+    :param open_trade: 持仓明细中匹配到的开仓，DbTradeData或TradeData
+    :param close_trade: 平仓成交
+    :param use_local_time: 平仓时间是否使用本地时间，与save_trade_data保持一致
+    """
+    open_datetime = to_db_datetime(open_trade.datetime)
+    close_datetime = datetime.now() if use_local_time else to_db_datetime(close_trade.datetime)
+    get_trade_writer().submit_round_trip({
+        "strategy_name": strategy_name,
+        "symbol": close_trade.vt_symbol,
+        "direction": Direction.SHORT.name if close_trade.direction == Direction.LONG else Direction.LONG.name,
+        "open_tradeid": open_trade.tradeid,
+        "close_tradeid": close_trade.tradeid,
+        "open_price": open_trade.price,
+        "close_price": close_trade.price,
+        "volume": volume,
+        "gross_pnl": gross_pnl,
+        "net_pnl": net_pnl,
+        "capital": capital,
+        "open_datetime": open_datetime,
+        "close_datetime": close_datetime,
+        "holding_seconds": max(int((close_datetime - open_datetime).total_seconds()), 0),
+    })
+
+
+def trade_to_row(strategy_name: str, capital: float, trade: TradeData, use_local_time=False) -> dict:
+    """
+    vnpy的trade数据转换为DbTradeData的一行
+    成交时间去掉微秒，与MySQL DATETIME保存的值一致，重放去重和更新平仓进度时按该时间精确匹配
+    """
+    trade_datetime = datetime.now() if use_local_time else trade.datetime
+    return {
+        "strategy_name": strategy_name,
+        "capital": capital,
+        "gateway_name": trade.gateway_name,
+        "symbol": trade.symbol + '.' + trade.exchange.value,
+        "exchange": trade.exchange.value,
+        "orderid": trade.orderid,
+        "tradeid": trade.tradeid,
+        "direction": trade.direction.name,
+        "offset": trade.offset.name,
+        "price": trade.price,
+        "volume": trade.volume,
+        "closed_volume": trade.closed_volume,
+        "status": TradeStatus.UN_CLOSED.value if trade.offset == Offset.OPEN else TradeStatus.CLOSED.value,
+        "datetime": trade_datetime.replace(microsecond=0),
+    }
+
+
 def save_trade_data(strategy_name: str, capital: float, trade: TradeData, use_local_time=False):
     """
-    储存数据
+    储存数据，写入本地日志后由后台线程写入数据库，不阻塞策略线程
     :param strategy_name: 策略名称
     :param capital: 交易后资金量
     :param trade: vnpy的trade数据
     :param use_local_time: 是否使用本地时间，回测时建议使用数据虚拟时间
     :return:
     """
-    # 获取数据库并重新连接
-    database=get_database()
-    database.db.connect(reuse_if_open=True)
-    db_trade_data: DbTradeData = DbTradeData()
-    db_trade_data.strategy_name = strategy_name
-    db_trade_data.capital = capital
-    db_trade_data.gateway_name = trade.gateway_name
-    db_trade_data.symbol = trade.symbol + '.' + trade.exchange.value
-    db_trade_data.exchange = trade.exchange.value
-    db_trade_data.orderid = trade.orderid
-    db_trade_data.tradeid = trade.tradeid
-    db_trade_data.direction = trade.direction.name
-    db_trade_data.offset = trade.offset.name
-    db_trade_data.price = trade.price
-    db_trade_data.volume = trade.volume
-    db_trade_data.closed_volume = trade.closed_volume
-    db_trade_data.status = TradeStatus.UN_CLOSED.value if trade.offset == Offset.OPEN else TradeStatus.CLOSED.value
-    db_trade_data.datetime = datetime.now() if use_local_time else trade.datetime
-    with database.db.atomic():
-        db_trade_data.save()
-    pass
+    row = trade_to_row(strategy_name, capital, trade, use_local_time)
+    # 持仓明细平仓时按保存的成交时间定位本次运行的开仓记录
+    trade.db_datetime = row["datetime"]
+    get_trade_writer().submit_insert(row)
 
 
 def update_db_trade_data(db_trade_data: DbTradeData):
-    # database=get_database()
-    # database.db.connect(reuse_if_open=True)
-    with db.atomic():
+    with connection(DbTradeData._meta.database) as trade_db, trade_db.atomic():
         db_trade_data.save()
     pass
 
 
 if __name__ == '__main__':
     # 初始化表结构
-    database = get_database()
-    database.db.create_tables([DbTradeData])
+    with connection(DbTradeData._meta.database) as trade_db:
+        trade_db.create_tables([DbTradeData, DbRoundTrip])
+    # 已有表补建索引
+    migrate_trade_indexes()
     pass
@@ -14,6 +14,8 @@ from vnpy_ctp import CtpGateway
 
 from future_data.auto_change_month_task import get_change_month_for_cta
 from future_data.download_data_task import get_instance_for_cta, get_instance_for_manual
+from future_data.job_scheduler import JobScheduler
+from future_data.tq_data_service import start_data_service
 from util.message_alert import ding_message
 from util.trading_period import check_real_trading_period
 
@@ -40,6 +42,10 @@ DAY_END_1 = time(15, 1)
 
 NIGHT_START = time(20, 58)
 NIGHT_END = time(23, 1)
+# 启动交易子进程前等待同一时段的数据下载及换月任务结束的最长时间(秒)，超时后照常启动
+DOWNLOAD_WAIT_SECONDS = 600
+# 启动交易子进程前需等待的任务，换月依赖下载的数据，按先下载后换月的顺序等待，未到触发时间的任务不等待
+STARTUP_JOBS = ["download_cta", "download_manual", "change_month_cta"]
 
 
 def check_trading_period(current=None):
@@ -120,22 +126,30 @@ def run_parent():
     Running in the parent process.
     """
     print("启动CTA策略守护父进程")
+    # 常驻数据服务，长期持有天勤连接，下载和换月任务都通过它访问天勤
+    start_data_service()
     # 添加数据下载任务
     task = get_instance_for_cta()
+    task.use_data_service = True
     task2 = get_instance_for_manual()
+    task2.use_data_service = True
     task3 = get_change_month_for_cta()
+    # 各任务到点后由调度器在线程池中独立执行，不再阻塞交易子进程的启停
+    scheduler = JobScheduler()
+    scheduler.add_job("download_cta", task.run_download, task.times)
+    scheduler.add_job("download_manual", task2.run_download, task2.times)
+    scheduler.add_job("change_month_cta", task3.run_change_month, task3.times)
+    scheduler.start()
     child_process = None
 
     while True:
-        # check for download
-        task.download()
-        task2.download()
-        task3.auto_change_month()
-
         trading = check_trading_period()
 
         # Start child process in trading period
         if trading and (child_process is None or not child_process.is_alive()):
+            # 下载和换月任务由调度器在线程中执行，需等待其结束，确保策略初始化时读取到补齐后的数据和换月后的合约
+            if not scheduler.wait_jobs(STARTUP_JOBS, DOWNLOAD_WAIT_SECONDS):
+                print("等待数据下载及换月超时，直接启动子进程")
             print("parent启动子进程")
             child_process = multiprocessing.Process(target=run_child)
             child_process.start()
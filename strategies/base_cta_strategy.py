@@ -12,9 +12,11 @@ from vnpy_ctastrategy import CtaTemplate, StopOrder
 from vnpy_ctastrategy.backtesting import BacktestingEngine
 from vnpy.trader.object import AccountData
 
-from future_data.trade_data import save_trade_data, TradeStatus, DbTradeData, update_db_trade_data, get_unclosed_trades
+from future_data.tick_recorder import get_tick_recorder
+from future_data.position_ledger import PositionLedger
+from future_data.trade_data import save_round_trip, save_trade_data, wait_trade_updates
 from log.log_init import get_logger
-from util.trading_period import check_real_trading_period
+from util.trading_period import check_real_trading_period, get_days_of_current_trading_day
 
 GLOBAL_SETTINGS = {
     "BACK_TESTING_DATA_SAVE": False
@@ -32,6 +34,7 @@ class BaseCtaStrategy(CtaTemplate):
     # 定义参数
     bar_window = 1  # k线周期
     need_stop = 1  # 0/1是否需要止损
+    record_tick = 0  # 0/1是否记录tick，需加入子类parameters才能通过配置修改
     trailing_percent = 5.0  # 百分比移动止损
     last_stop_order_id = None
 
@@ -67,12 +70,13 @@ class BaseCtaStrategy(CtaTemplate):
         self.am = ArrayManager()
         self.need_stop_for_now = False
         self.stop_price = None
-        # 回测时记录未平仓记录，实盘时直接从数据库获取
-        self.last_trades = []
         # 回测时自动获取总资金
         self.back_testing = False
         if isinstance(cta_engine, BacktestingEngine):
             self.back_testing = True
+        # 未平仓的开仓记录，实盘或指定回测时在初始化时从数据库读取，平仓进度写回数据库
+        self.ledger = PositionLedger(strategy_name,
+                                     persist=not self.back_testing or GLOBAL_SETTINGS["BACK_TESTING_DATA_SAVE"])
         if self.back_testing:
             # 读取回测配置
             self.capital = cta_engine.capital
@@ -82,6 +86,8 @@ class BaseCtaStrategy(CtaTemplate):
         # 日志
         logger_name = "backTesting" if self.back_testing else "main"
         self.logger = get_logger(logger_name)
+        # 实盘时记录收到的tick，由后台线程批量写入文件
+        self.tick_recorder = get_tick_recorder() if self.record_tick and not self.back_testing else None
         # 测试服务连通性
         self.connected = False
 
@@ -89,12 +95,21 @@ class BaseCtaStrategy(CtaTemplate):
         """
         当策略被初始化时调用该函数。
         """
-        # 加载历史数据用于初始化回放
-        self.load_bar(100, use_database=True)
+        if self.ledger.persist:
+            self.ledger.load()
+        # 加载历史数据用于初始化回放，实盘已从日线表预热时只回放当前交易日的分钟线
+        days = 100
+        if not self.back_testing and self.warm_up():
+            days = get_days_of_current_trading_day()
+        self.load_bar(days, use_database=True)
         # 加载完历史数据后，打开日志输出
         self.inited_internal = True
         self.output("策略初始化")
 
+    def warm_up(self) -> bool:
+        """实盘初始化时调用，子类可从合成k线表直接初始化指标，返回True时不再回放历史分钟线"""
+        return False
+
     def on_start(self):
         """
         当策略被启动时调用该函数。
@@ -110,6 +125,7 @@ class BaseCtaStrategy(CtaTemplate):
         """
         self.write_log("策略停止")
         self.output("策略停止")
+        wait_trade_updates()
         self.put_event()
 
     def on_tick(self, tick: TickData):
@@ -117,6 +133,8 @@ class BaseCtaStrategy(CtaTemplate):
         通过该函数收到Tick推送。
         """
         self.connected = True
+        if self.tick_recorder is not None:
+            self.tick_recorder.record(tick)
         if not check_real_trading_period(tick.datetime):
             self.output("not in trading period, %s" % tick)
             return
@@ -231,43 +249,8 @@ class BaseCtaStrategy(CtaTemplate):
             self.logger.info("%s==== %s" % (self.strategy_name, msg))
 
     def calculate_revenue(self, trade: TradeData):
-        # 已平仓手数
-        trade.closed_volume = 0
-        # 默认未平仓
-        trade.status = TradeStatus.UN_CLOSED.value
-
-        if trade.offset == Offset.NONE:
-            return
-        # 查询反方向的未平仓开仓单
-        direction = Direction.SHORT if trade.direction == Direction.LONG else Direction.LONG
-        # 实盘或指定回测时持久化交易记录
-        if not self.back_testing or GLOBAL_SETTINGS["BACK_TESTING_DATA_SAVE"]:
-            self.last_trades = get_unclosed_trades(self.strategy_name, self.vt_symbol, direction.name)
-        # 开仓交易记录直接储存到内存中
-        if trade.offset == Offset.OPEN:
-            # open only need to save data into db or list
-            self.last_trades.append(trade)
-            return
-
-        # 根据平仓方向过滤反方向的开仓数据
-        last_trades_of_direction = [v for v in self.last_trades if
-                                    v.direction == direction or v.direction == direction.name]
-        # 开始按先进先出匹配平仓数据
-        while len(last_trades_of_direction) > 0 and trade.closed_volume < trade.volume:
-            last_trade = last_trades_of_direction[0]
-
-            # 按较小值匹配当前成交量与开仓数据未平仓量
-            c_volume = min(last_trade.volume - last_trade.closed_volume, trade.volume - trade.closed_volume)
-            # 记录平仓
-            last_trade.closed_volume += c_volume
-            trade.closed_volume += c_volume
-            # 已全部平仓，移除数据并修改到数据库
-            if last_trade.volume <= last_trade.closed_volume:
-                last_trade.status = TradeStatus.CLOSED.value
-                last_trades_of_direction.remove(last_trade)
-                self.last_trades.remove(last_trade)
-            if isinstance(last_trade, DbTradeData):
-                update_db_trade_data(last_trade)
+        # 开仓加入持仓明细，平仓按先进先出匹配反方向的开仓数据
+        for last_trade, c_volume in self.ledger.update_trade(trade):
             # 计算每张合约的损益
             # print("self.last_trade.tradeid %s" % self.last_trade.tradeid)
             # print("self.trade.tradeid %s" % trade.tradeid)
@@ -295,7 +278,11 @@ class BaseCtaStrategy(CtaTemplate):
             self.output(msg)
             self.output(self.pos)
             self.capital += total_revenue
-            pass
+            if self.ledger.persist:
+                # 单笔盈亏由后台线程写入，用于资金曲线和策略统计
+                save_round_trip(self.strategy_name, last_trade, trade, volume,
+                                revenue_per_contract * self.size * volume, total_revenue, self.capital,
+                                use_local_time=not self.back_testing)
 
     def calculate_volume(self, current_price):
         volume = 1
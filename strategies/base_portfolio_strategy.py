@@ -8,7 +8,9 @@ from vnpy.trader.object import TickData, BarData, OrderData, TradeData
 from vnpy.trader.utility import BarGenerator
 
 from future_data.portfolio_global_config import vt_settings_with_short_code
-from future_data.trade_data import TradeStatus, get_unclosed_trades, DbTradeData, update_db_trade_data, save_trade_data
+from future_data.tick_recorder import get_tick_recorder
+from future_data.position_ledger import PositionLedger
+from future_data.trade_data import save_round_trip, save_trade_data, wait_trade_updates
 from log.log_init import get_logger
 from strategies.base_cta_strategy import GLOBAL_SETTINGS
 from util.vt_symbol_util import split_vnpy_format
@@ -23,6 +25,8 @@ class BasePortfolioStrategy(StrategyTemplate):
     vt_settings = {}
     # 总资金
     capital = 1000000
+    # 0/1是否记录tick，需加入子类parameters才能通过配置修改
+    record_tick = 0
     parameters = [
     ]
     variables = [
@@ -47,12 +51,16 @@ class BasePortfolioStrategy(StrategyTemplate):
             self.back_testing = True
         logger_name = "backTesting" if self.back_testing else "main"
         self.logger = get_logger(logger_name)
+        # 实盘时记录收到的tick，由后台线程批量写入文件
+        self.tick_recorder = get_tick_recorder() if self.record_tick and not self.back_testing else None
         # 记录是否初始化完成(如加载历史数据)
         self.inited_internal = False
         # 业务相关数据
         self.bgs: Dict[str, BarGenerator] = {}
         self.last_tick_time: datetime = None
-        self.last_trades = {}
+        # 未平仓的开仓记录，实盘或指定回测时在初始化时从数据库读取，平仓进度写回数据库
+        self.ledger = PositionLedger(strategy_name,
+                                     persist=not self.back_testing or GLOBAL_SETTINGS["BACK_TESTING_DATA_SAVE"])
 
         # 参考vnpy源码，需要为BarGenerator提供on_bar方法
         def on_bar(bar: BarData):
@@ -61,7 +69,6 @@ class BasePortfolioStrategy(StrategyTemplate):
 
         for vt_symbol in self.vt_symbols:
             self.bgs[vt_symbol] = BarGenerator(on_bar)
-            self.last_trades[vt_symbol] = []
             if self.back_testing:
                 self.capital = strategy_engine.capital
 
@@ -71,6 +78,7 @@ class BasePortfolioStrategy(StrategyTemplate):
         """
         self.output("策略初始化")
         # print("策略初始化")
+        self.init_ledger()
         if not self.back_testing:
             # for vt_symbol in self.vt_symbols:
             #     download_data_from_jq(vt_symbol.split('.')[0])
@@ -78,6 +86,11 @@ class BasePortfolioStrategy(StrategyTemplate):
         self.inited_internal = True
         print("初始化结束")
 
+    def init_ledger(self):
+        """读取数据库中未平仓的开仓记录，子类重写on_init时需调用"""
+        if self.ledger.persist:
+            self.ledger.load()
+
     def on_start(self):
         """
         Callback when strategy is started.
@@ -91,6 +104,7 @@ class BasePortfolioStrategy(StrategyTemplate):
         """
         self.output("start save variables")
         self.sync_data()
+        wait_trade_updates()
         self.write_log("策略停止")
 
     def on_tick(self, tick: TickData):
@@ -98,6 +112,8 @@ class BasePortfolioStrategy(StrategyTemplate):
         Callback of new tick data update.
         """
         # print("tick=%s,vt_symbol=%s" % (tick.datetime,tick.vt_symbol))
+        if self.tick_recorder is not None:
+            self.tick_recorder.record(tick)
         new_minute = False
         if self.last_tick_time:
             if self.last_tick_time.minute < tick.datetime.minute \
@@ -141,36 +157,8 @@ class BasePortfolioStrategy(StrategyTemplate):
                             use_local_time=not self.back_testing)
 
     def calculate_revenue(self, trade: TradeData):
-        # init data for trade
-        trade.closed_volume = 0
-        trade.status = TradeStatus.UN_CLOSED.value
-
-        if trade.offset == Offset.NONE:
-            return
-        trades = self.last_trades[trade.vt_symbol]
-        # load data from db if not back testing
-        direction = Direction.SHORT if trade.direction == Direction.LONG else Direction.LONG
-        if not self.back_testing or GLOBAL_SETTINGS["BACK_TESTING_DATA_SAVE"]:
-            trades = get_unclosed_trades(self.strategy_name, trade.vt_symbol, direction.name)
-        if trade.offset == Offset.OPEN:
-            # open only need to save data into db or list
-            trades.append(trade)
-            return
-        last_trades_of_direction = [v for v in trades if
-                                    v.direction == direction or v.direction == direction.name]
-        while len(last_trades_of_direction) > 0 and trade.closed_volume < trade.volume:
-            last_trade = last_trades_of_direction[0]
-
-            # volume can be deducted
-            c_volume = min(last_trade.volume - last_trade.closed_volume, trade.volume - trade.closed_volume)
-            last_trade.closed_volume += c_volume
-            trade.closed_volume += c_volume
-            if last_trade.volume <= last_trade.closed_volume:
-                last_trade.status = TradeStatus.CLOSED.value
-                last_trades_of_direction.remove(last_trade)
-                trades.remove(last_trade)
-            if isinstance(last_trade, DbTradeData):
-                update_db_trade_data(last_trade)
+        # 开仓加入持仓明细，平仓按先进先出匹配反方向的开仓数据
+        for last_trade, c_volume in self.ledger.update_trade(trade):
             # 计算每张合约的损益
             # print("self.last_trade.tradeid %s" % self.last_trade.tradeid)
             # print("self.trade.tradeid %s" % trade.tradeid)
@@ -202,7 +190,11 @@ class BasePortfolioStrategy(StrategyTemplate):
             print(self.pos)
             print(msg)
             self.capital += total_revenue
-            pass
+            if self.ledger.persist:
+                # 单笔盈亏由后台线程写入，用于资金曲线和策略统计
+                save_round_trip(self.strategy_name, last_trade, trade, volume,
+                                revenue_per_contract * self.vt_settings["sizes"][symbol] * volume, total_revenue,
+                                self.capital, use_local_time=not self.back_testing)
 
     def output(self, msg: str, display=False):
         if self.inited_internal or display:
@@ -1,9 +1,14 @@
+from datetime import datetime
+
 from vnpy.trader.object import (
     BarData,
 )
+from vnpy.trader.utility import extract_vt_symbol
 
+from future_data.bar_resample import load_resampled_bars, PERIOD_1D
 from strategies.base_cta_strategy import BaseCtaStrategy
 from util.day_bar_generator import DayBarGenerator
+from util.trading_period import get_trading_day
 
 
 class MacdHistStrategy(BaseCtaStrategy):
@@ -32,6 +37,13 @@ class MacdHistStrategy(BaseCtaStrategy):
         super().__init__(cta_engine, strategy_name, vt_symbol, setting)
         self.dbg = DayBarGenerator(max_length=100)
 
+    def warm_up(self) -> bool:
+        """从日线表加载已走完的交易日，不足ArrayManager长度(MACD按整个数组计算)时仍回放分钟线"""
+        symbol, exchange = extract_vt_symbol(self.vt_symbol)
+        bars = load_resampled_bars(symbol, exchange, PERIOD_1D, self.dbg.max_length,
+                                   before_day=get_trading_day(datetime.now()))
+        return self.dbg.load_day_bars(bars) > 0
+
     def on_bar_m(self, bar: BarData):
 
         self.output("on_bar_m : %s" % str(bar))
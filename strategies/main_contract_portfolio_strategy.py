@@ -6,12 +6,14 @@ from datetime import timedelta
 from typing import List, Dict, Tuple
 
 from vnpy_portfoliostrategy import StrategyEngine
-from vnpy.trader.constant import Direction, Offset
+from vnpy.trader.constant import Direction, Offset, Exchange
 from vnpy.trader.object import BarData
 
 
+from future_data.bar_resample import load_resampled_bars, PERIOD_1D
 from strategies.base_portfolio_strategy import BasePortfolioStrategy
 from util.day_bar_generator import DayBarGenerator
+from util.trading_period import get_trading_day, get_days_of_current_trading_day
 from util.vt_symbol_util import split_vnpy_format, concat_vnpy_format
 
 
@@ -99,6 +101,7 @@ class MainContractPortfolioStrategy(BasePortfolioStrategy):
         """
         try:
             self.output("策略初始化")
+            self.init_ledger()
             if not self.back_testing:
                 # 将合约转换为主力连续，方便计算长期趋势等数据
                 symbols = set()
@@ -108,13 +111,37 @@ class MainContractPortfolioStrategy(BasePortfolioStrategy):
                     # 添加主力连续
                     symbols.add(concat_vnpy_format(exchange, symbol,
                                                    MainContractPortfolioStrategy.history_contract_default_code))
+                # 全部品种均已从日线表预热时，只回放当前交易日的分钟线
+                days = get_days_of_current_trading_day() if self.warm_up() else 100
                 # 调用定制后的load_bars
-                self.load_bars(100, inparam_vt_symbols=symbols)
+                self.load_bars(days, inparam_vt_symbols=symbols)
             self.inited_internal = True
         except Exception as e:
             self.logger.error(e, stack_info=True, exc_info=True)
             pass
 
+    def warm_up(self) -> bool:
+        """用主力连续合约的日线初始化各品种的日线记录，返回是否全部品种都已预热"""
+        before_day = get_trading_day(datetime.now())
+        all_loaded = True
+        exchanges = {}
+        for vt_symbol in self.vt_symbols:
+            exchange, symbol, month = split_vnpy_format(vt_symbol)
+            exchanges[symbol] = exchange
+        for symbol, exchange in exchanges.items():
+            bars = load_resampled_bars(symbol + MainContractPortfolioStrategy.history_contract_default_code,
+                                       Exchange(exchange), PERIOD_1D, self.day_bgs[symbol].max_length,
+                                       before_day=before_day)
+            loaded = self.day_bgs[symbol].load_day_bars(bars, self.get_warm_up_window(symbol))
+            self.output("warm up %s, day bars=%s" % (symbol, loaded))
+            if loaded < 1:
+                all_loaded = False
+        return all_loaded
+
+    def get_warm_up_window(self, symbol: str) -> int:
+        """预热所需的最少日线数量，默认为日线记录的ArrayManager长度，子类可按所用指标的最长窗口返回"""
+        return self.day_bgs[symbol].am.size
+
     def on_bars(self, bars: Dict[str, BarData]):
         # 拷贝，避免直接修改bars对象
         # 否则会对vnpy内部使用产生影响
@@ -90,6 +90,10 @@ class TurtlePortfolioStrategyNew(MainContractPortfolioStrategy):
             for symbol in r_array:
                 self.vt_relations[symbol] = r_array
 
+    def get_warm_up_window(self, symbol: str) -> int:
+        """唐奇安通道和ATR所需的最长窗口"""
+        return max(self.s1_window, self.s2_window, self.exit_window, self.atr_window)
+
     def process_main_contract_bar(self, bar: BarData):
         vt_symbol = bar.vt_symbol
         exchange, symbol, month = split_vnpy_format(vt_symbol)
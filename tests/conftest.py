@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+from peewee import SqliteDatabase
+
+# 项目未打包安装，以仓库根目录作为导入路径
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+
+
+@pytest.fixture
+def bind_sqlite(tmp_path):
+    """
+    将peewee模型临时绑定到tmp_path下的sqlite文件并建表，测试结束后恢复原绑定
+    使用文件而非内存数据库，后台写入线程打开的连接读写的是同一个库
+    """
+    bound = []
+
+    def bind(models: list) -> SqliteDatabase:
+        sqlite_db = SqliteDatabase(str(tmp_path / "test.db"))
+        context = sqlite_db.bind_ctx(models, bind_refs=False, bind_backrefs=False)
+        context.__enter__()
+        bound.append((sqlite_db, context))
+        sqlite_db.create_tables(models)
+        return sqlite_db
+
+    yield bind
+    for sqlite_db, context in reversed(bound):
+        context.__exit__(None, None, None)
+        sqlite_db.close()
@@ -0,0 +1,93 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from vnpy.trader.constant import Exchange, Interval
+from vnpy.trader.database import DB_TZ
+from vnpy.trader.object import BarData
+
+from future_data.bar_cache import BarCache
+from future_data.bar_resample import DbResampledBar
+from future_data.bar_trading_day import DbBarTradingDay
+from future_data.continuous_contract import DbContractRoll, build_continuous_contract
+from future_data.data_downloader import save_bar
+from future_data.db_pool import DbBarData, DbBarOverview
+
+pytest.importorskip("pyarrow")
+
+MODELS = [DbBarData, DbBarOverview, DbBarTradingDay, DbResampledBar, DbContractRoll]
+START = datetime(2021, 11, 1)
+END = datetime(2022, 3, 1)
+
+
+def make_bars(symbol: str, day: datetime, price: float, open_interest: float = 1000, count: int = 5) -> list:
+    """day当天9:00开始的分钟线，时间带数据库时区"""
+    start = day.replace(hour=9, tzinfo=DB_TZ)
+    return [BarData(gateway_name="DB", symbol=symbol, exchange=Exchange.SHFE, datetime=start + timedelta(minutes=i),
+                    interval=Interval.MINUTE, open_price=price, high_price=price, low_price=price, close_price=price,
+                    volume=10, open_interest=open_interest)
+            for i in range(count)]
+
+
+@pytest.fixture
+def cache(bind_sqlite, tmp_path):
+    bind_sqlite(MODELS)
+    return BarCache(str(tmp_path / "bar_cache"))
+
+
+def load_closes(cache: BarCache, symbol: str) -> list:
+    df = cache.load_frame(symbol, Exchange.SHFE, Interval.MINUTE, START, END, columns=["close_price"])
+    return df["close_price"].tolist()
+
+
+def test_load_from_database_then_cache(cache):
+    save_bar(make_bars("rb2301", datetime(2022, 1, 4), 100) + make_bars("rb2301", datetime(2022, 2, 7), 101))
+    assert load_closes(cache, "rb2301") == [100] * 5 + [101] * 5
+    path = cache._get_dir("rb2301", Exchange.SHFE, Interval.MINUTE)
+    assert sorted(f for f in os.listdir(path) if f.endswith(".parquet")) == ["2022-01.parquet", "2022-02.parquet"]
+    # 库中数据不变时直接读缓存
+    DbBarData.update(close_price=0).where(DbBarData.symbol == "rb2301").execute()
+    assert load_closes(cache, "rb2301") == [100] * 5 + [101] * 5
+
+
+def test_appended_bars_invalidate_last_month(cache):
+    save_bar(make_bars("rb2301", datetime(2022, 1, 4), 100))
+    assert load_closes(cache, "rb2301") == [100] * 5
+    save_bar(make_bars("rb2301", datetime(2022, 1, 5), 102))
+    assert load_closes(cache, "rb2301") == [100] * 5 + [102] * 5
+
+
+def test_earlier_history_rebuilds_cache(cache):
+    save_bar(make_bars("rb2301", datetime(2022, 2, 7), 101))
+    assert load_closes(cache, "rb2301") == [101] * 5
+    save_bar(make_bars("rb2301", datetime(2022, 1, 4), 100))
+    assert load_closes(cache, "rb2301") == [100] * 5 + [101] * 5
+
+
+def test_clear_drops_all_intervals(cache):
+    save_bar(make_bars("rb2301", datetime(2022, 1, 4), 100))
+    load_closes(cache, "rb2301")
+    DbBarData.update(close_price=200).where(DbBarData.symbol == "rb2301").execute()
+    cache.clear("rb2301", Exchange.SHFE)
+    assert load_closes(cache, "rb2301") == [200] * 5
+
+
+def test_continuous_contract_roll_clears_cache(cache, monkeypatch):
+    # build_continuous_contract使用默认目录的BarCache，指向测试目录
+    monkeypatch.setattr("future_data.continuous_contract.BarCache", lambda: cache)
+    bars = []
+    for day in [datetime(2021, 11, 29), datetime(2021, 11, 30), datetime(2021, 12, 1)]:
+        bars += make_bars("rb2301", day, 100, open_interest=3000) + make_bars("rb2305", day, 110, open_interest=1000)
+    save_bar(bars)
+    build_continuous_contract("rb", Exchange.SHFE)
+    assert load_closes(cache, "rb7777") == [100] * 15
+    # 1月4日新合约持仓量超过旧合约，1月5日换月，之前的价格按1月4日收盘价比例调整
+    # 向后追加数据只会重建最后缓存月份(12月)及之后的分区，11月的分区需由换月清除
+    save_bar(make_bars("rb2301", datetime(2022, 1, 4), 100, open_interest=1000)
+             + make_bars("rb2305", datetime(2022, 1, 4), 120, open_interest=4000)
+             + make_bars("rb2301", datetime(2022, 1, 5), 100, open_interest=1000)
+             + make_bars("rb2305", datetime(2022, 1, 5), 120, open_interest=4000))
+    build_continuous_contract("rb", Exchange.SHFE)
+    closes = load_closes(cache, "rb7777")
+    assert closes[:20] == pytest.approx([120.0] * 20)
+    assert closes[20:] == [120] * 5
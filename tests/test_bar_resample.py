@@ -0,0 +1,90 @@
+from datetime import date, datetime, timedelta
+
+from vnpy.trader.constant import Exchange, Interval
+from vnpy.trader.object import BarData
+
+from future_data.bar_resample import PERIOD_15M, PERIOD_1D, PERIOD_5M, resample_rows
+from util.day_bar_generator import DayBarGenerator
+
+
+def make_rows(start: datetime, count: int) -> list:
+    """连续的分钟线，价格逐分钟递增"""
+    return [(start + timedelta(minutes=i), 100.0 + i, 101.0 + i, 99.0 + i, 100.5 + i, 1.0, 10.0, 1000.0 + i)
+            for i in range(count)]
+
+
+def make_bar(dt: datetime, price: float) -> BarData:
+    return BarData(gateway_name="DB", symbol="rb2301", exchange=Exchange.SHFE, datetime=dt,
+                   interval=Interval.MINUTE, open_price=price, high_price=price, low_price=price,
+                   close_price=price, volume=1)
+
+
+def test_resample_five_minutes():
+    results = resample_rows(make_rows(datetime(2022, 1, 4, 9, 0), 12), PERIOD_5M)
+    assert [r["datetime"] for r in results] == [datetime(2022, 1, 4, 9, 0), datetime(2022, 1, 4, 9, 5),
+                                               datetime(2022, 1, 4, 9, 10)]
+    first = results[0]
+    assert first["open_price"] == 100.0
+    assert first["high_price"] == 105.0
+    assert first["low_price"] == 99.0
+    assert first["close_price"] == 104.5
+    assert first["volume"] == 5.0
+    assert first["turnover"] == 50.0
+    assert first["open_interest"] == 1004.0
+    assert first["bar_count"] == 5
+    assert results[-1]["bar_count"] == 2
+
+
+def test_resample_aligns_to_natural_time():
+    results = resample_rows(make_rows(datetime(2022, 1, 4, 9, 7), 10), PERIOD_15M)
+    assert [r["datetime"] for r in results] == [datetime(2022, 1, 4, 9, 0), datetime(2022, 1, 4, 9, 15)]
+    assert [r["bar_count"] for r in results] == [8, 2]
+
+
+def test_resample_daily_by_trading_day():
+    # 周五夜盘和下周一白天合成同一根日线
+    rows = make_rows(datetime(2022, 1, 7, 21, 0), 3) + make_rows(datetime(2022, 1, 10, 9, 0), 2)
+    results = resample_rows(rows, PERIOD_1D)
+    assert len(results) == 1
+    assert results[0]["trading_day"] == date(2022, 1, 10)
+    assert results[0]["datetime"] == datetime(2022, 1, 10)
+    assert results[0]["bar_count"] == 5
+
+
+def test_day_bar_generator_defaults_to_calendar_day():
+    dbg = DayBarGenerator(10)
+    for dt in [datetime(2022, 1, 4, 14, 0), datetime(2022, 1, 4, 21, 0), datetime(2022, 1, 5, 9, 0)]:
+        dbg.update_bar(make_bar(dt, 100))
+    # 夜盘按自然日归入1月4日，1月5日的白盘开始新的日线
+    assert len(dbg.bars) == 1
+    assert dbg.bars[0].datetime == datetime(2022, 1, 4, 14, 0)
+
+
+def test_day_bar_generator_trading_day_opt_in():
+    dbg = DayBarGenerator(10, use_trading_day=True)
+    for dt in [datetime(2022, 1, 4, 14, 0), datetime(2022, 1, 4, 21, 0), datetime(2022, 1, 5, 9, 0)]:
+        dbg.update_bar(make_bar(dt, 100))
+    # 夜盘开始新的交易日
+    assert len(dbg.bars) == 1
+    assert dbg.current_bar.datetime == datetime(2022, 1, 4, 21, 0)
+
+
+def test_load_day_bars_requires_full_window():
+    dbg = DayBarGenerator(10)
+    days = [make_bar(datetime(2022, 1, 3) + timedelta(days=i), 100 + i) for i in range(5)]
+    assert dbg.load_day_bars(days, min_count=6) == 0
+    assert not dbg.use_trading_day
+    assert len(dbg.bars) == 0
+
+
+def test_load_day_bars_switches_to_trading_day():
+    dbg = DayBarGenerator(10)
+    days = [make_bar(datetime(2022, 1, 3) + timedelta(days=i), 100 + i) for i in range(5)]
+    assert dbg.load_day_bars(days, min_count=5) == 5
+    assert dbg.use_trading_day
+    assert dbg.last_loaded_day == date(2022, 1, 7)
+    # 已预加载交易日的分钟线不再合成
+    dbg.update_bar(make_bar(datetime(2022, 1, 7, 10, 0), 200))
+    assert dbg.current_bar is None
+    dbg.update_bar(make_bar(datetime(2022, 1, 7, 21, 0), 200))
+    assert dbg.current_bar is not None
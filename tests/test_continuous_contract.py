@@ -0,0 +1,55 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from future_data.continuous_contract import ADJUST_DIFFERENCE, ADJUST_RATIO, ROLL_BY_OPEN_INTEREST, \
+    combine_factors, get_adjust_factor, get_adjusted_symbol, select_rolls
+
+DAYS = [date(2022, 1, 3), date(2022, 1, 4), date(2022, 1, 5), date(2022, 1, 6), date(2022, 1, 7)]
+
+
+def make_metrics(open_interest: dict, close_price: dict) -> dict:
+    """与load_daily_metrics格式一致，行为交易日，列为合约"""
+    return {"open_interest": pd.DataFrame(open_interest, index=DAYS),
+            "volume": pd.DataFrame(open_interest, index=DAYS),
+            "close_price": pd.DataFrame(close_price, index=DAYS)}
+
+
+def test_roll_uses_previous_day_leader():
+    metrics = make_metrics({"rb2301": [300, 300, 100, 100, 100], "rb2305": [100, 200, 400, 400, 400]},
+                           {"rb2301": [10.0, 11.0, 12.0, 13.0, 14.0], "rb2305": [20.0, 21.0, 22.0, 23.0, 24.0]})
+    segments, rolls = select_rolls(metrics, ROLL_BY_OPEN_INTEREST, None, set(), date.min)
+    # 1月5日的持仓量换手，1月6日起使用新合约，调整值按1月5日的收盘价计算
+    assert rolls == [(date(2022, 1, 6), "rb2301", "rb2305", 12.0, 22.0)]
+    assert segments == [["rb2301", date(2022, 1, 3), date(2022, 1, 5)],
+                        ["rb2305", date(2022, 1, 6), date(2022, 1, 7)]]
+
+
+def test_never_roll_back_to_retired_contract():
+    metrics = make_metrics({"rb2301": [300, 100, 500, 500, 500], "rb2305": [100, 200, 100, 100, 100]},
+                           {"rb2301": [10.0] * 5, "rb2305": [20.0] * 5})
+    segments, rolls = select_rolls(metrics, ROLL_BY_OPEN_INTEREST, None, set(), date.min)
+    assert [roll[1:3] for roll in rolls] == [("rb2301", "rb2305")]
+    assert segments[-1] == ["rb2305", date(2022, 1, 5), date(2022, 1, 7)]
+
+
+def test_incremental_select_continues_from_current():
+    metrics = make_metrics({"rb2301": [300, 300, 100, 100, 100], "rb2305": [100, 200, 400, 400, 400]},
+                           {"rb2301": [10.0] * 5, "rb2305": [20.0] * 5})
+    segments, rolls = select_rolls(metrics, ROLL_BY_OPEN_INTEREST, "rb2305", {"rb2301"}, date(2022, 1, 6))
+    assert rolls == []
+    assert segments == [["rb2305", date(2022, 1, 6), date(2022, 1, 7)]]
+
+
+def test_adjust_factors():
+    assert get_adjust_factor(10.0, 12.0, ADJUST_RATIO) == pytest.approx(1.2)
+    assert get_adjust_factor(10.0, 12.0, ADJUST_DIFFERENCE) == pytest.approx(2.0)
+    assert combine_factors([1.2, 1.5], ADJUST_RATIO) == pytest.approx(1.8)
+    assert combine_factors([2.0, -0.5], ADJUST_DIFFERENCE) == pytest.approx(1.5)
+    assert combine_factors([], ADJUST_RATIO) == 1.0
+    assert combine_factors([], ADJUST_DIFFERENCE) == 0.0
+
+
+def test_adjusted_symbol():
+    assert get_adjusted_symbol("rb", ADJUST_RATIO) == "rb7777"
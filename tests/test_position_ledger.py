@@ -0,0 +1,86 @@
+from datetime import datetime
+
+import pytest
+from vnpy.trader.constant import Direction, Exchange, Offset
+from vnpy.trader.object import TradeData
+
+from future_data import trade_data
+from future_data.position_ledger import PositionLedger
+from future_data.trade_data import DbRoundTrip, DbTradeData, TradeStatus, TradeWriter, save_trade_data
+
+VT_SYMBOL = "rb2301.SHFE"
+
+
+def make_trade(tradeid: str, direction: Direction, offset: Offset, volume: int, dt: datetime,
+               orderid: str = None, price: float = 100.0) -> TradeData:
+    trade = TradeData(gateway_name="CTP", symbol="rb2301", exchange=Exchange.SHFE,
+                      orderid=orderid if orderid is not None else "o" + tradeid, tradeid=tradeid,
+                      direction=direction, offset=offset, price=price, volume=volume, datetime=dt)
+    # 与策略on_trade一致
+    trade.closed_volume = 0
+    return trade
+
+
+def test_fifo_matching_across_opens():
+    ledger = PositionLedger("s", persist=False)
+    first = make_trade("1", Direction.LONG, Offset.OPEN, 2, datetime(2022, 1, 4, 9))
+    second = make_trade("2", Direction.LONG, Offset.OPEN, 3, datetime(2022, 1, 4, 10))
+    assert ledger.update_trade(first) == []
+    assert ledger.update_trade(second) == []
+    assert ledger.get_open_volume(VT_SYMBOL, Direction.LONG) == 5
+
+    matches = ledger.update_trade(make_trade("3", Direction.SHORT, Offset.CLOSE, 4, datetime(2022, 1, 4, 11)))
+    assert [(trade.tradeid, volume) for trade, volume in matches] == [("1", 2), ("2", 2)]
+    assert first.status == TradeStatus.CLOSED.value
+    assert second.closed_volume == 2
+    assert second.status == TradeStatus.UN_CLOSED.value
+    assert ledger.get_open_trades(VT_SYMBOL, Direction.LONG) == [second]
+    assert ledger.get_open_volume(VT_SYMBOL, Direction.LONG) == 1
+
+
+def test_close_only_matches_opposite_direction():
+    ledger = PositionLedger("s", persist=False)
+    ledger.update_trade(make_trade("1", Direction.SHORT, Offset.OPEN, 1, datetime(2022, 1, 4, 9)))
+    # 平多仓时没有多头开仓，不匹配空头开仓
+    assert ledger.update_trade(make_trade("2", Direction.SHORT, Offset.CLOSE, 1, datetime(2022, 1, 4, 10))) == []
+    matches = ledger.update_trade(make_trade("3", Direction.LONG, Offset.CLOSETODAY, 1, datetime(2022, 1, 4, 11)))
+    assert [(trade.tradeid, volume) for trade, volume in matches] == [("1", 1)]
+    assert ledger.get_open_volume(VT_SYMBOL, Direction.SHORT) == 0
+
+
+@pytest.fixture
+def writer(bind_sqlite, tmp_path, monkeypatch):
+    bind_sqlite([DbTradeData, DbRoundTrip])
+    trade_writer = TradeWriter(journal_dir=str(tmp_path), retry_interval=0.01, fsync=False)
+    trade_writer.start()
+    monkeypatch.setattr(trade_data, "_writer", trade_writer)
+    yield trade_writer
+    trade_writer.close()
+
+
+def test_load_and_persist_closed_volume(writer):
+    save_trade_data("s", 1000, make_trade("1", Direction.LONG, Offset.OPEN, 2, datetime(2022, 1, 4, 9)))
+    writer.flush(5)
+    # 重启后从数据库读取未平仓的开仓，平仓进度按主键写回
+    ledger = PositionLedger("s")
+    ledger.load()
+    assert ledger.get_open_volume(VT_SYMBOL, Direction.LONG) == 2
+    ledger.update_trade(make_trade("2", Direction.SHORT, Offset.CLOSE, 2, datetime(2022, 1, 4, 10)))
+    writer.flush(5)
+    row = DbTradeData.get(DbTradeData.tradeid == "1")
+    assert (row.closed_volume, row.status) == (2, TradeStatus.CLOSED.value)
+
+
+def test_update_does_not_touch_older_open_with_same_tradeid(writer):
+    # 上一次回测遗留的未平仓开仓，成交编号与本次运行相同
+    save_trade_data("s", 1000, make_trade("1", Direction.LONG, Offset.OPEN, 1, datetime(2022, 1, 4, 9), "old"))
+    writer.flush(5)
+    ledger = PositionLedger("s")
+    opened = make_trade("1", Direction.LONG, Offset.OPEN, 1, datetime(2022, 2, 7, 9, 0, 0, 500000), "new")
+    ledger.update_trade(opened)
+    save_trade_data("s", 1000, opened)
+    closed = make_trade("2", Direction.SHORT, Offset.CLOSE, 1, datetime(2022, 2, 7, 10))
+    assert [(trade.orderid, volume) for trade, volume in ledger.update_trade(closed)] == [("new", 1)]
+    writer.flush(5)
+    statuses = {row.orderid: row.status for row in DbTradeData.select().where(DbTradeData.offset == Offset.OPEN.name)}
+    assert statuses == {"old": TradeStatus.UN_CLOSED.value, "new": TradeStatus.CLOSED.value}
@@ -0,0 +1,75 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+from vnpy.trader.constant import Direction, Exchange, Offset
+from vnpy.trader.object import TradeData
+
+from future_data.trade_data import DEAD_LETTER_FILE, OP_INSERT, DbRoundTrip, DbTradeData, TradeWriter, \
+    trade_to_row
+
+
+def make_row(tradeid: str, orderid: str, dt: datetime) -> dict:
+    trade = TradeData(gateway_name="CTP", symbol="rb2301", exchange=Exchange.SHFE, orderid=orderid,
+                      tradeid=tradeid, direction=Direction.LONG, offset=Offset.OPEN, price=100, volume=1,
+                      datetime=dt)
+    trade.closed_volume = 0
+    return trade_to_row("s", 1000, trade)
+
+
+def write_journal(path: str, rows: list):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps({"type": OP_INSERT, "row": dict(row, datetime=row["datetime"].isoformat())}) + "\n")
+
+
+def saved_orderids() -> list:
+    return [row.orderid for row in DbTradeData.select().order_by(DbTradeData.id)]
+
+
+@pytest.fixture
+def journal_dir(bind_sqlite, tmp_path):
+    bind_sqlite([DbTradeData, DbRoundTrip])
+    return str(tmp_path)
+
+
+def test_replay_orphan_journal(journal_dir):
+    # 已退出进程遗留的日志：一条已写入，一条未写入，另有一条成交编号相同的旧成交
+    committed = make_row("1", "a", datetime(2022, 1, 4, 9, 0))
+    DbTradeData.insert_many([committed, make_row("2", "old", datetime(2021, 12, 1, 9, 0))]).execute()
+    orphan = os.path.join(journal_dir, "trade_journal.99999.jsonl")
+    write_journal(orphan, [committed, make_row("2", "b", datetime(2022, 1, 4, 9, 1))])
+    writer = TradeWriter(journal_dir=journal_dir, retry_interval=0.01, fsync=False)
+    writer.start()
+    assert writer.flush(5)
+    writer.close()
+    assert not os.path.exists(orphan)
+    assert not os.path.exists(orphan + ".lock")
+    assert saved_orderids() == ["a", "old", "b"]
+
+
+def test_failed_op_moved_to_dead_letter(journal_dir):
+    writer = TradeWriter(journal_dir=journal_dir, retry_interval=0.01, max_retries=2, fsync=False)
+    writer.start()
+    broken = make_row("1", "a", datetime(2022, 1, 4, 9, 0))
+    del broken["capital"]
+    writer.submit_insert(broken)
+    writer.submit_insert(make_row("2", "b", datetime(2022, 1, 4, 9, 1)))
+    assert writer.flush(5)
+    writer.close()
+    # 失败的操作不阻塞后续写入
+    assert saved_orderids() == ["b"]
+    with open(os.path.join(journal_dir, DEAD_LETTER_FILE), encoding="utf-8") as f:
+        letters = [json.loads(line) for line in f]
+    assert [letter["op"]["row"]["orderid"] for letter in letters] == ["a"]
+
+
+def test_close_removes_own_journal(journal_dir):
+    writer = TradeWriter(journal_dir=journal_dir, retry_interval=0.01, fsync=False)
+    writer.start()
+    writer.submit_insert(make_row("1", "a", datetime(2022, 1, 4, 9, 0)))
+    writer.close()
+    assert saved_orderids() == ["a"]
+    assert not os.path.exists(writer.journal_path)
+    assert not os.path.exists(writer.journal_path + ".lock")
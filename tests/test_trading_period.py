@@ -0,0 +1,50 @@
+from datetime import date, datetime
+
+from util.trading_period import estimate_trading_minutes, get_days_of_current_trading_day, get_trading_day, \
+    get_trading_day_range
+
+
+def test_trading_day_of_day_session():
+    assert get_trading_day(datetime(2022, 1, 4, 9, 0)) == date(2022, 1, 4)
+    assert get_trading_day(datetime(2022, 1, 4, 16, 59)) == date(2022, 1, 4)
+
+
+def test_night_session_belongs_to_next_trading_day():
+    assert get_trading_day(datetime(2022, 1, 4, 21, 0)) == date(2022, 1, 5)
+    # 凌晨的夜盘仍属于当天的交易日
+    assert get_trading_day(datetime(2022, 1, 5, 1, 0)) == date(2022, 1, 5)
+
+
+def test_friday_night_belongs_to_monday():
+    # 2022-01-07为周五
+    assert get_trading_day(datetime(2022, 1, 7, 21, 0)) == date(2022, 1, 10)
+    assert get_trading_day(datetime(2022, 1, 8, 1, 0)) == date(2022, 1, 10)
+
+
+def test_trading_day_range_starts_at_previous_weekday_evening():
+    assert get_trading_day_range(date(2022, 1, 5)) == (datetime(2022, 1, 4, 17), datetime(2022, 1, 5, 17))
+    assert get_trading_day_range(date(2022, 1, 10)) == (datetime(2022, 1, 7, 17), datetime(2022, 1, 10, 17))
+
+
+def test_days_of_current_trading_day():
+    # 周一白天需回溯到上周五晚上
+    assert get_days_of_current_trading_day(datetime(2022, 1, 10, 10)) == 4
+    assert get_days_of_current_trading_day(datetime(2022, 1, 5, 10)) == 2
+
+
+def test_estimate_trading_minutes_skips_weekend():
+    # 周六凌晨之后到周一早盘前没有交易
+    assert estimate_trading_minutes(datetime(2022, 1, 8, 3, 0), datetime(2022, 1, 10, 8, 0)) == 0
+
+
+def test_estimate_trading_minutes_is_upper_bound():
+    # 周二白天约6小时，估算值包含各品种交易时段的并集
+    minutes = estimate_trading_minutes(datetime(2022, 1, 4, 8, 0), datetime(2022, 1, 4, 16, 0))
+    assert minutes >= 225
+    assert minutes <= 8 * 60
+
+
+def test_estimate_trading_minutes_limit_and_empty_range():
+    assert estimate_trading_minutes(datetime(2022, 1, 3), datetime(2022, 2, 1), limit=100) == 100
+    assert estimate_trading_minutes(datetime(2022, 1, 4), datetime(2022, 1, 3)) == 0
+    assert estimate_trading_minutes(None, datetime(2022, 1, 3)) == 0
@@ -0,0 +1,19 @@
+import time
+
+from peewee import SqliteDatabase
+
+
+def bind_models_to_sqlite(models: list, path: str = ":memory:") -> SqliteDatabase:
+    """将peewee模型绑定到sqlite并建表，用于在没有MySQL的环境下做性能测试"""
+    sqlite_db = SqliteDatabase(path, pragmas={"journal_mode": "wal", "synchronous": "normal"})
+    sqlite_db.bind(models, bind_refs=False, bind_backrefs=False)
+    sqlite_db.connect(reuse_if_open=True)
+    sqlite_db.create_tables(models)
+    return sqlite_db
+
+
+def timed(func, *args, **kwargs):
+    """执行方法并返回结果与耗时(秒)"""
+    start_time = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start_time
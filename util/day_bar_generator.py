@@ -5,16 +5,23 @@ from vnpy.trader.constant import Exchange
 from vnpy.trader.object import BarData
 from vnpy.trader.utility import ArrayManager
 
+from util.trading_period import get_trading_day
+
 DAY = "DAY"
 HOUR = "HOUR"
 MINUTE = "MINUTE"
 
 
 class DayBarGenerator:
+    """
+    由分钟线合成N分钟线、小时线或日线
+    日线默认按自然日划分，与已有策略的回测结果保持一致；
+    use_trading_day为True或从日线表预热后按交易日划分(夜盘归属下一交易日，周五夜盘归属下周一)，与DbResampledBar的日线一致
+    """
     # k线数组最大长度，超出长度后丢弃过期数据
     max_length = 60
 
-    def __init__(self, max_length: int = 60, bar_length=1, length_unit=DAY):
+    def __init__(self, max_length: int = 60, bar_length=1, length_unit=DAY, use_trading_day=False):
         """初始化，设置用于计算的k线数量最大数量及k线长度和单位"""
         self.max_length = max_length
         self.bars: BarData = []
@@ -23,6 +30,10 @@ class DayBarGenerator:
         # 支持N分钟k线、小时线、日线
         self.bar_length = bar_length
         self.length_unit = length_unit
+        # 日线是否按交易日划分(夜盘归属下一交易日)，默认按自然日
+        self.use_trading_day = use_trading_day
+        # 预加载日线的最后一个交易日，此前的分钟线不再合成
+        self.last_loaded_day = None
         # 缓存相关，由于日K线的统计数据在当天基本不变，故通过缓存提高回测速度
         self.cache = {}
         self.donchian_data = {}
@@ -34,7 +45,10 @@ class DayBarGenerator:
     def is_same_bar(self, datetime1, datetime2):
         """判断是否属于同一根k线"""
         if self.length_unit == DAY:
-            if datetime1.day != datetime2.day:
+            if self.use_trading_day:
+                if get_trading_day(datetime1) != get_trading_day(datetime2):
+                    return False
+            elif datetime1.day != datetime2.day:
                 return False
         if self.length_unit == HOUR:
             # if datetime1 + timedelta(hours=self.bar_length) < datetime2:
@@ -58,10 +72,34 @@ class DayBarGenerator:
         self.ma_data = {}
         self.wma_data = {}
 
+    def load_day_bars(self, bars: list, min_count: int = None) -> int:
+        """
+        用数据库中按交易日合成的日线预热，代替回放历史分钟线
+        预加载后按交易日合成日线，并忽略预加载最后一个交易日及之前的分钟线
+        :param bars: 按时间正序的已走完的日线
+        :param min_count: 计算指标所需的最少日线数量，默认为ArrayManager的长度，不足时不加载，由调用方回放分钟线
+        :return: 加载的日线数量
+        """
+        min_count = self.am.size if min_count is None else min_count
+        if self.length_unit != DAY or bars is None or len(bars) < max(min_count, 1):
+            return 0
+        self.use_trading_day = True
+        for bar in bars[-self.max_length:]:
+            self.bars.append(bar)
+            self.am.update_bar(bar)
+            if len(self.bars) > self.max_length:
+                self.bars.pop(0)
+        self.last_loaded_day = bars[-1].datetime.date()
+        self.current_bar = None
+        self.reset_cache()
+        return len(bars)
+
     def update_bar(self, bar: BarData, init_function=None):
         """将新的k线更新到数据中"""
         if bar is None:
             return
+        if self.last_loaded_day is not None and get_trading_day(bar.datetime) <= self.last_loaded_day:
+            return
         if self.current_bar is None:
             self.current_bar = bar
             return
@@ -0,0 +1,97 @@
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+
+class FakeTqApi:
+    """
+    离线的TqApi替代品，按相同格式返回模拟的k线和主连历史对应合约，不访问网络
+    用于在没有天勤账号的环境下测试和评估下载流程，可作为download_from_tq的api_factory使用
+    :param latency: 每次请求模拟的网络耗时(秒)
+    :param history_length: 合约可提供的k线数量，请求超过该数量时与天勤一致以NaN补齐前面的k线
+    :param end: 最后一根k线的时间，默认为当前分钟
+    """
+
+    def __init__(self, latency: float = 0.0, history_length: int = None, end: datetime = None, seed: int = 0):
+        self.latency = latency
+        self.history_length = history_length
+        self.end = end if end is not None else datetime.now().replace(second=0, microsecond=0)
+        self.seed = seed
+        self.request_count = 0
+        self.closed = False
+
+    def _wait(self):
+        if self.closed:
+            raise RuntimeError("api closed")
+        self.request_count += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def _random(self, symbol: str) -> np.random.RandomState:
+        # 同一合约每次返回相同的数据，便于验证重复写入和增量同步
+        return np.random.RandomState((zlib.crc32(symbol.encode()) + self.seed) % (2 ** 32))
+
+    def get_kline_serial(self, symbol: str, duration_seconds: int, data_length: int = 200) -> pd.DataFrame:
+        self._wait()
+        size = data_length if self.history_length is None else min(data_length, self.history_length)
+        random = self._random(symbol)
+        end_ns = pd.Timestamp(self.end).tz_localize(datetime.now().astimezone().tzinfo).value
+        datetimes = end_ns - np.arange(size - 1, -1, -1, dtype=np.int64) * duration_seconds * 10 ** 9
+        close = 3000 + np.cumsum(random.randn(size))
+        open_oi = random.randint(10000, 20000, size).astype(np.float64)
+        klines = pd.DataFrame({
+            "datetime": datetimes.astype(np.float64),
+            "id": np.arange(size, dtype=np.float64),
+            "open": close + random.randn(size),
+            "high": close + 2,
+            "low": close - 2,
+            "close": close,
+            "volume": random.randint(1, 1000, size).astype(np.float64),
+            "open_oi": open_oi,
+            "close_oi": open_oi + random.randint(-100, 100, size),
+        })
+        if size < data_length:
+            padding = pd.DataFrame(np.nan, index=range(data_length - size), columns=klines.columns)
+            klines = pd.concat([padding, klines], ignore_index=True)
+        klines["symbol"] = symbol
+        klines["duration"] = duration_seconds
+        return klines
+
+    def query_his_cont_quotes(self, symbol, n: int = 200) -> pd.DataFrame:
+        """
+        返回最近n个交易日各主连对应的标的合约，每月中旬换月到两个月后的合约
+        :param symbol: 主连代码或列表，如KQ.m@SHFE.rb
+        """
+        self._wait()
+        symbols = [symbol] if isinstance(symbol, str) else list(symbol)
+        dates = pd.bdate_range(end=self.end.date(), periods=n)
+        df = pd.DataFrame({"date": dates})
+        for cont_symbol in symbols:
+            exchange, code = cont_symbol.split("@")[-1].split(".")
+            underlyings = []
+            for date in dates:
+                roll = date + pd.offsets.MonthBegin(2) if date.day >= 15 else date + pd.offsets.MonthBegin(1)
+                month = roll.strftime("%y%m")
+                # 郑商所合约月份为3位
+                underlyings.append("%s.%s%s" % (exchange, code, month[1:] if exchange == "CZCE" else month))
+            df[cont_symbol] = underlyings
+        return df
+
+    def wait_update(self, deadline: float = None) -> bool:
+        """没有行情推送，短暂等待(不超过deadline)后返回False"""
+        if deadline is not None:
+            time.sleep(max(0.0, min(deadline - time.time(), self.latency or 0.01)))
+        return False
+
+    def close(self):
+        self.closed = True
+
+
+if __name__ == '__main__':
+    api = FakeTqApi(latency=0.01, history_length=5, end=datetime(2022, 11, 1, 14, 59))
+    print(api.get_kline_serial("SHFE.rb2301", 60, data_length=8))
+    print(api.query_his_cont_quotes(["KQ.m@SHFE.rb", "KQ.m@CZCE.TA"], n=10))
+    api.close()
@@ -5,33 +5,56 @@ from util.message_alert import ding_message
 from util.vt_symbol_util import split_vnpy_format, split_tq_format, concat_vnpy_format
 
 
+# 查询主连历史对应合约的天数
+CONT_QUOTES_DAYS = 10
+# 当前主力合约在最近CONT_QUOTES_DAYS天中出现不超过该天数，视为刚刚换月
+FIRST_CHANGE_DAYS = 5
+
+
+def get_tq_main_symbol(vt_symbol: str) -> str:
+    """vnpy格式合约对应的天勤主连代码，如rb2301.SHFE -> KQ.m@SHFE.rb"""
+    exchange, code, month = split_vnpy_format(vt_symbol)
+    return "KQ.m@%s.%s" % (exchange, code)
+
+
+def check_main_contracts(vt_symbols, tq_api: TqApi, n: int = CONT_QUOTES_DAYS) -> dict:
+    """
+    一次请求查询全部品种的主连历史对应合约，并批量判断是否换月
+    :return: {vt_symbol: (当前主力合约, 是否与vt_symbol相同, 是否刚刚换月)}
+    """
+    vt_symbols = list(vt_symbols)
+    if len(vt_symbols) < 1:
+        return {}
+    main_symbols = {vt_symbol: get_tq_main_symbol(vt_symbol) for vt_symbol in vt_symbols}
+    columns = list(dict.fromkeys(main_symbols.values()))
+    df = tq_api.query_his_cont_quotes(symbol=columns, n=n)[columns]
+    current = df.iloc[-1]
+    # 各品种当前主力合约在最近n天中出现的天数
+    counts = (df == current).sum()
+    result = {}
+    for vt_symbol, main_symbol in main_symbols.items():
+        exchange, code, month = split_tq_format(current[main_symbol])
+        vnpy_format_vt_symbol = concat_vnpy_format(exchange, code, month)
+        # this param is used to recommend the k-line downloader to get a large size of data for init
+        change_of_first_time = bool(counts[main_symbol] <= FIRST_CHANGE_DAYS)
+        result[vt_symbol] = (vnpy_format_vt_symbol, vt_symbol == vnpy_format_vt_symbol, change_of_first_time)
+    return result
+
+
 def check_current_main_contract(vnpy_format_vt_symbol_now: str, tq_api: TqApi):
     """:returns current_main_contract, input param is current_main_contract, whether this change happens today"""
-    vt_symbol = vnpy_format_vt_symbol_now
-    exchange, code, month = split_vnpy_format(vt_symbol)
-    n = 10
-    tq_internal_main_vt_symbol = "KQ.m@%s.%s" % (exchange, code)
-    df = tq_api.query_his_cont_quotes(symbol=[tq_internal_main_vt_symbol], n=n)
-    origin_tq_vt_symbol = df.iloc[n - 1][tq_internal_main_vt_symbol]
-    exchange, code, month = split_tq_format(origin_tq_vt_symbol)
-    vnpy_format_vt_symbol = concat_vnpy_format(exchange, code, month)
-    # print(vnpy_format_vt_symbol)
-    # count to show current main contract changes the first time
-    count = df[tq_internal_main_vt_symbol].value_counts()[origin_tq_vt_symbol]
-    # this param is used to recommend the k-line downloader to get a large size of data for init
-    change_of_first_time = count <= 5
-    is_the_same = vnpy_format_vt_symbol_now == vnpy_format_vt_symbol
-    # print(count)
-    return vnpy_format_vt_symbol, is_the_same, change_of_first_time
+    return check_main_contracts([vnpy_format_vt_symbol_now], tq_api)[vnpy_format_vt_symbol_now]
 
 
-def get_main_contract(vt_symbols, include_the_same=False):
-    tq_api = TqApi(auth=TqAuth(AccountConfig.tq_acct, AccountConfig.tq_pass))
+def get_main_contract(vt_symbols, include_the_same=False, tq_api: TqApi = None):
+    """:param tq_api: 复用已登录的TqApi，为None时临时创建并在结束后关闭"""
+    own_api = tq_api is None
+    if own_api:
+        tq_api = TqApi(auth=TqAuth(AccountConfig.tq_acct, AccountConfig.tq_pass))
     try:
         main_contract_map = {}
-        for vt_symbol in vt_symbols:
-            new_main_contract_vt_symbol, is_the_same, change_of_first_time = check_current_main_contract(vt_symbol,
-                                                                                                         tq_api)
+        for vt_symbol, (new_main_contract_vt_symbol, is_the_same, change_of_first_time) in \
+                check_main_contracts(vt_symbols, tq_api).items():
             if is_the_same and not include_the_same:
                 continue
             main_contract_map[vt_symbol] = new_main_contract_vt_symbol
@@ -39,17 +62,21 @@ def get_main_contract(vt_symbols, include_the_same=False):
         ding_message("get_main_contract异常,%s" % e)
         raise e
     finally:
-        tq_api.close()
+        if own_api:
+            tq_api.close()
     return main_contract_map
 
 
-def check_all_symbol_main_contract(vt_symbols):
-    tq_api = TqApi(auth=TqAuth(AccountConfig.tq_acct, AccountConfig.tq_pass))
+def check_all_symbol_main_contract(vt_symbols, tq_api: TqApi = None):
+    """:param tq_api: 复用已登录的TqApi，为None时临时创建并在结束后关闭"""
+    own_api = tq_api is None
+    if own_api:
+        tq_api = TqApi(auth=TqAuth(AccountConfig.tq_acct, AccountConfig.tq_pass))
     try:
         new_codes = []
         existed_new_codes = []
-        for vt_symbol in vt_symbols:
-            vnpy_format_vt_symbol, is_the_same, change_of_first_time = check_current_main_contract(vt_symbol, tq_api)
+        for vnpy_format_vt_symbol, is_the_same, change_of_first_time in \
+                check_main_contracts(vt_symbols, tq_api).values():
             if is_the_same:
                 continue
             if change_of_first_time:
@@ -60,7 +87,8 @@ def check_all_symbol_main_contract(vt_symbols):
         ding_message("check_all_symbol_main_contract异常,%s" % e)
         raise e
     finally:
-        tq_api.close()
+        if own_api:
+            tq_api.close()
     return new_codes, existed_new_codes
 
 
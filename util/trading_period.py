@@ -1,4 +1,4 @@
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
 
 TRADE_DAY_START_1 = time(9, 00)
 TRADE_DAY_END_1 = time(11, 31)
@@ -26,3 +26,76 @@ def check_real_trading_period(current: datetime = None):
         trading = True
 
     return trading
+
+
+# 各品种交易时段的并集(含中金所9:30-15:15及各夜盘)，仅用于估算k线数量的上限
+SESSION_SUPERSET = [(time(8, 59), time(15, 16)), (time(20, 59), time(23, 59, 59)), (time(0, 0), time(2, 31))]
+
+
+def estimate_trading_minutes(start: datetime, end: datetime = None, limit: int = None) -> int:
+    """估算[start, end]之间最多可能产生的分钟k线数量，宁多勿少，超过limit时直接返回limit"""
+    if end is None:
+        end = datetime.now()
+    if start is None or start >= end:
+        return 0
+    total = 0
+    day = start.date()
+    while day <= end.date():
+        weekday = day.weekday()
+        for session_start, session_end in SESSION_SUPERSET:
+            # 周六仅有周五夜盘延续到凌晨的部分，周日无交易，周一凌晨无夜盘
+            if weekday == 6 or (weekday == 5 and session_start != time(0, 0)) \
+                    or (weekday == 0 and session_start == time(0, 0)):
+                continue
+            period_start = max(start, datetime.combine(day, session_start))
+            period_end = min(end, datetime.combine(day, session_end))
+            if period_end > period_start:
+                total += int((period_end - period_start).total_seconds() // 60) + 1
+        if limit is not None and total >= limit:
+            return limit
+        day += timedelta(days=1)
+    return total if limit is None else min(total, limit)
+
+
+# 交易日切换时间，之后的夜盘属于下一个交易日
+TRADING_DAY_START = time(17, 0)
+
+
+def get_trading_day(dt: datetime):
+    """返回dt所属的交易日，夜盘归属下一个交易日，周五夜盘归属下周一，不考虑节假日"""
+    day = dt.date()
+    if dt.time() >= TRADING_DAY_START:
+        day += timedelta(days=1)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return day
+
+
+def get_trading_day_range(day):
+    """:return: 交易日day包含的时间范围[start, end)，从前一个工作日17:00开始"""
+    start = day - timedelta(days=1)
+    while start.weekday() >= 5:
+        start -= timedelta(days=1)
+    return datetime.combine(start, TRADING_DAY_START), datetime.combine(day, TRADING_DAY_START)
+
+
+def get_days_of_current_trading_day(now: datetime = None) -> int:
+    """覆盖当前交易日(含前一晚夜盘)所需回溯的自然日数，用于load_bar只回放当前交易日"""
+    now = now if now is not None else datetime.now()
+    start = get_trading_day_range(get_trading_day(now))[0]
+    return (now.date() - start.date()).days + 1
+
+
+# 分钟k线(以k线开始时间标记)所在的交易时段，结束时间不含。夜盘按最晚的2:30计算，各品种夜盘结束时间不同
+COMMODITY_SESSIONS = [(time(21, 0), time(2, 30)), (time(9, 0), time(11, 30)), (time(13, 30), time(15, 0))]
+# 商品期货上午10:15-10:30小节休息
+COMMODITY_BREAKS = [(time(10, 15), time(10, 30))]
+# 中金所股指及国债期货，国债期货下午收盘为15:15
+CFFEX_SESSIONS = [(time(9, 30), time(11, 30)), (time(13, 0), time(15, 15))]
+
+
+def get_trading_sessions(exchange: str):
+    """:return: 交易所对应的(交易时段列表, 休息时段列表)"""
+    if exchange == "CFFEX":
+        return CFFEX_SESSIONS, []
+    return COMMODITY_SESSIONS, COMMODITY_BREAKS